@@ -17,6 +17,7 @@ from optparse import OptionParser
 
 from .warctools import ArcRecord,WarcRecord, MixedRecord, expand_files
 from .warctools.warc import warc_datetime_str
+from .warctools.writer import WarcWriter, ParallelWarcWriter
 
 from .httptools import ResponseMessage, RequestMessage
 
@@ -26,6 +27,8 @@ parser.add_option("-o", "--output", dest="output",
                        help="output warc file")
 parser.add_option("-l", "--limit", dest="limit")
 parser.add_option("-Z", "--gzip", dest="gzip", action="store_true", help="compress")
+parser.add_option("--compress-level", dest="compress_level", type="int", help="gzip level, 1 (fastest) to 9 (smallest)")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", help="with -Z, compress in this many threads")
 parser.add_option("-L", "--log-level", dest="log_level")
 parser.add_option("--description", dest="description")
 parser.add_option("--operator", dest="operator")
@@ -35,7 +38,7 @@ parser.add_option("--resource", dest="resource", action="append")
 parser.add_option("--response", dest="response", action="append")
 
 parser.set_defaults(
-    output_directory=None, limit=None, log_level="info", gzip=False,
+    output_directory=None, limit=None, log_level="info", gzip=False, compress_level=9, jobs=1,
     description="", operator="", publisher="", audience="",
     resource = [], response=[],
     
@@ -215,6 +218,10 @@ def main(argv):
         audience = options.audience,
     )
     arc = ArcTransformer(options.output, warcinfo, options.resource, options.response)
+    if options.gzip and options.jobs > 1:
+        writer = ParallelWarcWriter(out, options.jobs, compress_level=options.compress_level)
+    else:
+        writer = WarcWriter(out, gzip=options.gzip, compress_level=options.compress_level)
     for name in expand_files(input_files):
         fh = MixedRecord.open_archive(filename=name, gzip="auto")
         try:
@@ -227,9 +234,10 @@ def main(argv):
                     warcs = arc.convert(record)
 
                 for warcrecord in warcs:
-                    warcrecord.write_to(out, gzip=options.gzip)
+                    writer.write(warcrecord)
         finally:
             fh.close()
+            writer.flush()
 
     return 0
 
@@ -12,6 +12,8 @@ import os.path
 from optparse import OptionParser
 
 from .warctools import WarcRecord, expand_files
+from .warctools.writer import WarcWriter, ParallelWarcWriter
+from .warctools.compress import COMPRESS_LEVEL
 from .httptools import RequestMessage, ResponseMessage
 
 parser = OptionParser(usage="%prog [options] url (url ...)")
@@ -21,16 +23,20 @@ parser.add_option("-o", "--output", dest="output",
 parser.add_option("-l", "--limit", dest="limit")
 parser.add_option("-I", "--input", dest="input_format", help="(ignored)")
 parser.add_option("-Z", "--gzip", dest="gzip", action="store_true", help="compress output, record by record")
+parser.add_option("--compress-level", dest="compress_level", type="int", help="gzip level, 1 (fastest) to 9 (smallest), recompressing gzipped records that would otherwise be copied as they are")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", help="with -Z, compress in this many threads")
 parser.add_option("-D", "--decode_http", dest="decode_http", action="store_true", help="decode http messages (strip chunks, gzip)")
 parser.add_option("-L", "--log-level", dest="log_level")
+parser.add_option("-P", "--prefetch", dest="prefetch", action="store_true", help="read and decompress input in a background thread")
 parser.add_option("--wget-chunk-fix", dest="wget_workaround", action="store_true", help="skip transfer-encoding headers in http records, when decoding them (-D)")
 
-parser.set_defaults(output_directory=None, limit=None, log_level="info", gzip=False, decode_http=False, wget_workaround=False)
+parser.set_defaults(output_directory=None, limit=None, log_level="info", gzip=False, decode_http=False, wget_workaround=False, prefetch=False,
+                    compress_level=None, jobs=1)
 
 
 WGET_IGNORE_HEADERS = ['Transfer-Encoding']
 
-def process(record, out, options):
+def process(record, writer, options):
     ignore_headers = WGET_IGNORE_HEADERS if options.wget_workaround else ()
     if options.decode_http:
         if record.type == WarcRecord.RESPONSE:
@@ -58,7 +64,31 @@ def process(record, out, options):
                         error.append("incomplete message (at %s, %s)"%(message.mode, message.header.mode))
                     print('errors decoding http in record', record.id, ",".join(error), file=sys.stderr)
 
-    record.write_to(out, gzip=options.gzip)
+    writer.write(record)
+
+def copy_raw(fh, options):
+    """Can records be copied from fh as they are? Only if they aren't to be
+    changed, or compressed differently."""
+    return (fh.raw_file is not None and not options.decode_http
+            and options.compress_level is None
+            and fh.raw_gzip == bool(options.gzip))
+
+def process_archive(fh, writer, options):
+    raw = copy_raw(fh, options)
+    for offset, record, errors in fh.read_records(limit=None, offsets=raw):
+        if not record:
+            if errors:
+                error_str = ",".join(str(error) for error in errors)
+                raise Exception("Errors while decoding %s" % error_str)
+            break
+        if raw and not record.errors:
+            # only records that process() would write out the same, with no
+            # errors to mend and the usual trailer
+            length = fh.raw_length(offset, record.TRAILER)
+            if length is not None:
+                writer.write_raw(fh.raw_file, offset, length)
+                continue
+        process(record, writer, options)
 
 def main(argv):
     (options, input_files) = parser.parse_args(args=argv[1:])
@@ -68,19 +98,24 @@ def main(argv):
     except AttributeError: # python2
         out = sys.stdout
 
-    if len(input_files) < 1:
-        fh = WarcRecord.open_archive(file_handle=sys.stdin, gzip=None)
-
-        for record in fh:
-            process(record, out, options)
+    compress_level = options.compress_level
+    if compress_level is None:
+        compress_level = COMPRESS_LEVEL
+    if options.gzip and options.jobs > 1:
+        writer = ParallelWarcWriter(out, options.jobs, compress_level=compress_level)
     else:
-        for name in expand_files(input_files):
-            fh = WarcRecord.open_archive(name, gzip="auto")
-            for record in fh:
-                process(record, out, options)
-
-            fh.close()
-
+        writer = WarcWriter(out, gzip=options.gzip, compress_level=compress_level)
+    try:
+        if len(input_files) < 1:
+            fh = WarcRecord.open_archive(file_handle=sys.stdin, gzip=None, prefetch=options.prefetch)
+            process_archive(fh, writer, options)
+        else:
+            for name in expand_files(input_files):
+                fh = WarcRecord.open_archive(name, gzip="auto", prefetch=options.prefetch)
+                process_archive(fh, writer, options)
+                fh.close()
+    finally:
+        writer.flush()
 
 
     return 0
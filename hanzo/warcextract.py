@@ -6,19 +6,26 @@ from __future__ import print_function
 import os
 import sys
 
-import sys
-import os.path
-
 from optparse import OptionParser
 from contextlib import closing
 
 from .warctools import WarcRecord
+from .warctools.memberindex import load_member_index
+from .warctools.index import SortedIndex, line_location
 
-parser = OptionParser(usage="%prog [options] warc offset")
+parser = OptionParser(usage="%prog [options] warc offset\n       %prog -x INDEX [-t TIMESTAMP] url")
 
 #parser.add_option("-l", "--limit", dest="limit")
 parser.add_option("-I", "--input", dest="input_format")
 parser.add_option("-L", "--log-level", dest="log_level")
+parser.add_option("-n", "--record-number", dest="record_number", type="int",
+                  help="dump the Nth record (from 0), found with the file's member index")
+parser.add_option("-i", "--record-id", dest="record_id",
+                  help="dump the record with this WARC-Record-ID, found with the file's member index")
+parser.add_option("-x", "--index", dest="index",
+                  help="dump the latest record of the url given, found in this sorted index (see warcindex -S)")
+parser.add_option("-t", "--timestamp", dest="timestamp",
+                  help="with --index, the latest record at or before this timestamp, e.g. 2013 or 20131115")
 
 parser.set_defaults(output_directory=None, limit=None, log_level="info")
 
@@ -33,31 +40,86 @@ def main(argv):
     if len(args) < 1:
         # dump the first record on stdin
         with closing(WarcRecord.open_archive(file_handle=sys.stdin, gzip=None)) as fh:
-            dump_record(fh, out)
+            dump_record(fh, out, '-')
         
     else:
         # dump a record from the filename, with optional offset
         filename = args[0]
-        if len(args) > 1:
+        member_index = None
+        skip = 0
+        if options.index is not None:
+            filename, offset, length = find_url(parser, args[0], options)
+        elif options.record_number is not None or options.record_id is not None:
+            member_index, entry = find_record(parser, filename, options)
+            offset, skip = entry.offset, entry.skip
+        elif len(args) > 1:
             offset = int(args[1])
         else:
             offset = 0
 
-        with closing(WarcRecord.open_archive(filename=filename, gzip="auto")) as fh:
+        with closing(WarcRecord.open_archive(filename=filename, gzip="auto",
+                                             member_index=member_index)) as fh:
             fh.seek(offset)
-            dump_record(fh, out)
+            skip_records(fh, skip)
+            dump_record(fh, out, filename, offset)
 
 
     return 0
 
-def dump_record(fh, out):
-    for (offset, record, errors) in fh.read_records(limit=1, offsets=False):
+def find_record(parser, filename, options):
+    """Returns the member index of filename, and the entry of the record
+    selected by --record-number or --record-id."""
+    member_index = load_member_index(filename)
+    if member_index is None:
+        parser.error("no up to date member index for %s, make one with warcindex --member-index" % filename)
+
+    if options.record_number is not None:
+        entry = member_index.lookup(options.record_number)
+    else:
+        entry = member_index.lookup(options.record_id)
+    if entry is None:
+        parser.error("no such record in %s" % filename)
+
+    return member_index, entry
+
+def skip_records(fh, count):
+    """Read past count records, e.g. those before the one wanted in a gzip
+    member they share."""
+    for (offset, record, errors) in fh.read_records(limit=count, offsets=False):
+        if not record:
+            raise Exception("record not found, the member index may be out of date")
+
+def find_url(parser, url, options):
+    """Returns the filename, offset and length (None if not known) of the
+    latest record of url in the sorted index given by --index, up to
+    --timestamp. A relative filename is taken to be in the directory of
+    the index, unless there is such a file in the current directory."""
+    timestamp = options.timestamp.encode('ascii') if options.timestamp else None
+    try:
+        with closing(SortedIndex(options.index)) as index:
+            line = None
+            for line in index.lookup(url.encode('utf-8'), to_timestamp=timestamp):
+                pass
+    except (IOError, OSError) as e:
+        parser.error("can't read index %s: %s" % (options.index, e))
+    if line is None:
+        parser.error("no record of %s in %s" % (url, options.index))
+
+    filename, offset, length = line_location(line)
+    if not os.path.isabs(filename) and not os.path.exists(filename):
+        filename = os.path.join(os.path.dirname(options.index), filename)
+    return filename, offset, length
+
+def dump_record(fh, out, name, offset=0):
+    """Write the content of the next record in fh, or the errors reading
+    it, from offset in file name."""
+    for (_, record, errors) in fh.read_records(limit=1, offsets=False):
         if record:
             out.write(record.content[1])
         elif errors:
-            print("warc errors at %s:%d"%(name, offset if offset else 0), file=sys.stderr)
+            print("warc errors at %s:%d"%(name, offset), file=sys.stderr)
             for e in errors:
-                print('\t', e)
+                print('\t', e, file=sys.stderr)
         break # only use one (I'm terrible)
 
 
@@ -9,7 +9,10 @@ import re
 from optparse import OptionParser
 
 from .warctools import WarcRecord, expand_files
+from .warctools.memberindex import load_member_index
+from .warctools.writer import WarcWriter
 from .httptools import RequestMessage, ResponseMessage
+from .warcindex import INDEX_HEADER, index_line
 
 parser = OptionParser(usage="%prog [options] pattern warc warc warc")
 
@@ -22,8 +25,14 @@ parser.add_option("-C", "--content-type", dest="content_type",action="store_true
 parser.add_option("-H", "--http-content-type", dest="http_content_type",action="store_true", help="match on http payload content type")
 parser.add_option("-D", "--warc-date", dest="warc_date",action="store_true", help="match on WARC-Date header")
 parser.add_option("-L", "--log-level", dest="log_level", help="log level(ignored)")
+parser.add_option("-P", "--prefetch", dest="prefetch", action="store_true", help="read and decompress input in a background thread")
+parser.add_option("-R", "--raw", dest="raw", action="store_true",
+                  help="copy matching records as they are in the input, still gzipped if it is record-gzipped")
+parser.add_option("--headers-only", dest="headers_only", action="store_true",
+                  help="match on headers alone, skipping payloads, and print a warcindex line for each match")
 
-parser.set_defaults(output_directory=None, limit=None, log_level="info", invert=False, url=None, content_type=None, type=None)
+parser.set_defaults(output_directory=None, limit=None, log_level="info", invert=False, url=None, content_type=None, type=None, prefetch=False,
+                    headers_only=False, raw=False)
 
 def parse_http_response(record):
     message = ResponseMessage(RequestMessage())
@@ -62,13 +71,28 @@ def main(argv):
 
     invert = options.invert
     pattern = re.compile(pattern)
+    if options.headers_only:
+        if options.http_content_type:
+            parser.error("--headers-only cannot match on http payloads")
+        if options.raw:
+            parser.error("--headers-only writes index lines, not records")
+        out.write(INDEX_HEADER)
     if not input_files:
-            fh = WarcRecord.open_archive(file_handle=sys.stdin, gzip=None)
-            filter_archive(fh, options, pattern, out)
+            fh = WarcRecord.open_archive(file_handle=sys.stdin, gzip=None, prefetch=options.prefetch)
+            if options.headers_only:
+                filter_headers(fh, '-', options, pattern, out)
+            else:
+                filter_archive(fh, options, pattern, out)
     else:
         for name in expand_files(input_files):
-            fh = WarcRecord.open_archive(name, gzip="auto")
-            filter_archive(fh, options, pattern,out)
+            # records that don't match are skipped, by member index if there is one
+            member_index = None if name.startswith('s3://') else load_member_index(name)
+            fh = WarcRecord.open_archive(name, gzip="auto", prefetch=options.prefetch,
+                                         member_index=member_index)
+            if options.headers_only:
+                filter_headers(fh, name, options, pattern, out)
+            else:
+                filter_archive(fh, options, pattern,out)
             fh.close()
 
 
@@ -76,30 +100,60 @@ def main(argv):
     return 0
 
 def filter_archive(fh, options, pattern, out):
+        if options.raw:
+            writer = WarcWriter(out, gzip=fh.raw_gzip)
+            try:
+                _filter_archive(fh, options, pattern, writer.write_raw, writer.write)
+            finally:
+                writer.flush()
+        else:
+            _filter_archive(fh, options, pattern, None, lambda record: record.write_to(out))
+
+def _filter_archive(fh, options, pattern, write_raw, write_record):
+        """Write each record that matches with write_record, or copy it
+        verbatim with write_raw, when given and the stream can, and the
+        record is as write_record would write it."""
         invert = options.invert
-        for record in fh:
+        raw_file = fh.raw_file if write_raw else None
+
+        def write(record, offset):
+            if raw_file is not None and not record.errors:
+                length = fh.raw_length(offset, record.TRAILER)
+                if length is not None:
+                    write_raw(raw_file, offset, length)
+                    return
+            write_record(record)
+
+        records = fh.read_records(limit=None, offsets=raw_file is not None)
+        for offset, record, errors in records:
+            if not record:
+                if errors:
+                    error_str = ",".join(str(error) for error in errors)
+                    raise Exception("Errors while decoding %s" % error_str)
+                break
+
             if options.url:
                 if bool(record.url and pattern.search(record.url)) ^ invert :
-                    record.write_to(out)
+                    write(record, offset)
 
             elif options.type:
                 if bool(record.type and pattern.search(record.type)) ^ invert:
-                    record.write_to(out)
+                    write(record, offset)
 
             elif options.content_type:
                 if bool(record.content_type and pattern.search(record.content_type)) ^ invert:
-                    record.write_to(out)
+                    write(record, offset)
 
             elif options.http_content_type:
                 if record.type == WarcRecord.RESPONSE and record.content_type.startswith(b'application/http'):
                     code, content_type, message = parse_http_response(record)
 
                     if bool(content_type and pattern.search(content_type)) ^ invert:
-                        record.write_to(out)
+                        write(record, offset)
 
             elif options.warc_date:
                 if bool(record.date and pattern.search(record.date)) ^ invert:
-                    record.write_to(out)
+                    write(record, offset)
 
             else:
                 found = False
@@ -114,7 +168,32 @@ def filter_archive(fh, options, pattern, out):
                         
 
                 if found ^ invert:
-                    record.write_to(out)
+                    write(record, offset)
+
+
+def filter_headers(fh, name, options, pattern, out):
+        """Like filter_archive, but without reading any payloads: writes
+        the warcindex line of each record whose headers match."""
+        invert = options.invert
+        for record in fh.scan():
+            if options.url:
+                value = record.url
+            elif options.type:
+                value = record.type
+            elif options.content_type:
+                value = record.content_type
+            elif options.warc_date:
+                value = record.date
+            else:
+                value = None
+
+            if options.url or options.type or options.content_type or options.warc_date:
+                found = bool(value and pattern.search(value))
+            else:
+                found = any(pattern.search(v) for k, v in record.headers)
+
+            if found ^ invert:
+                out.write(index_line(name, record))
 
 
 def run():
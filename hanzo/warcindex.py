@@ -6,20 +6,50 @@ import sys
 
 import sys
 import os.path
+import collections
+import io
+import itertools
+import tempfile
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from optparse import OptionParser
 
-from .warctools import WarcRecord, expand_files
+from .warctools import WarcRecord, RecordHeaderView, expand_files
+from .warctools.filecopy import copy_file
+from .warctools.cdx import FORMATS, index_records, write_index_lines, read_http_head
+from .warctools.index import LineSorter, write_index
+from .warctools.incremental import STATE_SUFFIX, resume_state, scan_new
+from .warctools.memberindex import write_member_index
+from .warctools.zran import NotWholeGzip, write_checkpoints
 
 parser = OptionParser(usage="%prog [options] warc warc warc")
 
 parser.add_option("-l", "--limit", dest="limit")
-parser.add_option("-O", "--output-format", dest="output_format", help="output format (ignored)")
-parser.add_option("-o", "--output", dest="output_format", help="output file (ignored)")
+parser.add_option("-O", "--output-format", dest="output_format", choices=['warcindex'] + sorted(FORMATS),
+                  help="warcindex (the default), cdx11 or cdxj")
+parser.add_option("-o", "--output", dest="output", help="output file (ignored)")
 
 parser.add_option("-L", "--log-level", dest="log_level")
+parser.add_option("-P", "--prefetch", dest="prefetch", action="store_true", help="read and decompress input in a background thread")
+parser.add_option("-M", "--member-index", dest="member_index", action="store_true",
+                  help="write a .idx member index next to each input file, for warcextract and warcpayload")
+parser.add_option("-G", "--gzip-checkpoints", dest="checkpoints", action="store_true",
+                  help="write a .zran checkpoint file next to each input file gzipped as a whole, for random access to it")
+parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                  help="index this many files at once, in separate processes")
+parser.add_option("-S", "--sorted-index", dest="sorted_index",
+                  help="write a sorted, block compressed index of the input files to SORTED_INDEX.idx and shards next to it, in cdxj format unless -O cdx11, for warcextract and warcpayload --index")
+parser.add_option("--unordered", dest="unordered", action="store_true",
+                  help="with -j, write each file's lines as soon as it is done, rather than in the order the files were given")
+parser.add_option("-u", "--incremental", dest="incremental", action="store_true",
+                  help="only index records added since the last run with -u, keeping a .state file for each input file")
+parser.add_option("--state-dir", dest="state_dir",
+                  help="with -u, keep the state files in this directory rather than next to the input files")
 
-parser.set_defaults(output=None, limit=None, log_level="info")
+parser.set_defaults(output=None, limit=None, log_level="info", member_index=False,
+                    checkpoints=False, prefetch=False, jobs=1, unordered=False,
+                    output_format='warcindex', sorted_index=None, incremental=False,
+                    state_dir=None)
 
 def main(argv):
     (options, input_files) = parser.parse_args(args=argv[1:])
@@ -31,35 +61,254 @@ def main(argv):
 
     if len(input_files) < 1:
         parser.error("no imput warc file(s)")
-        
-    out.write(b'#WARC filename offset warc-type warc-subject-uri warc-record-id content-type content-length\n')
-    for name in expand_files(input_files):
-        fh = WarcRecord.open_archive(name, gzip="auto")
+    if options.incremental:
+        if options.sorted_index:
+            parser.error("-u can't be used with -S, which indexes everything at once")
+        if any(name.startswith('s3:') for name in input_files):
+            parser.error("-u only works with local files")
 
+    names = expand_files(input_files)
+    if options.checkpoints or options.member_index:
+        args = ((name, options.checkpoints, options.member_index) for name in names)
         try:
-            for (offset, record, errors) in fh.read_records(limit=None):
-                if record:
-                    fields = [name.encode('utf-8'), 
-                            str(offset).encode('utf-8'),
-                            record.type or b'-', 
-                            record.url or b'-', 
-                            record.id or b'-', 
-                            record.content_type or b'-',
-                            str(record.content_length).encode('utf-8')]
-                    out.write(b' '.join(fields) + b'\n')
-                elif errors:
+            if options.jobs > 1:
+                for _ in imap_files(write_sidecars, args, options.jobs):
                     pass
-                    # ignore
-                else:
-                    pass
-                    # no errors at tail
+            else:
+                for arg in args:
+                    write_sidecars(*arg)
+        except NotWholeGzip as e:
+            parser.error("-G only works with files gzipped as a whole (%s)" % e)
+        return 0
 
-        finally:
-            fh.close()
+    sorter = None
+    if options.sorted_index:
+        if options.output_format == 'warcindex':
+            options.output_format = 'cdxj'
+        out = sorter = LineSorter()
+        options.unordered = True
+    else:
+        if options.incremental:
+            # lines are added to those of earlier runs, so the header only
+            # goes before those of the first, when no file has a state yet
+            names = list(names)
+            first_run = not any(os.path.exists(state_file(name, options)) for name in names)
+        if not options.incremental or first_run:
+            if options.output_format == 'warcindex':
+                out.write(INDEX_HEADER)
+            else:
+                out.write(FORMATS[options.output_format].header)
 
+    # with -u, a file's state is saved once its lines are written out
+    if options.jobs > 1:
+        args = ((name, options.prefetch, options.output_format,
+                 state_file(name, options)) for name in names)
+        for result, state in imap_files(spool_index, args, options.jobs,
+                                        ordered=not options.unordered,
+                                        discard=discard_spool):
+            write_spool(result, out)
+            save_state(state, out)
+    else:
+        for name in names:
+            state = index_file(name, out, options.prefetch, options.output_format,
+                               state_file(name, options))
+            save_state(state, out)
+
+    if sorter is not None:
+        write_index(sorter.sorted(), options.sorted_index)
     return 0
 
 
+def state_file(name, options):
+    """Where -u keeps the state of file name, e.g. mywarc.warc.gz.cdxj.state,
+    or None without -u."""
+    if not options.incremental:
+        return None
+    path = name + '.' + options.output_format + STATE_SUFFIX
+    if options.state_dir:
+        path = os.path.join(options.state_dir, os.path.basename(path))
+    return path
+
+
+def save_state(state, out):
+    if state is not None:
+        out.flush()
+        state.save()
+
+
+def index_file(name, out, prefetch=False, output_format='warcindex', state_path=None):
+    """Write the warcindex lines of the records in file name to out, or
+    its lines in one of cdx.FORMATS. With state_path, only the records
+    after those indexed when the state there was saved are, and the new
+    incremental.IndexState is returned, to be saved once out has the lines
+    (None if the file hasn't changed)."""
+    if state_path is not None:
+        return index_new(name, out, prefetch, output_format, state_path)
+
+    fh = WarcRecord.open_archive(name, gzip="auto", prefetch=prefetch)
+
+    try:
+        if output_format != 'warcindex':
+            index_records(fh, name, FORMATS[output_format], out)
+            return
+        for (offset, length, payload_offset, payload_length, headers, errors) in fh.read_headers():
+            if headers is not None:
+                record = RecordHeaderView(WarcRecord, headers, errors, offset,
+                                          length, payload_offset, payload_length)
+                out.write(index_line(name, record))
+            elif errors:
+                pass
+                # ignore
+            else:
+                pass
+                # no errors at tail
+
+    finally:
+        fh.close()
+
+
+def index_new(name, out, prefetch, output_format, state_path):
+    state = resume_state(state_path, os.stat(name))
+    if state is None:
+        return None
+    if state.offset >= state.size:
+        return state
+
+    fh = WarcRecord.open_archive(name, gzip="auto", offset=state.offset or None,
+                                 prefetch=prefetch)
+    try:
+        if output_format != 'warcindex':
+            index_format = FORMATS[output_format]
+            head = read_http_head if index_format.http_head else None
+            write_index_lines(scan_new(fh, state, head), name, index_format, out)
+        else:
+            for record in scan_new(fh, state):
+                out.write(index_line(name, record))
+    finally:
+        fh.close()
+    return state
+
+
+def write_sidecars(name, checkpoints, member_index):
+    if checkpoints:
+        write_checkpoints(name)
+    if member_index:
+        write_member_index(name)
+
+
+SPOOL_SIZE = 1 << 20
+
+class Spool(object):
+    """Holds what is written to it in memory, until there is more than
+    size bytes, and then in a temporary file."""
+    def __init__(self, size=SPOOL_SIZE):
+        self.size = size
+        self.buf = io.BytesIO()
+        self.file = None
+
+    def write(self, data):
+        if self.file is None and self.buf.tell() + len(data) > self.size:
+            self.file = tempfile.NamedTemporaryFile(prefix='warcindex-', delete=False)
+            self.file.write(self.buf.getvalue())
+            self.buf = None
+        (self.buf if self.file is None else self.file).write(data)
+
+    def result(self):
+        """(data, None), or (None, path) of the temporary file, which the
+        caller deletes."""
+        if self.file is None:
+            return self.buf.getvalue(), None
+        self.file.close()
+        return None, self.file.name
+
+
+def spool_index(name, prefetch=False, output_format='warcindex', state_path=None):
+    """index_file in a worker process, returning its lines as
+    Spool.result() does, so a big file's lines don't pile up in memory,
+    here or in the parent, while earlier files are written out, along with
+    what index_file returns."""
+    spool = Spool()
+    try:
+        state = index_file(name, spool, prefetch, output_format, state_path)
+    except:
+        discard_spool((spool.result(), None))
+        raise
+    return spool.result(), state
+
+
+def write_spool(result, out):
+    data, path = result
+    if path is None:
+        out.write(data)
+        return
+    try:
+        with open(path, 'rb') as f:
+            copy_file(f, out)
+    finally:
+        os.unlink(path)
+
+
+def discard_spool(result):
+    path = result[0][1]
+    if path is not None:
+        os.unlink(path)
+
+
+def imap_files(fn, args, jobs, ordered=True, discard=None):
+    """Yield fn(*arg) for each of args, called in a pool of jobs processes,
+    in order, or as they are done if not ordered. Only 2 * jobs calls are
+    in hand at once, so results don't pile up when one file takes longer
+    than the rest. discard is called on the results of calls left over if
+    the caller stops early or a call raises."""
+    args = iter(args)
+    pending = collections.deque()
+    done = collections.deque()
+    with ProcessPoolExecutor(jobs) as executor:
+        def submit(n):
+            for arg in itertools.islice(args, n):
+                pending.append(executor.submit(fn, *arg))
+
+        try:
+            submit(2 * jobs)
+            while pending:
+                if ordered:
+                    done.append(pending.popleft())
+                else:
+                    for future in wait(pending, return_when=FIRST_COMPLETED)[0]:
+                        pending.remove(future)
+                        done.append(future)
+                submit(len(done))
+                while done:
+                    yield done.popleft().result()
+        finally:
+            leftover = list(done) + list(pending)
+            for future in leftover:
+                future.cancel()
+            for future in leftover:
+                if not future.cancelled() and discard is not None:
+                    try:
+                        discard(future.result())
+                    except Exception:
+                        pass
+
+
+INDEX_HEADER = b'#WARC filename offset warc-type warc-subject-uri warc-record-id content-type content-length\n'
+
+def index_line(name, record):
+    """The warcindex line for a RecordHeaderView read from file name"""
+    content_length = record.content_length
+    if content_length is None:
+        content_length = record.payload_length
+    fields = [name.encode('utf-8'), 
+            str(record.offset).encode('utf-8'),
+            record.type or b'-', 
+            record.url or b'-', 
+            record.id or b'-', 
+            record.content_type or b'-',
+            str(content_length).encode('utf-8')]
+    return b' '.join(fields) + b'\n'
+
+
 def run():
     sys.exit(main(sys.argv))
 
@@ -14,14 +14,36 @@ from optparse import OptionParser
 from contextlib import closing
 
 from .warctools import WarcRecord
+from .warcextract import find_record, find_url, skip_records
 
-parser = OptionParser(usage="%prog warc:offset")
+parser = OptionParser(usage="%prog warc:offset\n       %prog [-n N | -i ID] warc\n       %prog -x INDEX [-t TIMESTAMP] url")
+
+parser.add_option("-n", "--record-number", dest="record_number", type="int",
+                  help="dump the payload of the Nth record (from 0), found with the file's member index")
+parser.add_option("-i", "--record-id", dest="record_id",
+                  help="dump the payload of the record with this WARC-Record-ID, found with the file's member index")
+parser.add_option("-x", "--index", dest="index",
+                  help="dump the payload of the latest record of the url given, found in this sorted index (see warcindex -S)")
+parser.add_option("-t", "--timestamp", dest="timestamp",
+                  help="with --index, the latest record at or before this timestamp, e.g. 2013 or 20131115")
 
 parser.set_defaults(output_directory=None, limit=None, log_level="info")
 
 def main(argv):
     (options, args) = parser.parse_args(args=argv[1:])
 
+    if options.index is not None:
+        filename, offset, length = find_url(parser, args[0], options)
+        dump_payload_from_file(filename, offset, length)
+        return
+
+    if options.record_number is not None or options.record_id is not None:
+        filename = args[0]
+        member_index, entry = find_record(parser, filename, options)
+        dump_payload_from_file(filename, entry.offset, entry.length, member_index,
+                               skip=entry.skip)
+        return
+
     filename, offset = args[0].rsplit(':',1)
     if ',' in offset:
         offset, length = [int(n) for n in offset.split(',',1)]
@@ -31,8 +53,12 @@ def main(argv):
 
     dump_payload_from_file(filename, offset, length)
 
-def dump_payload_from_file(filename, offset=None, length=None):
-    with closing(WarcRecord.open_archive(filename=filename, gzip="auto", offset=offset, length=length)) as fh:
+def dump_payload_from_file(filename, offset=None, length=None, member_index=None, skip=0):
+    """Dump the payload of the record at offset, or of the record skip
+    records after it, when records share a gzip member."""
+    with closing(WarcRecord.open_archive(filename=filename, gzip="auto", offset=offset, length=length,
+                                         member_index=member_index)) as fh:
+        skip_records(fh, skip)
         return dump_payload_from_stream(fh)
 
 def dump_payload_from_stream(fh):
@@ -1,9 +1,21 @@
-from .record import ArchiveRecord
+from .record import ArchiveRecord, RecordHeaderView
 from .warc import WarcRecord
 from .arc import ArcRecord
 from .mixed import MixedRecord
+from .memberindex import MemberIndex
 from .s3 import list_files
-from . import record, warc, arc, s3
+from . import record, warc, arc, s3, memberindex
+
+# imported when first used, as warctools.<name>, so that importing the
+# package doesn't pull in asyncio, ctypes, thread pools and the like
+LAZY_MODULES = ('zran', 'asyncstream', 'batch', 'digest', 'writer', 'compress',
+                'cdx', 'filecopy', 'index', 'incremental')
+
+def __getattr__(name):
+    if name in LAZY_MODULES:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 def expand_files(files):
     for file in files:
@@ -14,12 +26,25 @@ def expand_files(files):
             yield file
 
 __all__= [
+    'MemberIndex',
     'MixedRecord',
     'ArchiveRecord',
+    'RecordHeaderView',
     'ArcRecord',
     'WarcRecord',
     'record',
     'warc',
     'arc',
+    'memberindex',
+    'zran',
+    'asyncstream',
+    'batch',
+    'digest',
+    'writer',
+    'compress',
+    'cdx',
+    'filecopy',
+    'index',
+    'incremental',
     'expand_files',
 ]
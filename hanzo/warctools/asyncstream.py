@@ -0,0 +1,272 @@
+"""Read archive records from asyncio code.
+
+The record parsers are synchronous, so an AsyncRecordStream runs the
+RecordStream under it in an executor, a batch of records at a time, and
+reads the next batches while the caller is busy with this one. One event
+loop can then keep many archives moving at once:
+
+    stream = await asyncstream.open_archive(filename='foo.warc.gz')
+    async with stream:
+        async for record in stream:
+            ...
+
+A record's content is read in to memory before it is handed over if it
+would otherwise be read from the stream, as the stream has moved on by
+then.
+
+A remote archive can be read from any object with a coroutine read(n),
+such as an asyncio.StreamReader, by passing it as reader to open_archive.
+"""
+
+import asyncio
+import collections
+import functools
+
+from hanzo.warctools.stream import open_record_stream
+
+BATCH_SIZE = 64  # records read by the executor at a time
+READ_AHEAD = 4   # batches read before they are asked for
+READER_CHUNK_SIZE = 65536
+REWIND_SIZE = 1 << 20
+
+
+class AsyncRecordStream(object):
+    """Wraps a RecordStream for use with asyncio. read_records() and async
+    iteration work as they do on a RecordStream, but with async for."""
+
+    def __init__(self, stream, executor=None, batch_size=BATCH_SIZE,
+                 read_ahead=READ_AHEAD):
+        self.stream = stream
+        self.executor = executor
+        self.batch_size = batch_size
+        self.read_ahead = read_ahead
+        self._results = None
+
+    def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def read_records(self, limit=1, offsets=True, lengths=False):
+        """An async iterator of the tuples RecordStream.read_records
+        yields. The iterator of any earlier call is stopped, as seek() does,
+        before this one reads anything, dropping what it had read ahead."""
+        results = self.stream.read_records(limit=limit, offsets=offsets, lengths=lengths)
+        previous = self._results
+        if previous is not None:
+            previous._done = True
+        self._results = AsyncResults(self, results, previous)
+        return self._results
+
+    def __aiter__(self):
+        return AsyncRecords(self.read_records(limit=None, offsets=False))
+
+    async def seek(self, offset, pos=0):
+        await self._stop()
+        await self._run(self.stream.seek, offset, pos)
+
+    async def _stop(self):
+        if self._results is not None:
+            await self._results.aclose()
+            self._results = None
+
+    async def close(self):
+        await self._stop()
+        await self._run(self.stream.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncResults(object):
+    """The async iterator returned by AsyncRecordStream.read_records. At
+    most one batch is read at a time, as the stream can only be read from
+    one thread, and at most read_ahead batches are kept waiting."""
+
+    def __init__(self, stream, results, previous=None):
+        self.stream = stream
+        self._results = results
+        self._batches = collections.deque()
+        self._pending = None
+        self._done = False
+        self._previous = previous  # AsyncResults to stop before reading
+
+    def _read_batch(self):
+        """Run in the executor."""
+        batch = []
+        for result in self._results:
+            record = result[-2]
+            if record is not None and record.content_file is self.stream.stream:
+                record.content
+            batch.append(result)
+            if len(batch) >= self.stream.batch_size:
+                break
+        return batch
+
+    def _read_ahead(self):
+        if (self._pending is None and not self._done
+                and len(self._batches) < self.stream.read_ahead):
+            self._pending = asyncio.ensure_future(self.stream._run(self._read_batch))
+            self._pending.add_done_callback(lambda future: self._collect())
+
+    def _collect(self):
+        """Take the batch being read if it is ready, and start on the next."""
+        if self._pending is None or not self._pending.done():
+            return
+        future, self._pending = self._pending, None
+        if future.cancelled():
+            self._done = True
+            return
+        if future.exception() is not None or not future.result():
+            self._done = True
+        self._batches.append(future)
+        self._read_ahead()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._previous is not None:
+            await self._previous.aclose()
+            self._previous = None
+        while True:
+            self._collect()
+            if self._batches:
+                batch = self._batches[0].result()
+                if batch:
+                    result = batch.pop(0)
+                    if not batch:
+                        self._batches.popleft()
+                        self._read_ahead()
+                    return result
+                self._batches.popleft()
+            self._read_ahead()
+            if self._pending is None:
+                raise StopAsyncIteration
+            await asyncio.wait([self._pending])
+
+    async def aclose(self):
+        """Stop reading ahead, waiting for any batch being read, and close
+        the RecordStream.read_records generator under it."""
+        self._done = True
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        self._batches.clear()
+        self._results.close()
+
+
+class AsyncRecords(object):
+    """Async iteration over the records of an AsyncRecordStream, raising
+    on errors, like iterating over a RecordStream."""
+
+    def __init__(self, results):
+        self._results = results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        (offset, record, errors) = await self._results.__anext__()
+        if record:
+            return record
+        elif errors:
+            error_str = ",".join(str(error) for error in errors)
+            raise Exception("Errors while decoding %s" % error_str)
+        raise StopAsyncIteration
+
+
+class AsyncReaderFile(object):
+    """A synchronous, readable file of the bytes from an async reader with a
+    coroutine read(n). It must only be used from a thread other than the
+    event loop's, e.g. by a RecordStream running in an executor. It can seek
+    back over the last REWIND_SIZE bytes read, enough to guess what kind of
+    archive it is."""
+
+    def __init__(self, reader, loop):
+        self.reader = reader
+        self.loop = loop
+        self._buf = bytearray()  # the last bytes read, ending at _end
+        self._end = 0
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        future = asyncio.run_coroutine_threadsafe(self.reader.read(READER_CHUNK_SIZE), self.loop)
+        data = future.result()
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        self._end += len(data)
+        if len(self._buf) > 2 * REWIND_SIZE:
+            # keep what hasn't been read yet
+            unread = self._end - self._pos
+            del self._buf[:len(self._buf) - max(unread, REWIND_SIZE)]
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence != 0:
+            raise IOError('can only seek from the start or current position')
+        while offset > self._end and self._fill():
+            pass
+        if not self._end - len(self._buf) <= offset <= self._end:
+            raise IOError('cannot seek to %d in an async reader' % offset)
+        self._pos = offset
+        return self._pos
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or self._end - self._pos < size) and self._fill():
+            pass
+        start = len(self._buf) - (self._end - self._pos)
+        if size is None or size < 0:
+            end = len(self._buf)
+        else:
+            end = min(len(self._buf), start + size)
+        self._pos += end - start
+        return bytes(self._buf[start:end])
+
+    def readline(self, size=-1):
+        while True:
+            start = len(self._buf) - (self._end - self._pos)
+            end = self._buf.find(b'\n', start)
+            if end >= 0:
+                end += 1
+                break
+            if size is not None and 0 <= size <= len(self._buf) - start:
+                end = len(self._buf)
+                break
+            if not self._fill():
+                end = len(self._buf)
+                break
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+        self._pos += end - start
+        return bytes(self._buf[start:end])
+
+    def close(self):
+        close = getattr(self.reader, 'close', None)
+        if close is not None:
+            self.loop.call_soon_threadsafe(close)
+
+
+async def open_archive(filename=None, file_handle=None, reader=None,
+                       record_class=None, executor=None, **kwargs):
+    """Open an archive, like ArchiveRecord.open_archive, from a filename,
+    a file handle or an async reader, and return an AsyncRecordStream.
+    Other keyword arguments are passed on to open_record_stream."""
+    loop = asyncio.get_event_loop()
+    if reader is not None:
+        file_handle = AsyncReaderFile(reader, loop)
+    opener = functools.partial(open_record_stream, record_class, filename,
+                               file_handle, **kwargs)
+    stream = await loop.run_in_executor(executor, opener)
+    return AsyncRecordStream(stream, executor)
@@ -0,0 +1,88 @@
+"""Read the headers of many records at once, as columns.
+
+RecordStream.read_batch(n, fields) returns a RecordBatch: the offsets and
+lengths of up to n records and their payloads as array('q'), with -1 where
+a value isn't known, and a list for each header asked for, holding each
+record's value or None. No record objects are handed out, and payloads are
+skipped as in RecordStream.read_headers.
+
+The arrays support the buffer protocol, so numpy.frombuffer(batch.offsets,
+dtype='int64') makes a numpy array of them without copying.
+"""
+
+from array import array
+
+
+class RecordBatch(object):
+    """The columns of a batch of records. fields maps each header name asked
+    for to a list of values, one for each record. errors maps the position
+    in the batch of any record with errors to its errors."""
+
+    def __init__(self, fields=()):
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.payload_offsets = array('q')
+        self.payload_lengths = array('q')
+        self.fields = dict((name, []) for name in fields)
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def column(self, name):
+        """The list of values of header name, which must have been asked
+        for."""
+        return self.fields[name]
+
+
+def _value(value):
+    return -1 if value is None else value
+
+
+def read_batch(results, n, fields=()):
+    """Build a RecordBatch from the first n of results, an iterator of the
+    tuples RecordStream.read_headers yields."""
+    unique = []
+    for name in fields:
+        if name not in unique:
+            unique.append(name)
+    fields = unique
+    batch = RecordBatch(fields)
+    # find each wanted header with one pass over a record's headers
+    names = []
+    for name in fields:
+        if name.lower() not in names:
+            names.append(name.lower())
+    wanted = dict((name, i) for i, name in enumerate(names))
+    columns = [(batch.fields[name], wanted[name.lower()]) for name in fields]
+
+    for (offset, length, payload_offset, payload_length,
+         headers, errors) in results:
+        if headers is None:
+            if errors:
+                error_str = ",".join(str(error) for error in errors)
+                raise Exception("Errors while decoding %s" % error_str)
+            break
+
+        if errors:
+            batch.errors[len(batch)] = errors
+        batch.offsets.append(_value(offset))
+        batch.lengths.append(_value(length))
+        batch.payload_offsets.append(_value(payload_offset))
+        batch.payload_lengths.append(_value(payload_length))
+
+        values = [None] * len(names)
+        found = 0
+        for k, v in headers:
+            i = wanted.get(k.lower())
+            if i is not None and values[i] is None:
+                values[i] = v
+                found += 1
+                if found == len(wanted):
+                    break
+        for column, i in columns:
+            column.append(values[i])
+
+        if len(batch) >= n:
+            break
+    return batch
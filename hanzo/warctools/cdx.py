@@ -0,0 +1,247 @@
+"""CDX and CDXJ index lines for warc records.
+
+A CDXJ line is a key, a 14 digit timestamp and a JSON block of fields:
+
+    org,example)/ 20131115000000 {"url": "http://example.org/", ...}
+
+A CDX line (the 11 column format, CDX N b a m s k r M S V g) has the same
+key and timestamp, then the url, mime type, http status, payload digest,
+redirect and meta tags (both always -), length, offset and filename.
+
+The key is the SURT form of the url (see surt). The fields give where the
+record is, its filename, offset and (compressed) length, and some of its
+headers. For http responses and revisits, the status and mime type come
+from the http headers at the start of the payload, which read_http_head
+reads without reading the rest.
+
+index_records writes the index lines of a stream in one of FORMATS, and
+write_index_lines those of RecordHeaderViews read some other way.
+"""
+
+import functools
+import json
+import re
+
+from hanzo.warctools.warc import WarcRecord
+
+HTTP_HEAD_SIZE = 8192
+HTTP_RECORD_TYPES = (WarcRecord.RESPONSE, WarcRecord.REVISIT)
+HTTP_CONTENT_TYPE = b'application/http'
+INDEX_RECORD_TYPES = (WarcRecord.RESPONSE, WarcRecord.REVISIT, WarcRecord.RESOURCE)
+REVISIT_MIME = b'warc/revisit'
+SURT_CACHE_SIZE = 65536
+
+
+def cdx_timestamp(date):
+    """The 14 digit timestamp of a WARC-Date, e.g. 20131115000000."""
+    if not date:
+        return b'-'
+    return re.sub(br'[^0-9]', b'', date)[:14]
+
+
+SURT_SCHEMES = (b'http', b'https', b'ftp')
+DEFAULT_PORTS = {b'http': b'80', b'https': b'443', b'ftp': b'21'}
+url_rx = re.compile(br'^([a-z][a-z0-9+.-]*)://([^/?#]*)([^#]*)', re.I)
+www_rx = re.compile(br'^www\d*\.')
+ipv4_rx = re.compile(br'^\d+\.\d+\.\d+\.\d+$')
+space_rx = re.compile(br'\s')
+
+
+@functools.lru_cache(maxsize=SURT_CACHE_SIZE)
+def surt_host(host):
+    """The SURT form of a (lowercase) host name: a leading www dropped, and
+    the rest reversed and joined by commas, e.g. org,example. Cached, as an
+    archive holds many urls on few hosts."""
+    host = host.strip(b'.')
+    if ipv4_rx.match(host) or host.startswith(b'['):
+        return host
+    host = www_rx.sub(b'', host)
+    return b','.join(reversed(host.split(b'.')))
+
+
+def surt(url):
+    """The SURT form of a http(s) or ftp url, e.g. org,example)/a?a=2&b=1
+    for http://www.Example.org:80/a?b=1&a=2#top: lowercased, without the
+    scheme, user, default port or fragment, with the host reversed and
+    query arguments sorted. Other urls are just lowercased. Any spaces
+    left are escaped, so keys can be split from what follows them."""
+    url = space_rx.sub(b'%20', url.strip().lower())
+    match = url_rx.match(url)
+    if match is None or match.group(1) not in SURT_SCHEMES:
+        return url
+    scheme, authority, rest = match.groups()
+
+    host = authority.rpartition(b'@')[2]
+    port = None
+    if not host.endswith(b']'):
+        name, sep, port = host.rpartition(b':')
+        if sep and port.isdigit():
+            host = name
+        else:
+            port = None
+    if port == DEFAULT_PORTS.get(scheme):
+        port = None
+
+    path, sep, query = rest.partition(b'?')
+    key = surt_host(host)
+    if port:
+        key += b':' + port
+    key += b')' + (path or b'/')
+    args = sorted(arg for arg in query.split(b'&') if arg)
+    if args:
+        key += b'?' + b'&'.join(args)
+    return key
+
+
+def cdx_key(url):
+    """The key a record for url is sorted by."""
+    return surt(url)
+
+
+def is_http_response(record):
+    """True if the payload of record starts with http response headers."""
+    content_type = record.get_header(WarcRecord.CONTENT_TYPE) or b''
+    return (record.type in HTTP_RECORD_TYPES
+            and content_type.lower().startswith(HTTP_CONTENT_TYPE))
+
+
+def read_http_head(record, size=HTTP_HEAD_SIZE):
+    """The http headers at the start of record's payload, read from its
+    content_file up to the first blank line, but no more than size bytes,
+    or None if it doesn't hold a http response. For RecordStream.scan(head=)."""
+    if record.content_file is None or not is_http_response(record):
+        return None
+    head = b''
+    while len(head) < size:
+        buf = record.content_file.read(min(1024, size - len(head)))
+        if not buf:
+            break
+        head += buf
+        if b'\r\n\r\n' in head or b'\n\n' in head:
+            break
+    return head
+
+
+def content_http_head(record, size=HTTP_HEAD_SIZE):
+    """Like read_http_head, for a record whose content is in memory, not
+    in a content_file."""
+    if record.content_file is not None or not is_http_response(record):
+        return None
+    return (record.content[1] or b'')[:size]
+
+
+status_rx = re.compile(br'^HTTP/\d+(?:\.\d+)?\s+(\d{3})\b')
+blank_line_rx = re.compile(br'\r?\n\r?\n')
+content_type_rx = re.compile(br'^content-type[ \t]*:[ \t]*([^;\r\n]*)', re.I | re.M)
+
+
+def parse_http_head(head):
+    """(status, mime type) from the start of a http response, either of
+    which is None if it can't be found. The mime type is lowercased, and
+    without parameters."""
+    status = mime = None
+    match = status_rx.match(head)
+    if match:
+        status = match.group(1)
+    end = blank_line_rx.search(head)
+    if end:
+        head = head[:end.start()]
+    match = content_type_rx.search(head)
+    if match:
+        mime = match.group(1).strip().lower() or None
+    return status, mime
+
+
+def cdxj_fields(record, filename, offset, length, head=None):
+    """The JSON fields of a record, a WarcRecord or RecordHeaderView. head
+    is the start of its payload if it holds a http response, as
+    read_http_head returns, which the status and mime type are taken from."""
+    fields = {}
+    if record.url:
+        fields['url'] = record.url.decode('latin1')
+    status = mime = None
+    if head is not None:
+        status, mime = parse_http_head(head)
+    if record.type == WarcRecord.REVISIT:
+        mime = REVISIT_MIME
+    elif head is None:
+        mime = record.get_header(WarcRecord.CONTENT_TYPE)
+    if mime:
+        fields['mime'] = mime.decode('latin1')
+    if status:
+        fields['status'] = status.decode('latin1')
+    digest = record.get_header(WarcRecord.PAYLOAD_DIGEST)
+    if digest:
+        if digest.lower().startswith(b'sha1:'):
+            digest = digest[5:]
+        fields['digest'] = digest.decode('latin1')
+    if length is not None:
+        fields['length'] = str(length)
+    fields['offset'] = str(offset)
+    fields['filename'] = filename
+    return fields
+
+
+def cdxj_line(record, filename, offset, length, head=None):
+    """The CDXJ line of a record written at offset in filename, taking up
+    length bytes there."""
+    url = record.url or b'-'
+    fields = cdxj_fields(record, filename, offset, length, head)
+    return b' '.join((cdx_key(url), cdx_timestamp(record.date),
+                      json.dumps(fields, sort_keys=True).encode('utf-8'))) + b'\n'
+
+
+CDX11_FIELDS = ('url', 'mime', 'status', 'digest', 'redirect', 'meta',
+                'length', 'offset', 'filename')
+
+
+def cdx11_line(record, filename, offset, length, head=None):
+    """The CDX line, in the 11 column format, of a record written at offset
+    in filename, taking up length bytes there."""
+    url = record.url or b'-'
+    fields = cdxj_fields(record, filename, offset, length, head)
+    values = [cdx_key(url), cdx_timestamp(record.date)]
+    for name in CDX11_FIELDS:
+        value = re.sub(r'\s', '%20', fields.get(name) or '-')
+        values.append(value.encode('utf-8' if name == 'filename' else 'latin1'))
+    return b' '.join(values) + b'\n'
+
+
+class IndexFormat(object):
+    """An index format: header is written once at the start of an index,
+    and line(record, filename, offset, length, head) gives a record's line.
+    http_head says if line needs head, the start of a http payload."""
+
+    def __init__(self, name, header, line, http_head=True):
+        self.name = name
+        self.header = header
+        self.line = line
+        self.http_head = http_head
+
+
+FORMATS = {
+    'cdxj': IndexFormat('cdxj', b'', cdxj_line),
+    'cdx11': IndexFormat('cdx11', b' CDX N b a m s k r M S V g\n', cdx11_line),
+}
+
+
+def index_records(stream, filename, index_format, out,
+                  record_types=INDEX_RECORD_TYPES):
+    """Write the index lines of the records in stream of one of
+    record_types (all of them if None) to out, in the order they are in
+    stream, reading no more of each record than its headers and, if the
+    format needs them, the http headers of its payload. filename is the
+    name written in each line."""
+    head = read_http_head if index_format.http_head else None
+    write_index_lines(stream.scan(head=head), filename, index_format, out, record_types)
+
+
+def write_index_lines(records, filename, index_format, out,
+                      record_types=INDEX_RECORD_TYPES):
+    """Write the index lines of records, RecordHeaderViews with head set
+    if the format needs it, as index_records does."""
+    line = index_format.line
+    for record in records:
+        if record_types is not None and record.type not in record_types:
+            continue
+        out.write(line(record, filename, record.offset, record.length, record.head))
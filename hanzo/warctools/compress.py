@@ -0,0 +1,103 @@
+"""Compress records into gzip members.
+
+Setting up a deflate stream costs about as much as compressing a small
+record, so a GzipCompressor keeps one stream for all the members it
+writes. Each member is ended with a full flush, after which nothing in
+it refers back to what came before, and an empty final block, so every
+member still inflates on its own.
+
+Compression uses zlib-ng or isal when one is installed (python packages
+zlib-ng and isal), as they are a good deal faster, and zlib otherwise.
+isal only has levels 0 to 3, so higher levels are turned down to 3.
+"""
+
+import struct
+import zlib
+
+try:
+    from zlib_ng import zlib_ng
+except ImportError:
+    zlib_ng = None
+
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
+COMPRESS_LEVEL = 9 # as GzipFile
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+FINAL_BLOCK = b'\x03\x00' # an empty, final, fixed huffman block
+
+BACKENDS = [('zlib-ng', zlib_ng), ('isal', isal_zlib), ('zlib', zlib)]
+
+
+def get_backend(name=None):
+    """The zlib-like module named: 'zlib-ng', 'isal' or 'zlib', or when
+    name is None, the first of those installed."""
+    for backend_name, module in BACKENDS:
+        if module is not None and (name is None or name == backend_name):
+            return module
+    raise Exception('compression backend %s is not installed' % name)
+
+
+class GzipCompressor(object):
+    """Compresses one gzip member after another:
+
+        data = compressor.start_member()
+        data += compressor.compress(part) ...
+        data += compressor.end_member()
+    """
+
+    def __init__(self, level=COMPRESS_LEVEL, strategy=zlib.Z_DEFAULT_STRATEGY,
+                 backend=None):
+        self.zlib = get_backend(backend)
+        if self.zlib is isal_zlib:
+            level = min(level, isal_zlib.ISAL_BEST_COMPRESSION)
+        self.level = level
+        self._compress = self.zlib.compressobj(level, zlib.DEFLATED,
+                                               -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                               strategy)
+        self._crc = 0
+        self._size = 0
+
+    def start_member(self):
+        self._crc = 0
+        self._size = 0
+        return GZIP_HEADER
+
+    def compress(self, data):
+        self._crc = self.zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return self._compress.compress(data)
+
+    def end_member(self):
+        return (self._compress.flush(zlib.Z_FULL_FLUSH) + FINAL_BLOCK
+                + struct.pack('<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+
+    def compress_member(self, data):
+        """A whole gzip member of data."""
+        return self.start_member() + self.compress(data) + self.end_member()
+
+
+class CompressingFile(object):
+    """Writes to out, compressed by compressor as a single member, between
+    start() and end()."""
+
+    def __init__(self, out, compressor):
+        self.out = out
+        self.compressor = compressor
+
+    def start(self):
+        self.out.write(self.compressor.start_member())
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.out.write(data)
+
+    def flush(self):
+        pass
+
+    def end(self):
+        self.out.write(self.compressor.end_member())
+        self.out.flush()
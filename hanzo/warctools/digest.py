@@ -0,0 +1,194 @@
+"""WARC-Block-Digest and WARC-Payload-Digest.
+
+A digest header is algorithm:value, e.g. sha1:3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ,
+with the value in base32 as crawlers usually write it, or in base16 or
+base64. The block digest covers the whole content block of a record, the
+payload digest just the payload: for http request and response records
+that is what follows the http headers, as sent (not de-chunked), and for
+other records it is the whole block.
+
+A RecordDigester is fed a block a chunk at a time, so digests are worked
+out while a record is being read or written, without buffering it.
+"""
+
+import base64
+import binascii
+import hashlib
+import tempfile
+
+from hanzo.warctools.warc import WarcRecord
+
+CHUNK_SIZE = 65536
+DEFAULT_ALGORITHM = 'sha1'
+HTTP_CONTENT_TYPE = b'application/http'
+HTTP_RECORD_TYPES = (WarcRecord.RESPONSE, WarcRecord.REQUEST)
+
+
+def _hash(algorithm):
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        return None
+
+
+def parse_digest(value):
+    """Split a digest header into the name of its hashlib algorithm and the
+    digest itself as bytes, which is None if it can't be decoded. Returns
+    None if value isn't a digest of an algorithm hashlib knows."""
+    algorithm, sep, encoded = value.partition(b':')
+    if not sep:
+        return None
+    algorithm = algorithm.strip().lower().replace(b'-', b'').decode('ascii', 'replace')
+    h = _hash(algorithm)
+    if h is None:
+        return None
+    encoded = encoded.strip()
+    size = h.digest_size
+    decoders = (
+        lambda v: binascii.unhexlify(v),
+        lambda v: base64.b32decode(v + b'=' * (-len(v) % 8), casefold=True),
+        lambda v: base64.b64decode(v + b'=' * (-len(v) % 4)),
+    )
+    for decode in decoders:
+        try:
+            digest = decode(encoded)
+        except (TypeError, ValueError, binascii.Error):
+            continue
+        if len(digest) == size:
+            return algorithm, digest
+    return algorithm, None
+
+
+def format_digest(algorithm, digest):
+    """A digest header value, in base32."""
+    return algorithm.encode('ascii') + b':' + base64.b32encode(digest)
+
+
+def is_http(record):
+    """True if the payload of record comes after http headers."""
+    content_type = record.get_header(WarcRecord.CONTENT_TYPE) or b''
+    return (record.type in HTTP_RECORD_TYPES
+            and content_type.lower().startswith(HTTP_CONTENT_TYPE))
+
+
+class RecordDigester(object):
+    """Works out the digests of a record's block and payload as the block
+    is fed to update(). Either algorithm can be None to skip that digest.
+    With http, the payload starts after the first blank line."""
+
+    def __init__(self, block_algorithm=DEFAULT_ALGORITHM,
+                 payload_algorithm=DEFAULT_ALGORITHM, http=False):
+        self.block = _hash(block_algorithm) if block_algorithm else None
+        self.payload = _hash(payload_algorithm) if payload_algorithm else None
+        self.block_algorithm = block_algorithm
+        self.payload_algorithm = payload_algorithm
+        self.in_payload = not http
+        self._tail = b''  # end of the http headers so far
+
+    def update(self, data):
+        if self.block is not None:
+            self.block.update(data)
+        if self.payload is None:
+            return
+        if not self.in_payload:
+            buf = self._tail + data
+            end = buf.find(b'\r\n\r\n')
+            if end < 0:
+                self._tail = buf[-3:]
+                return
+            self.in_payload = True
+            self._tail = b''
+            data = buf[end + 4:]
+        self.payload.update(data)
+
+    def block_digest(self):
+        """The block digest header value."""
+        return format_digest(self.block_algorithm, self.block.digest())
+
+    def payload_digest(self):
+        """The payload digest header value."""
+        return format_digest(self.payload_algorithm, self.payload.digest())
+
+
+def check_digests(record, chunk_size=CHUNK_SIZE):
+    """Read record's content, checking it against its block and payload
+    digest headers, if it has them, and return a list of errors like those
+    in record.errors. The payload digest of a revisit record is that of
+    another record, so it is left alone, as are digests using algorithms
+    hashlib doesn't have."""
+    errors = []
+    expected = {}
+    for name in (WarcRecord.BLOCK_DIGEST, WarcRecord.PAYLOAD_DIGEST):
+        value = record.get_header(name)
+        if value is None:
+            continue
+        if name == WarcRecord.PAYLOAD_DIGEST and record.type == WarcRecord.REVISIT:
+            continue
+        parsed = parse_digest(value)
+        if parsed is None:
+            continue
+        if parsed[1] is None:
+            errors.append(('invalid digest', name, value))
+            continue
+        expected[name] = (value, parsed)
+    if not expected:
+        return errors
+
+    block = expected.get(WarcRecord.BLOCK_DIGEST)
+    payload = expected.get(WarcRecord.PAYLOAD_DIGEST)
+    digester = RecordDigester(block[1][0] if block else None,
+                              payload[1][0] if payload else None,
+                              http=is_http(record))
+
+    if record.content_file is not None:
+        content_file = record.content_file
+        while True:
+            buf = content_file.read(chunk_size)
+            if not buf:
+                break
+            digester.update(buf)
+    else:
+        digester.update(record.content[1])
+
+    if block and digester.block.digest() != block[1][1]:
+        errors.append(('block digest mismatch', block[0], digester.block_digest()))
+    if payload and digester.payload.digest() != payload[1][1]:
+        errors.append(('payload digest mismatch', payload[0], digester.payload_digest()))
+    return errors
+
+
+PAYLOAD_RECORD_TYPES = (WarcRecord.RESPONSE, WarcRecord.REQUEST,
+                        WarcRecord.RESOURCE, WarcRecord.CONVERSION)
+SPOOL_SIZE = 1 << 20
+
+
+def add_digests(record, algorithm=DEFAULT_ALGORITHM, spool_size=SPOOL_SIZE):
+    """Set record's WARC-Block-Digest, and WARC-Payload-Digest if it is a
+    record with a payload, from its content, ready for writing. A
+    content_file is read once, through a spool kept in memory up to
+    spool_size bytes and on disk past that, which becomes the record's
+    content_file. The record owns the spool, and closes it once it has
+    been written, or its content_file is replaced."""
+    with_payload = record.type in PAYLOAD_RECORD_TYPES
+    digester = RecordDigester(algorithm, algorithm if with_payload else None,
+                              http=is_http(record))
+
+    if record.content_file is not None:
+        if not record._content_file_valid:
+            raise Exception('cannot digest record because content_file has already been used')
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        while True:
+            buf = record.content_file.read(CHUNK_SIZE)
+            if not buf:
+                break
+            digester.update(buf)
+            spool.write(buf)
+        spool.seek(0)
+        record.content_file = spool
+        record._owns_content_file = True
+    else:
+        digester.update(record.content[1] or b'')
+
+    record.set_header(WarcRecord.BLOCK_DIGEST, digester.block_digest())
+    if with_payload:
+        record.set_header(WarcRecord.PAYLOAD_DIGEST, digester.payload_digest())
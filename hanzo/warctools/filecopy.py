@@ -0,0 +1,154 @@
+"""Copy byte ranges of one file to another, e.g. whole records.
+
+Between two real files, copy_range has the kernel do the copying, with
+os.copy_file_range, or os.sendfile where that isn't supported (e.g. when
+writing to a pipe), so nothing passes through python. Otherwise, or when
+both of those fail, it reads and writes.
+
+The source is read at the offset given without moving its position, so a
+range can be copied out of a file that is being read as a record stream.
+
+Only plain files, as open() returns them, are read or written by file
+descriptor. Wrappers like gzip.GzipFile have a fileno() too, but it is
+that of the file underneath, so they are read and written as usual.
+
+copy_file writes the rest of a file-like object, such as a record's
+content_file, the same way when file_range can tell where in a local file
+its bytes are.
+"""
+
+import io
+import os
+import stat
+
+CHUNK_SIZE = 1 << 20
+MAX_COPY = 1 << 30 # per system call
+MIN_COPY = 1 << 16 # smaller ranges are just read and written
+
+
+FILE_TYPES = (io.FileIO, io.BufferedReader, io.BufferedWriter, io.BufferedRandom)
+
+
+def _fileno(f):
+    """The file descriptor of f, if f is a plain file."""
+    if not isinstance(f, FILE_TYPES):
+        return None
+    try:
+        return f.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+COPIERS = [copier for name, copier in (('copy_file_range', _copy_file_range),
+                                       ('sendfile', _sendfile))
+           if hasattr(os, name)]
+
+
+def _copy_fds(src_fd, offset, length, dst_fd):
+    """Copy in the kernel, returning how much was copied, which is short of
+    length if it couldn't be done this way."""
+    copied = 0
+    for copier in COPIERS:
+        while copied < length:
+            try:
+                count = copier(src_fd, dst_fd, offset + copied,
+                               min(length - copied, MAX_COPY))
+            except OSError:
+                break
+            if not count:
+                break
+            copied += count
+        if copied >= length:
+            break
+    return copied
+
+
+def read_range(src, offset, length):
+    """The length bytes at offset in src, or fewer at the end of src,
+    leaving src where it was."""
+    fd = _fileno(src)
+    if fd is not None and hasattr(os, 'pread'):
+        chunks = []
+        while length > 0:
+            buf = os.pread(fd, min(length, CHUNK_SIZE), offset)
+            if not buf:
+                break
+            chunks.append(buf)
+            offset += len(buf)
+            length -= len(buf)
+        return b''.join(chunks)
+
+    pos = src.tell()
+    try:
+        src.seek(offset)
+        return src.read(length)
+    finally:
+        src.seek(pos)
+
+
+def copy_range(src, offset, length, dst):
+    """Write the length bytes at offset in src to dst, leaving src where it
+    was. Raises if src ends first."""
+    src_fd = _fileno(src)
+    dst_fd = _fileno(dst)
+    if src_fd is not None and dst_fd is not None:
+        dst.flush()
+        copied = _copy_fds(src_fd, offset, length, dst_fd)
+        offset += copied
+        length -= copied
+
+    while length > 0:
+        buf = read_range(src, offset, min(length, CHUNK_SIZE))
+        if not buf:
+            raise Exception('expected {} more bytes at offset {}'.format(length, offset))
+        dst.write(buf)
+        offset += len(buf)
+        length -= len(buf)
+
+
+def file_range(f):
+    """(file, offset, length) of what is left to read of f, if that is a
+    range of a local file: f can be a local file, or anything with a
+    file_range() method, like the content_file of a record read from an
+    uncompressed local file. None otherwise."""
+    method = getattr(f, 'file_range', None)
+    if method is not None:
+        return method()
+    if not isinstance(f, (io.BufferedReader, io.FileIO)):
+        return None
+    try:
+        offset = f.tell()
+        st = os.fstat(f.fileno())
+    except (IOError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return f, offset, max(0, st.st_size - offset)
+
+
+def copy_file(f, out):
+    """Write what is left to read of f to out, leaving f at its end. With
+    copy_range, if file_range finds at least MIN_COPY bytes, or else by
+    reading CHUNK_SIZE bytes at a time. Returns how many were written."""
+    found = file_range(f)
+    if found is not None and found[2] >= MIN_COPY:
+        src, offset, length = found
+        copy_range(src, offset, length, out)
+        f.seek(0, 2)
+        return length
+
+    written = 0
+    while True:
+        buf = f.read(CHUNK_SIZE)
+        if not buf:
+            return written
+        out.write(buf)
+        written += len(buf)
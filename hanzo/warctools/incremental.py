@@ -0,0 +1,147 @@
+"""Index archives a bit at a time, as they are written to.
+
+An IndexState records how far an archive has been indexed: its size and
+mtime then, and the offset just after the last whole record indexed. It
+is kept in a small JSON file for each archive. Next time, resume_state
+says whether the archive has changed since, and if it has, the stream is
+opened at that offset and scan_new reads just the records after it.
+
+A record at the end of an archive that is cut short, because it is still
+being written, is left out, and the offset kept is that of its start, so
+it is read again next time. In a record-gzipped file that is a member
+that ends early. In an uncompressed file it is a record without all of
+its payload or the newlines after it. Headers that can't be parsed are
+treated the same way.
+
+Records that share a gzip member, as in a file gzipped as a whole, have
+no end of their own, so the offset kept is that of the member, along
+with skip, the number of its records already indexed.
+"""
+
+import json
+import os
+
+from hanzo.warctools.filecopy import read_range
+from hanzo.warctools.warc import WarcRecord
+
+STATE_SUFFIX = '.state'
+MAX_TRAILER = 64 # bytes read from the end of the last record to check it
+
+
+class IndexState(object):
+    """How far an archive has been indexed, saved at path."""
+
+    def __init__(self, path=None, size=None, mtime=None, offset=0, skip=0):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.offset = offset
+        self.skip = skip
+
+    @classmethod
+    def load(cls, path):
+        """The state saved at path, or None if there is none."""
+        try:
+            with open(path, 'rb') as f:
+                fields = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError):
+            return None
+        return cls(path, fields['size'], fields['mtime'], fields['offset'],
+                   fields.get('skip', 0))
+
+    def save(self, path=None):
+        """Write the state to path, or the path it was made with, replacing
+        what was there in one go."""
+        path = path or self.path
+        fields = {'size': self.size, 'mtime': self.mtime,
+                  'offset': self.offset, 'skip': self.skip}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(fields, sort_keys=True).encode('utf-8') + b'\n')
+        os.replace(tmp, path)
+
+    def unchanged(self, st):
+        """True if an archive with os.stat() st is as it was when indexed."""
+        return self.size == st.st_size and self.mtime == st.st_mtime
+
+    def advance(self, view):
+        """Move past the record of a RecordHeaderView."""
+        if view.offset is not None and view.length is not None:
+            self.offset = view.offset + view.length
+            self.skip = 0
+            return
+        if view.offset is not None and view.offset != self.offset:
+            self.offset = view.offset
+            self.skip = 0
+        self.skip += 1
+
+
+def resume_state(path, st):
+    """The state to index an archive with os.stat() st from: the one saved
+    at path, or a new one, from the start, if there is none or the archive
+    is now shorter than it says, i.e. it has been replaced. None if the
+    archive hasn't changed since. The state's size and mtime are set from
+    st, so take st before reading the archive."""
+    state = IndexState.load(path)
+    if state is not None and state.unchanged(st):
+        return None
+    if state is None or st.st_size < state.offset:
+        state = IndexState(path)
+    state.size = st.st_size
+    state.mtime = st.st_mtime
+    return state
+
+
+def _trailer_whole(stream, view):
+    """False if the last record of an archive is missing bytes at its end:
+    some of its payload, or the newlines after it."""
+    if view.payload_offset is None or view.payload_length is None or view.length is None:
+        return True
+    payload_end = view.payload_offset + view.payload_length
+    end = view.offset + view.length
+    if end <= payload_end:
+        return False
+    newlines = 2 if issubclass(view.record_class, WarcRecord) else 1
+    raw_file = stream.raw_file
+    if raw_file is None:
+        return end - payload_end >= newlines
+    start = max(payload_end, end - MAX_TRAILER)
+    trailer = read_range(raw_file, start, end - start)
+    return trailer.endswith(b'\n') and trailer.count(b'\n') >= newlines
+
+
+def scan_new(stream, state, head=None):
+    """Yield a RecordHeaderView, as RecordStream.scan(head=head) does, for
+    each whole record in stream, which was opened at state.offset, after
+    the first state.skip records there. state is advanced past each record
+    as it is yielded, and stops short of any record cut short."""
+    skip = state.skip
+    state.skip = 0
+    pending = None
+    try:
+        for (offset, length, payload_offset, payload_length,
+             record, errors, record_head) in stream._read_headers(None, head):
+            if not record:
+                break
+            view = record.header_view(offset, length, payload_offset,
+                                      payload_length, record_head)
+            if pending is not None:
+                state.advance(pending)
+                if skip:
+                    skip -= 1
+                else:
+                    yield pending
+            pending = view
+    except EOFError:
+        # a gzip member that ends early: pending is whole, as its member
+        # has been read to the end
+        if pending is not None:
+            state.advance(pending)
+            if not skip:
+                yield pending
+        return
+
+    if pending is not None and _trailer_whole(stream, pending):
+        state.advance(pending)
+        if not skip:
+            yield pending
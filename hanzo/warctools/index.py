@@ -0,0 +1,310 @@
+"""A sorted, block compressed index of CDX or CDXJ lines, for finding the
+records of a url without reading every archive, as ZipNum clusters do.
+
+write_index(sorted_lines, path), or an IndexWriter, writes lines in blocks of
+BLOCK_LINES, each a gzip member of its own, to shards named path-00000.gz,
+path-00001.gz, ..., starting a new shard once one is SHARD_SIZE bytes,
+and writes a summary, path.idx, with a line for each block:
+
+    org,example)/ 20131115000000<tab>path-00000.gz<tab>0<tab>4023
+
+giving the key and timestamp of its first line, and its shard, offset and
+length. A SortedIndex bisects the memory mapped summary, and inflates
+just the blocks that can hold the lines asked for, keeping the last few
+it inflated for lookups close by.
+
+Lines are sorted as bytes, as LC_ALL=C sort does. build_index sorts them
+first, with a LineSorter, which sorts runs of lines in memory and merges
+them from temporary files.
+"""
+
+import bisect
+import collections
+import heapq
+import json
+import mmap
+import os
+import tempfile
+import zlib
+
+from hanzo.warctools.cdx import surt
+from hanzo.warctools.compress import GzipCompressor, COMPRESS_LEVEL
+
+BLOCK_LINES = 3000
+SHARD_SIZE = 1 << 30
+SUMMARY_SUFFIX = '.idx'
+SHARD_TEMPLATE = '{path}-{shard:05d}.gz'
+RUN_SIZE = 1000000 # lines sorted in memory at once
+BLOCK_CACHE_SIZE = 16 # inflated blocks a SortedIndex keeps
+
+
+def is_index_line(line):
+    """False for blank lines and the header lines of CDX files."""
+    return bool(line.strip()) and not line.startswith((b' CDX', b'CDX', b'#'))
+
+
+class LineSorter(object):
+    """Lines are written to it, any number at a time and in any order, and
+    sorted() yields them sorted, each ending in a newline."""
+
+    def __init__(self, run_size=RUN_SIZE):
+        self.run_size = run_size
+        self._lines = []
+        self._rest = b''
+        self._runs = []
+
+    def write(self, data):
+        lines = (self._rest + data).split(b'\n')
+        self._rest = lines.pop()
+        for line in lines:
+            self._lines.append(line + b'\n')
+        if len(self._lines) >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        self._lines.sort()
+        run = tempfile.TemporaryFile(prefix='warcindex-')
+        run.writelines(self._lines)
+        run.seek(0)
+        self._runs.append(run)
+        self._lines = []
+
+    def sorted(self):
+        if self._rest:
+            self._lines.append(self._rest + b'\n')
+            self._rest = b''
+        self._lines.sort()
+        try:
+            for line in heapq.merge(self._lines, *self._runs):
+                yield line
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+            self._lines = []
+
+
+def _summary_key(line):
+    return b' '.join(line.split(b' ', 2)[:2]).rstrip(b'\n')
+
+
+class IndexWriter(object):
+    """Writes sorted lines to an index at path, in blocks of block_lines
+    lines, each compressed as a gzip member of its own."""
+
+    def __init__(self, path, block_lines=BLOCK_LINES, shard_size=SHARD_SIZE,
+                 compress_level=COMPRESS_LEVEL):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self.block_lines = block_lines
+        self.shard_size = shard_size
+        self.compressor = GzipCompressor(compress_level)
+        self.summary = open(path + SUMMARY_SUFFIX, 'wb')
+        self.shard = None
+        self.shard_name = None
+        self.shards = 0
+        self.count = 0
+        self._block = []
+
+    def write(self, line):
+        """Write a line, which must not sort before the last. Header lines
+        are left out."""
+        if not is_index_line(line):
+            return
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        self._block.append(line)
+        self.count += 1
+        if len(self._block) >= self.block_lines:
+            self._write_block()
+
+    def _write_block(self):
+        if self.shard is None or self.shard.tell() >= self.shard_size:
+            if self.shard is not None:
+                self.shard.close()
+            shard_path = SHARD_TEMPLATE.format(path=self.path, shard=self.shards)
+            self.shard_name = os.path.relpath(shard_path, self.directory or '.')
+            self.shard = open(shard_path, 'wb')
+            self.shards += 1
+
+        data = self.compressor.compress_member(b''.join(self._block))
+        offset = self.shard.tell()
+        self.shard.write(data)
+        self.summary.write(b'\t'.join((_summary_key(self._block[0]),
+                                       self.shard_name.encode('utf-8'),
+                                       str(offset).encode('ascii'),
+                                       str(len(data)).encode('ascii'))) + b'\n')
+        self._block = []
+
+    def close(self):
+        """Write the last block, and close the files."""
+        try:
+            if self._block:
+                self._write_block()
+        finally:
+            if self.shard is not None:
+                self.shard.close()
+            self.summary.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_index(lines, path, **kwargs):
+    """Write lines, which must be sorted, as an index at path: the summary
+    path + SUMMARY_SUFFIX, and shards named after path. Keyword arguments
+    are passed on to IndexWriter. Returns the number of lines written."""
+    with IndexWriter(path, **kwargs) as writer:
+        for line in lines:
+            writer.write(line)
+    return writer.count
+
+
+def build_index(lines, path, run_size=RUN_SIZE, **kwargs):
+    """Sort lines, in any order, and write them as an index at path, as
+    write_index does."""
+    sorter = LineSorter(run_size)
+    for line in lines:
+        sorter.write(line if line.endswith(b'\n') else line + b'\n')
+    return write_index(sorter.sorted(), path, **kwargs)
+
+
+def _prefix_end(prefix):
+    """The first byte string after all those starting with prefix."""
+    prefix = prefix.rstrip(b'\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes(bytearray([prefix[-1] + 1]))
+
+
+def line_location(line):
+    """(filename, offset, length) of the record of a CDX (11 column) or
+    CDXJ line. length is None if it isn't known. Whitespace in a CDX
+    filename, written as %20, is put back."""
+    key, timestamp, rest = line.rstrip(b'\r\n').split(b' ', 2)
+    if rest.startswith(b'{'):
+        fields = json.loads(rest.decode('utf-8'))
+        length = fields.get('length')
+        return (fields['filename'], int(fields['offset']),
+                int(length) if length is not None else None)
+    values = rest.split(b' ')
+    length, offset, filename = values[-3:]
+    return (filename.decode('utf-8').replace('%20', ' '), int(offset),
+            int(length) if length.isdigit() else None)
+
+
+class SortedIndex(object):
+    """An index written by write_index at path, for looking up lines by
+    url, url prefix or date range. Lines are returned as bytes, in sorted
+    order, i.e. by key then timestamp."""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(path)
+        self._summary = open(path + SUMMARY_SUFFIX, 'rb')
+        self._size = os.fstat(self._summary.fileno()).st_size
+        self._mm = None
+        if self._size:
+            self._mm = mmap.mmap(self._summary.fileno(), 0, access=mmap.ACCESS_READ)
+        self._shards = {}
+        self._cache = collections.OrderedDict() # (shard, offset): lines
+
+    def _line_end(self, start):
+        end = self._mm.find(b'\n', start)
+        return self._size if end < 0 else end
+
+    def _first_block(self, start):
+        """The offset in the summary of the line of the first block that can
+        hold lines from start on: the block before the first one whose key
+        is start or after it."""
+        mm = self._mm
+        lo, hi = 0, self._size
+        # lo and hi are always the starts of lines
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = max(lo, mm.rfind(b'\n', lo, mid) + 1)
+            line_end = self._line_end(line_start)
+            key = mm[line_start:line_end].split(b'\t', 1)[0]
+            if key < start:
+                lo = line_end + 1
+            else:
+                hi = line_start
+        if lo > 0:
+            lo = mm.rfind(b'\n', 0, lo - 1) + 1
+        return lo
+
+    def _blocks(self, start, end):
+        pos = self._first_block(start)
+        mm = self._mm
+        while pos < self._size:
+            line_end = self._line_end(pos)
+            key, shard, offset, length = mm[pos:line_end].split(b'\t')
+            if end is not None and key >= end:
+                return
+            yield shard.decode('utf-8'), int(offset), int(length)
+            pos = line_end + 1
+
+    def _read_block(self, shard, offset, length):
+        """The lines of a block, from the cache if they're there."""
+        lines = self._cache.pop((shard, offset), None)
+        if lines is None:
+            fh = self._shards.get(shard)
+            if fh is None:
+                fh = self._shards[shard] = open(os.path.join(self.directory, shard), 'rb')
+            fh.seek(offset)
+            data = zlib.decompress(fh.read(length), 16 + zlib.MAX_WBITS)
+            lines = data.splitlines(True)
+            while len(self._cache) >= BLOCK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        self._cache[shard, offset] = lines
+        return lines
+
+    def range(self, start, end=None):
+        """Yield the lines from start, up to but not including end."""
+        if self._mm is None:
+            return
+        first = True
+        for shard, offset, length in self._blocks(start, end):
+            lines = self._read_block(shard, offset, length)
+            i = bisect.bisect_left(lines, start) if first else 0
+            first = False
+            for line in lines[i:]:
+                if end is not None and line >= end:
+                    return
+                yield line
+
+    def lookup(self, url, from_timestamp=None, to_timestamp=None):
+        """Yield the lines of url, oldest first, optionally only those from
+        from_timestamp and up to to_timestamp, either of which can be
+        shortened, e.g. b'2013' for anything in 2013."""
+        key = surt(url) + b' '
+        start = key + (from_timestamp or b'')
+        if to_timestamp:
+            end = key + to_timestamp + b'\xff'
+        else:
+            end = _prefix_end(key)
+        return self.range(start, end)
+
+    def prefix(self, url):
+        """Yield the lines of all urls whose keys start with url's, e.g.
+        everything under http://example.org/a/."""
+        key = surt(url)
+        return self.range(key, _prefix_end(key))
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._summary.close()
+        for fh in self._shards.values():
+            fh.close()
+        self._shards = {}
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
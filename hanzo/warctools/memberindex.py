@@ -0,0 +1,183 @@
+"""A sidecar index of the records in an archive, so they can be found by
+number or by record id without scanning the file.
+
+The sidecar sits next to the archive, named <archive>.idx, e.g.
+foo.warc.gz.idx. It is a text file starting with a version line and a line
+giving the size and mtime of the archive it was made from, followed by one
+line per record:
+
+    offset length header-length type record-id skip
+
+space separated, with - for anything unknown. offset and length are the
+raw, compressed, byte range of the record, and header-length the
+uncompressed length of its headers, i.e. where its content starts. When
+records share a gzip member, e.g. in a file gzipped as a whole, each has
+the offset of the member and no length, and skip is the number of records
+before it in the member, to be read past after seeking to offset.
+
+A sidecar made from an archive of another size or mtime, or of an older
+version, is ignored, as it may no longer match the archive.
+"""
+
+from collections import namedtuple
+import os.path
+
+from hanzo.warctools.stream import open_record_stream
+
+SUFFIX = '.idx'
+VERSION_LINE = b'#warctools member index 2\n'
+
+MemberIndexEntry = namedtuple('MemberIndexEntry',
+                              'offset length header_length type id skip')
+
+
+def index_filename(filename):
+    """The name of the sidecar index for an archive."""
+    return filename + SUFFIX
+
+
+class MemberIndex(object):
+    """The entries of a member index, in file order. Can be looked up by
+    position, raw offset or record id. size and mtime are those of the
+    archive it was made from, if known."""
+
+    def __init__(self, entries=(), size=None, mtime=None):
+        self.entries = list(entries)
+        self.size = size
+        self.mtime = mtime
+        self._offsets = None
+        self._ids = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, n):
+        return self.entries[n]
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self._offsets = self._ids = None
+
+    def by_offset(self, offset):
+        """The entry for the (first) record starting at offset, or None."""
+        if self._offsets is None:
+            self._offsets = dict((e.offset, e) for e in reversed(self.entries))
+        return self._offsets.get(offset)
+
+    def by_id(self, record_id):
+        """The entry for the record with the given WARC-Record-ID, or None."""
+        if self._ids is None:
+            self._ids = dict((e.id, e) for e in reversed(self.entries)
+                             if e.id is not None)
+        return self._ids.get(record_id)
+
+    def lookup(self, key):
+        """The Nth entry if key is an int, else the entry with key as its
+        record id. Returns None if there isn't one."""
+        if isinstance(key, int):
+            if 0 <= key < len(self.entries):
+                return self.entries[key]
+            return None
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return self.by_id(key)
+
+    def matches(self, st):
+        """True if the index was made from an archive with os.stat() st."""
+        return self.size == st.st_size and self.mtime == st.st_mtime
+
+    def write(self, out):
+        out.write(VERSION_LINE)
+        out.write(('#archive %s %r\n' % (self.size, self.mtime)).encode('ascii'))
+        for entry in self.entries:
+            fields = [b'-' if v is None else
+                      v if isinstance(v, bytes) else str(v).encode('ascii')
+                      for v in entry]
+            out.write(b' '.join(fields) + b'\n')
+
+    def save(self, filename):
+        with open(filename, 'wb') as out:
+            self.write(out)
+
+    @classmethod
+    def read(cls, fh):
+        line = fh.readline()
+        if line != VERSION_LINE:
+            raise Exception('not a member index: %r' % line)
+        line = fh.readline()
+        fields = line.split()
+        if len(fields) != 3 or fields[0] != b'#archive':
+            raise Exception('bad archive line in member index: %r' % line)
+        size = None if fields[1] == b'None' else int(fields[1])
+        mtime = None if fields[2] == b'None' else float(fields[2])
+
+        index = cls(size=size, mtime=mtime)
+        for line in fh:
+            fields = [None if v == b'-' else v for v in line.split()]
+            if len(fields) != len(MemberIndexEntry._fields):
+                raise Exception('bad line in member index: %r' % line)
+            offset, length, header_length, record_type, record_id, skip = fields
+            index.entries.append(MemberIndexEntry(
+                int(offset),
+                None if length is None else int(length),
+                None if header_length is None else int(header_length),
+                record_type, record_id, int(skip)))
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            return cls.read(fh)
+
+
+def build_member_index(filename=None, file_handle=None, record_class=None):
+    """Scan an archive once, skipping payloads, and return its
+    MemberIndex."""
+    index = MemberIndex()
+    if filename is not None and file_handle is None:
+        st = os.stat(filename)
+        index.size, index.mtime = st.st_size, st.st_mtime
+    fh = open_record_stream(record_class, filename, file_handle)
+    last_offset, skip = None, 0
+    try:
+        for (offset, length, record, errors) in fh.read_records(limit=None, lengths=True):
+            if record is None:
+                if errors:
+                    error_str = ",".join(str(error) for error in errors)
+                    raise Exception("Errors while decoding %s" % error_str)
+                break
+            skip = skip + 1 if offset is not None and offset == last_offset else 0
+            last_offset = offset
+            index.append(MemberIndexEntry(offset, length, fh.header_length,
+                                          record.type, getattr(record, 'id', None),
+                                          skip))
+    finally:
+        fh.close()
+    return index
+
+
+def write_member_index(filename, record_class=None):
+    """Build the member index for an archive and save it as its sidecar."""
+    index = build_member_index(filename, record_class=record_class)
+    index.save(index_filename(filename))
+    return index
+
+
+def load_member_index(filename):
+    """The member index from the sidecar of an archive, or None if it
+    doesn't have one, or has one that was made from a different version of
+    the archive, or is of an older version itself."""
+    name = index_filename(filename)
+    if not os.path.exists(name):
+        return None
+    with open(name, 'rb') as fh:
+        if fh.readline() != VERSION_LINE:
+            return None
+        fh.seek(0)
+        index = MemberIndex.read(fh)
+    if not index.matches(os.stat(filename)):
+        return None
+    return index
@@ -0,0 +1,217 @@
+"""Read a record-gzipped archive with a pool of workers.
+
+Every gzip member of a record-gzipped (w)arc can be inflated on its own, so
+the file is cut into byte ranges, each worker reads the records starting in
+its range, and the records are put back in file order. A worker starts at
+the first gzip member at or after the nominal start of its range that holds
+the start of a record, and reads on until a record starts at or after the
+nominal end.
+
+A gzip member found by searching may be part of a payload rather than a
+record of the file, so a range's start is only trusted if it is where the
+worker before it, reading member by member, found the first record after
+its range. Otherwise the range is read again from there, in the calling
+process. The first range starts where the stream was opened.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+from hanzo.warctools.stream import GzipRecordStream, GZIP_MAGIC
+
+RANGE_SIZE = 8 << 20 # raw bytes handed to a worker at a time
+SCAN_SIZE = 1 << 16
+
+
+def record_starts_at(fh, offset, record_parser):
+    """True if a gzip member holding the start of a record begins at
+    offset."""
+    fh.seek(offset)
+    stream = GzipRecordStream(fh, record_parser)
+    try:
+        start, record, errors = stream._read_record(offsets=True)
+    except Exception:
+        return False
+    return record is not None and start == offset
+
+
+def find_record_start(fh, offset, record_parser):
+    """The raw offset of the first gzip member at or after offset that
+    holds the start of a record, or None if there isn't one."""
+    if offset == 0:
+        return 0
+    pos = offset
+    while True:
+        fh.seek(pos)
+        buf = fh.read(SCAN_SIZE)
+        if len(buf) < len(GZIP_MAGIC):
+            return None
+        i = buf.find(GZIP_MAGIC)
+        while i >= 0:
+            if record_starts_at(fh, pos + i, record_parser):
+                return pos + i
+            i = buf.find(GZIP_MAGIC, i + 1)
+        # a header may straddle the end of the buffer
+        pos += len(buf) - len(GZIP_MAGIC) + 1
+
+
+def read_range(filename, record_class, start, end, lengths=False,
+               headers=False, head=None, begin=None):
+    """Read the records of filename from the first record found at or after
+    start, or from begin, if given, up to the first that starts at or after
+    end. Returns (begin, results, next_offset): where reading began, a list
+    of tuples, as RecordStream.read_records would yield them, with each
+    record's content read in to memory, and the offset of the record after
+    them, None at the end of the file. With headers, the tuples are those
+    of RecordStream._read_headers(limit, head), and payloads are skipped
+    instead."""
+    with open(filename, 'rb') as fh:
+        record_parser = record_class.make_parser()
+        if start > 0:
+            # the first record can configure the parser, e.g. an arc filedesc
+            GzipRecordStream(fh, record_parser)._read_record(offsets=True)
+
+        if begin is None:
+            begin = find_record_start(fh, start, record_parser)
+        if begin is None:
+            return None, [], None
+        if end is not None and begin >= end:
+            return begin, [], begin
+
+        fh.seek(begin)
+        stream = GzipRecordStream(fh, record_parser)
+        if headers:
+            records = stream._read_headers(limit=None, head=head)
+        else:
+            records = stream.read_records(limit=None, lengths=lengths)
+        results = []
+        for result in records:
+            offset, record = result[0], result[4 if headers else -2]
+            if end is not None and record is not None and offset >= end:
+                return begin, results, offset
+            if record is not None and record.content_file is not None:
+                record.content # read it while we can
+            results.append(result)
+        return begin, results, None
+
+
+class ParallelRecordStream(object):
+    """Reads the records of a local, record-gzipped archive in a pool of
+    worker processes (or threads), yielding them in file order, like a
+    RecordStream. Each record's content has already been read into memory,
+    so content_file is unavailable. Normally created through
+    open_archive(..., workers=N)."""
+
+    def __init__(self, file_handle, filename, record_class, workers,
+                 threads=False, range_size=RANGE_SIZE):
+        self.fh = file_handle
+        self.filename = filename
+        self.record_class = record_class
+        self.workers = workers
+        self.threads = threads
+        self.range_size = range_size
+        self.start = file_handle.tell()
+        self.size = os.fstat(file_handle.fileno()).st_size
+
+    def _ranges(self):
+        starts = list(range(self.start, self.size, self.range_size)) or [self.start]
+        ends = starts[1:] + [None]
+        return zip(starts, ends)
+
+    def _results(self, lengths, headers=False, head=None):
+        if self.threads:
+            executor = ThreadPoolExecutor(self.workers)
+        else:
+            executor = ProcessPoolExecutor(self.workers)
+
+        with executor:
+            pending = []
+            ranges = iter(self._ranges())
+            expected = self.start # where the next range must begin
+            while True:
+                # keep a few ranges in flight per worker, but not the file
+                while len(pending) < 2 * self.workers:
+                    try:
+                        start, end = next(ranges)
+                    except StopIteration:
+                        break
+                    # the first range begins where the stream was opened
+                    begin = self.start if start == self.start else None
+                    pending.append((start, end, executor.submit(
+                        read_range, self.filename, self.record_class, start, end,
+                        lengths, headers, head, begin)))
+                if not pending:
+                    break
+                try:
+                    start, end, future = pending.pop(0)
+                    try:
+                        begin, results, next_offset = future.result()
+                        confirmed = begin == expected
+                    except Exception:
+                        # it may have begun in a payload and read on into it;
+                        # a real error is raised again below
+                        confirmed = False
+                    if expected is None:
+                        # the file ended in an earlier range
+                        results, next_offset = [], None
+                    elif not confirmed:
+                        # a gzip member inside a payload: read the range
+                        # again from where the last one ended
+                        begin, results, next_offset = read_range(
+                            self.filename, self.record_class, start, end,
+                            lengths, headers, head, expected)
+                    expected = next_offset
+                    for result in results:
+                        yield result
+                except GeneratorExit:
+                    for _, _, future in pending:
+                        future.cancel()
+                    raise
+
+    def _limit(self, results, limit, record_index=-2):
+        nrecords = 0
+        for result in results:
+            if limit is not None and nrecords >= limit:
+                return
+            nrecords += 1
+            yield result
+            if not result[record_index]:
+                return
+
+    def read_records(self, limit=1, offsets=True, lengths=False):
+        """See RecordStream.read_records. Offsets are always given."""
+        return self._limit(self._results(lengths), limit)
+
+    def read_headers(self, limit=None):
+        """See RecordStream.read_headers"""
+        for (offset, length, payload_offset, payload_length, record,
+             errors, _) in self._limit(self._results(True, headers=True), limit, 4):
+            if record:
+                yield (offset, length, payload_offset, payload_length,
+                       record.headers, record.errors)
+            else:
+                yield (offset, None, None, None, None, errors)
+
+    def scan(self, limit=None, head=None):
+        """See RecordStream.scan. head is called in the workers, so it must
+        be a function that can be pickled."""
+        results = self._results(True, headers=True, head=head)
+        for (offset, length, payload_offset, payload_length, record,
+             errors, record_head) in self._limit(results, limit, 4):
+            if record:
+                yield record.header_view(offset, length, payload_offset,
+                                         payload_length, record_head)
+            elif errors:
+                error_str = ",".join(str(error) for error in errors)
+                raise Exception("Errors while decoding %s" % error_str)
+
+    def __iter__(self):
+        for (offset, record, errors) in self.read_records(limit=None):
+            if record:
+                yield record
+            elif errors:
+                error_str = ",".join(str(error) for error in errors)
+                raise Exception("Errors while decoding %s" % error_str)
+
+    def close(self):
+        self.fh.close()
@@ -0,0 +1,285 @@
+"""Read ahead in a background thread.
+
+Normally reading, inflating and parsing records all happen one after the
+other on the caller's thread. With prefetch=True, open_record_stream reads
+and inflates the file in a background thread instead, into a bounded
+queue, while the caller parses the records. zlib and file reads release
+the GIL, so the work overlaps.
+
+Seeking stops the thread and starts a new one at the new position.
+Payloads are inflated rather than jumped over, as the thread is already
+ahead of them.
+
+The thread holds the file it reads, but not the object reading ahead for
+the caller, so when that is dropped without being closed, e.g. when the
+caller stops iterating over a stream part way, the thread stops too.
+"""
+
+import threading
+import weakref
+
+try:
+    import queue
+except ImportError: # python2
+    import Queue as queue
+
+from hanzo.warctools.stream import GzipMemberFile, RAW_CHUNK_SIZE
+
+QUEUE_SIZE = 16          # batches of work waiting for the caller
+BATCH_BYTES = 4 * RAW_CHUNK_SIZE
+BATCH_EVENTS = 64
+
+_START, _DATA, _END, _EOF, _ERROR = range(5)
+
+
+class _Worker(object):
+    """Runs produce(fileobj, put) in a daemon thread, with put() adding to a
+    bounded queue, until produce returns, or the worker is stopped or owner
+    is garbage collected."""
+
+    def __init__(self, owner, produce, fileobj):
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self._stopping = False
+        self._finalizer = weakref.finalize(owner, self._cancel)
+        self._thread = threading.Thread(target=self._run, args=(produce, fileobj))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, produce, fileobj):
+        try:
+            produce(fileobj, self._put)
+        except Exception as e:
+            self._put([(_ERROR, e)])
+
+    def _cancel(self):
+        # the thread sees this within a put() timeout
+        self._stopping = True
+
+    def _put(self, item):
+        while not self._stopping:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        return self.queue.get()
+
+    def stop(self):
+        self._finalizer.detach()
+        self._stopping = True
+        while self._thread.is_alive():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self._thread.join(0.01)
+
+
+def _produce_members(fileobj, put):
+    """Inflate gzip members from fileobj, putting batches of events."""
+    inner = GzipMemberFile(fileobj)
+    events = []
+    size = 0
+    while True:
+        if inner._decomp is None:
+            if not inner._start_member():
+                events.append((_EOF, inner.raw_offset))
+                put(events)
+                return
+            events.append((_START, inner.member_offset))
+        elif inner._decomp.eof:
+            inner._end_member()
+            events.append((_END, inner.raw_offset))
+        else:
+            data = inner._inflate()
+            if data:
+                events.append((_DATA, data, inner.raw_offset))
+                size += len(data)
+
+        if size >= BATCH_BYTES or len(events) >= BATCH_EVENTS:
+            if not put(events):
+                return
+            events = []
+            size = 0
+
+
+def _produce_chunks(fileobj, put):
+    """Read fileobj, putting a chunk at a time, and an empty one at the end."""
+    while True:
+        data = fileobj.read(BATCH_BYTES)
+        if not put([(_DATA, data)]) or not data:
+            return
+
+
+class _Member(object):
+    """Stands in for the decompressor of the member being read."""
+    eof = False
+
+
+class PrefetchGzipMemberFile(GzipMemberFile):
+    """A GzipMemberFile that inflates ahead of the reader in a background
+    thread. The thread sends the starts and ends of members along with the
+    inflated data, so the reader keeps track of members as before."""
+
+    def __init__(self, fileobj):
+        self._worker = None
+        self._events = []
+        GzipMemberFile.__init__(self, fileobj)
+
+    def _stop(self):
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        self._events = []
+
+    def reset(self):
+        self._stop()
+        GzipMemberFile.reset(self)
+
+    def seek_raw(self, offset, whence=0):
+        self._stop()
+        GzipMemberFile.seek_raw(self, offset, whence)
+
+    def _next_event(self):
+        if not self._events:
+            if self._worker is None:
+                self._worker = _Worker(self, _produce_members, self.fileobj)
+            self._events = self._worker.get()
+            self._events.reverse()
+        return self._events.pop()
+
+    def _fill(self, next_member=True):
+        while True:
+            event = self._next_event()
+            kind = event[0]
+            if kind == _DATA:
+                self._buf = event[1]
+                self._pos = 0
+                self._member_out += len(event[1])
+                self.raw_offset = event[2]
+                return True
+            elif kind == _START:
+                if not next_member:
+                    self._events.append(event)
+                    return False
+                self.raw_offset = self.member_offset = event[1]
+                self.member_length = None
+                self._member_out = 0
+                self._decomp = _Member()
+            elif kind == _END:
+                self.raw_offset = event[1]
+                self._end_member()
+                if not next_member:
+                    return False
+            elif kind == _EOF:
+                self.raw_offset = event[1]
+                self._events.append(event)
+                return False
+            else:
+                self._events.append(event)
+                raise event[1]
+
+    def skip_member(self, length):
+        """Jump to the end of the current member. The background thread has
+        most likely inflated it already, so this just drops the data."""
+        while self._decomp is not None and self._fill(next_member=False):
+            pass
+        self._buf = b''
+        self._pos = 0
+
+    def close(self):
+        self._stop()
+        GzipMemberFile.close(self)
+
+
+class PrefetchFile(object):
+    """A readable file that reads ahead of the reader in a background
+    thread, for uncompressed archives read from pipes or other files that
+    aren't memory mapped. It can't seek."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        try:
+            self._pos = fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            self._pos = 0
+        self._buf = b''
+        self._bufpos = 0
+        self._eof = False
+        self._worker = None
+
+    def _fill(self):
+        if self._eof:
+            return False
+        if self._worker is None:
+            self._worker = _Worker(self, _produce_chunks, self.fileobj)
+        event = self._worker.get()[0]
+        if event[0] == _ERROR:
+            raise event[1]
+        if not event[1]:
+            self._eof = True
+            return False
+        self._buf = event[1]
+        self._bufpos = 0
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0:
+            if self._bufpos >= len(self._buf) and not self._fill():
+                break
+            end = len(self._buf)
+            if size >= 0:
+                end = min(end, self._bufpos + size)
+                size -= end - self._bufpos
+            chunks.append(self._buf[self._bufpos:end])
+            self._pos += end - self._bufpos
+            self._bufpos = end
+        return b''.join(chunks)
+
+    def peek_to(self, delim, limit):
+        """See GzipMemberFile.peek_to"""
+        if self._bufpos >= len(self._buf) and not self._fill():
+            return None
+        end = self._buf.find(delim, self._bufpos, self._bufpos + limit)
+        if end < 0:
+            return None
+        return self._buf[self._bufpos:end + len(delim)]
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0:
+            if self._bufpos >= len(self._buf) and not self._fill():
+                break
+            end = len(self._buf)
+            if size >= 0:
+                end = min(end, self._bufpos + size)
+            nl = self._buf.find(b'\n', self._bufpos, end)
+            if nl >= 0:
+                end = nl + 1
+            if size >= 0:
+                size -= end - self._bufpos
+            chunks.append(self._buf[self._bufpos:end])
+            self._pos += end - self._bufpos
+            self._bufpos = end
+            if nl >= 0:
+                break
+        return b''.join(chunks)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        self.fileobj.close()
@@ -1,10 +1,10 @@
 """a skeleton class for archive records"""
 
 from __future__ import print_function
-from gzip import GzipFile
 import re
 
 from hanzo.warctools.stream import open_record_stream
+from hanzo.warctools.compress import GzipCompressor, CompressingFile
 
 strip = re.compile(br'[^\w\t \|\\\/]')
 
@@ -44,6 +44,30 @@ class ArchiveRecord(object):
 
     HEADERS = staticmethod(add_headers)
 
+    @property
+    def headers(self):
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers = headers
+        self._header_map = None
+
+    def _get_header_map(self):
+        """A dict of lowercased header name to the first value with that
+        name, rebuilt when headers is replaced or changed in any way. A
+        copy of the list it was built from is kept to check that against,
+        which is cheap, as the (name, value) tuples are mostly the same
+        objects."""
+        headers = self._headers
+        if self._header_map is None or self._header_map_headers != headers:
+            header_map = {}
+            for k, v in headers:
+                header_map.setdefault(k.lower(), v)
+            self._header_map = header_map
+            self._header_map_headers = list(headers)
+        return self._header_map
+
     @property
     def date(self):
         return self.get_header(self.DATE)
@@ -78,13 +102,26 @@ class ArchiveRecord(object):
         record can only be written once, since writing the record entails
         reading content_file and advancing the file position. Subsequent
         attempts to write using content_file will throw an exception.
+        A content_file the record made itself, like the spool of
+        add_digests, is closed once it has been written.
         """
         return self._content_file
 
     @content_file.setter
     def content_file(self, fh):
+        if getattr(self, '_owns_content_file', False):
+            self._content_file.close()
         self._content_file = fh
         self._content_file_valid = fh is not None
+        self._owns_content_file = False
+
+    def _content_file_used(self):
+        """Note that content_file has been read through to write the
+        record, closing it if the record made it."""
+        self._content_file_valid = False
+        if self._owns_content_file:
+            self._content_file.close()
+            self._owns_content_file = False
 
     @property
     def content(self):
@@ -132,14 +169,19 @@ class ArchiveRecord(object):
     def get_header(self, name):
         """Returns value of first header found matching name, case
         insensitively."""
-        for k, v in self.headers:
-            if name.lower() == k.lower():
-                return v
+        return self._get_header_map().get(name.lower())
 
     def set_header(self, name, value):
         self.headers = [(k, v) for (k, v) in self.headers if k != name]
         self.headers.append((name, value))
 
+    def header_view(self, offset=None, length=None, payload_offset=None,
+                    payload_length=None, head=None):
+        """A RecordHeaderView of this record's headers and errors."""
+        return RecordHeaderView(type(self), self.headers,
+                                self.errors or NO_ERRORS, offset, length,
+                                payload_offset, payload_length, head)
+
     def dump(self, content=True):
         print('Headers:')
         for (h, v) in self.headers:
@@ -164,37 +206,54 @@ class ArchiveRecord(object):
             for e in self.errors:
                 print('\t' + e)
 
-    def write_to(self, out, newline=b'\x0D\x0A', gzip=False):
+    def write_to(self, out, newline=b'\x0D\x0A', gzip=False, digests=None):
+        """Write the record to out. With gzip, it is written as a gzip member;
+        gzip can be a compress.GzipCompressor to use, which is quicker when
+        writing many records. With digests, the name of a hashlib
+        algorithm, its digest headers are set from its content first (see
+        add_digests)."""
         if self.content_file is not None:
             if not self._content_file_valid:
                 raise Exception('cannot write record because content_file has already been used')
 
+        if digests:
+            self.add_digests(digests)
+
         if gzip:
-            if hasattr(out, 'mode'):
-                out = GzipFile(fileobj=out)
-            else:
-                out = GzipFile(fileobj=out, mode='ab')
+            if not isinstance(gzip, GzipCompressor):
+                gzip = GzipCompressor()
+            out = CompressingFile(out, gzip)
+            out.start()
 
         self._write_to(out, newline)
 
         if gzip:
-            out.flush()
-            out.close()
+            out.end()
 
         if self.content_file is not None:
-            self._content_file_valid = False
+            self._content_file_used()
 
     def _write_to(self, out, newline):
         raise AssertionError('this is bad')
 
+    def add_digests(self, algorithm):
+        raise Exception('%s records have no digest headers' % type(self).__name__)
+
     ### class methods for parsing
     @classmethod
     def open_archive(cls, filename=None, file_handle=None,
-                     mode="rb", gzip="auto", offset=None, length=None):
-        """Generically open an archive - magic autodetect"""
+                     mode="rb", gzip="auto", offset=None, length=None,
+                     member_index=None, workers=None, checkpoints=None,
+                     prefetch=False):
+        """Generically open an archive - magic autodetect. With workers > 1,
+        a local record-gzipped file is read by that many processes.
+        checkpoints are zran.Checkpoints for a file gzipped as a whole.
+        With prefetch, the file is read ahead in a background thread."""
         if cls is ArchiveRecord:
             cls = None # means guess
-        return open_record_stream(cls, filename, file_handle, mode, gzip, offset, length)
+        return open_record_stream(cls, filename, file_handle, mode, gzip, offset, length,
+                                  member_index=member_index, workers=workers,
+                                  checkpoints=checkpoints, prefetch=prefetch)
 
     @classmethod
     def make_parser(self):
@@ -203,3 +262,68 @@ class ArchiveRecord(object):
         record-specific errors are contained in the record - errors is only
         used when *nothing* could be parsed"""
         raise Exception()
+
+
+NO_ERRORS = ()  # shared by every RecordHeaderView without errors
+
+
+class RecordHeaderView(object):
+    """Just the headers of a record, with the offsets and lengths of it and
+    its payload in the archive when they are known. Much smaller than a record, for keeping
+    hold of many at once, e.g. while building an index. get_header and the
+    header properties work as they do on the record class."""
+
+    __slots__ = ('record_class', 'headers', 'errors', 'offset', 'length',
+                 'payload_offset', 'payload_length', 'head', '_header_map')
+
+    def __init__(self, record_class, headers, errors=NO_ERRORS,
+                 offset=None, length=None, payload_offset=None,
+                 payload_length=None, head=None):
+        self.record_class = record_class
+        self.headers = headers
+        self.errors = errors
+        self.offset = offset
+        self.length = length
+        self.payload_offset = payload_offset
+        self.payload_length = payload_length
+        self.head = head
+        self._header_map = None
+
+    def get_header(self, name):
+        """Returns value of first header found matching name, case
+        insensitively."""
+        if self._header_map is None:
+            header_map = {}
+            for k, v in self.headers:
+                header_map.setdefault(k.lower(), v)
+            self._header_map = header_map
+        return self._header_map.get(name.lower())
+
+    @property
+    def type(self):
+        return self.get_header(self.record_class.TYPE)
+
+    @property
+    def url(self):
+        return self.get_header(self.record_class.URL)
+
+    @property
+    def date(self):
+        return self.get_header(self.record_class.DATE)
+
+    @property
+    def id(self):
+        name = getattr(self.record_class, 'ID', None)
+        return self.get_header(name) if name is not None else None
+
+    @property
+    def content_type(self):
+        return self.get_header(self.record_class.CONTENT_TYPE)
+
+    @property
+    def content_length(self):
+        content_length = self.get_header(self.record_class.CONTENT_LENGTH)
+        return int(content_length) if content_length is not None else None
+
+    def __repr__(self):
+        return '<RecordHeaderView %r at %r>' % (self.type, self.offset)
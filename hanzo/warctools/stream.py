@@ -1,23 +1,58 @@
 """Read records from normal file and compressed file"""
 
 import gzip
+import mmap
+import os
 import re
+import stat
+import zlib
 
 from hanzo.warctools.archive_detect import is_gzip_file, guess_record_type
+from hanzo.warctools.batch import read_batch
+from hanzo.warctools.filecopy import read_range, _fileno
 
 def open_record_stream(record_class=None, filename=None, file_handle=None,
-                       mode="rb", gzip="auto", offset=None, length=None):
+                       mode="rb", gzip="auto", offset=None, length=None,
+                       member_index=None, workers=None, checkpoints=None,
+                       prefetch=False):
     """Can take a filename or a file_handle. Normally called
     indirectly from A record class i.e WarcRecord.open_archive. If the
-    first parameter is None, will try to guess"""
+    first parameter is None, will try to guess
 
+    member_index is an optional memberindex.MemberIndex for the file. A
+    record-gzipped stream uses it to jump over the members it covers without
+    inflating them.
+
+    If workers is more than one, and filename is a local record-gzipped
+    file, a parallel.ParallelRecordStream reads it with that many worker
+    processes.
+
+    checkpoints is an optional zran.Checkpoints for a file gzipped as a
+    whole (gzip='file'), so it can seek without inflating from the start.
+    offset is then an uncompressed offset. A local file with a checkpoint
+    sidecar is read this way, loading the checkpoints from the sidecar,
+    even when gzip is 'auto'. Sidecars are only made for files that are a
+    single gzip member, and one made from a different version of the file
+    is ignored.
+
+    If prefetch is true, a record-gzipped file is read and inflated ahead
+    of the caller in a background thread, as is an uncompressed file that
+    can't be memory mapped. See prefetch."""
+
+    local_file = False
     if file_handle is None:
         if filename.startswith('s3://'):
             from . import s3
             file_handle = s3.open_url(filename, offset=offset, length=length)
         else:
             file_handle = open(filename, mode=mode)
-            if offset is not None:
+            local_file = True
+            if gzip in ('auto', 'file') and checkpoints is None:
+                from . import zran
+                checkpoints = zran.load_checkpoints(filename)
+                if checkpoints is not None:
+                    gzip = 'file'
+            if offset is not None and gzip != 'file':
                 file_handle.seek(offset)
 
     if record_class == None:
@@ -38,13 +73,34 @@ def open_record_stream(record_class=None, filename=None, file_handle=None,
             gzip = None
 
     if gzip == 'record':
-        return GzipRecordStream(file_handle, record_parser)
+        if workers is not None and workers > 1 and local_file:
+            from .parallel import ParallelRecordStream
+            return ParallelRecordStream(file_handle, filename, record_class, workers)
+        return GzipRecordStream(file_handle, record_parser, member_index, prefetch)
     elif gzip == 'file':
-        return GzipFileStream(file_handle, record_parser)
+        stream = GzipFileStream(file_handle, record_parser, checkpoints)
+        if local_file and offset is not None:
+            stream.seek(offset)
+        return stream
+    elif local_file and mode == "rb" and can_mmap(file_handle):
+        return MmapRecordStream(file_handle, record_parser)
+    elif prefetch:
+        from .prefetch import PrefetchFile
+        return RecordStream(PrefetchFile(file_handle), record_parser)
     else:
         return RecordStream(file_handle, record_parser)
 
 
+def can_mmap(file_handle):
+    """True if file_handle is a non-empty regular file that can be memory
+    mapped."""
+    try:
+        st = os.fstat(file_handle.fileno())
+    except (AttributeError, OSError, ValueError):
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size > 0
+
+
 class RecordStream(object):
     """A readable/writable stream of Archive Records. Can be iterated over
     or read_records can give more control, and potentially offset information.
@@ -57,22 +113,150 @@ class RecordStream(object):
         # Normally set by the record parser based on the Content-Length header.
         self.bytes_to_eoc = None
 
+        # Number of (uncompressed) bytes from the start of the last record
+        # read to the start of its content, if known.
+        self.header_length = None
+
+        # Size of a seekable file_handle, once it is needed.
+        self._size = None
+
     def seek(self, offset, pos=0):
         """Same as a seek on a file"""
         self.fh.seek(offset, pos)
 
-    def read_records(self, limit=1, offsets=True):
+    def read_records(self, limit=1, offsets=True, lengths=False):
         """Yield a tuple of (offset, record, errors) where
         Offset is either a number or None.
         Record is an object and errors is an empty list
-        or record is none and errors is a list"""
+        or record is none and errors is a list
+
+        If lengths is true, yield (offset, length, record, errors) instead,
+        where length is the number of raw bytes from offset to the start of
+        the next record: the compressed length of the gzip member for
+        record-gzipped files. The end of a record is only known once it has
+        been read, so in this mode each record's payload is skipped before
+        the record is yielded, and its content_file is unavailable unless it
+        is independent of the stream. length is None whenever it cannot be
+        trusted, e.g. when several records share one gzip member."""
+        nrecords = 0
+        while limit is None or nrecords < limit:
+            offset, record, errors = self._read_record(offsets or lengths)
+            nrecords += 1
+            if lengths:
+                length = None
+                if record:
+                    end = self._end_of_record()
+                    if record.content_file is self:
+                        record.content_file = None
+                    if end is not None and offset is not None:
+                        length = end - offset
+                yield (offset, length, record, errors)
+            else:
+                yield (offset, record, errors)
+            if not record:
+                break
+
+    def _read_headers(self, limit, head=None):
+        """Like read_records(lengths=True), with the payload's offset and
+        length too, and with content_file always detached. Yields (offset,
+        length, payload_offset, payload_length, record, errors, head), where
+        head is what head(record) returned, if head was given, having been
+        called before the payload was skipped."""
         nrecords = 0
         while limit is None or nrecords < limit:
-            offset, record, errors = self._read_record(offsets)
+            offset, record, errors = self._read_record(True)
             nrecords += 1
-            yield (offset, record, errors)
             if not record:
+                yield (offset, None, None, None, record, errors, None)
                 break
+            payload_length = self.bytes_to_eoc
+            payload_offset = self._payload_offset(offset)
+            record_head = None
+            if head is not None and record.content_file is not None:
+                record_head = head(record)
+            end = self._end_of_record()
+            record.content_file = None
+            length = None
+            if end is not None and offset is not None:
+                length = end - offset
+            yield (offset, length, payload_offset, payload_length, record, errors,
+                   record_head)
+
+    @property
+    def raw_file(self):
+        """The file offsets are raw offsets in, which records can be copied
+        out of verbatim with filecopy.copy_range, or None if they can't."""
+        return self.fh if self._seekable() else None
+
+    # are the raw bytes of records gzip members?
+    raw_gzip = False
+
+    def raw_length(self, offset, trailer=None):
+        """For the record just read from offset, the number of raw bytes
+        from offset to the start of the next record, as in
+        read_records(lengths=True), for copying it verbatim from raw_file.
+        This skips the rest of the record, so its content_file can't be read
+        afterwards, unless it is independent of the stream. Returns None,
+        leaving the record as it was, if the record can't be copied, or if
+        trailer is given and the record's content isn't followed by exactly
+        that, e.g. its record class's TRAILER."""
+        if self.raw_file is None or offset is None or self.bytes_to_eoc is None:
+            return None
+        if trailer is not None:
+            data = read_range(self.raw_file, self._content_end(), len(trailer) + 1)
+            if data[:len(trailer)] != trailer or data[len(trailer):] in (b'\r', b'\n'):
+                return None
+        end = self._end_of_record()
+        if end is None:
+            return None
+        return end - offset
+
+    def _content_end(self):
+        return self.fh.tell() + self.bytes_to_eoc
+
+    def _payload_offset(self, offset):
+        if offset is None or self.header_length is None:
+            return None
+        return offset + self.header_length
+
+    def read_headers(self, limit=None):
+        """Yields (offset, length, payload_offset, payload_length, headers,
+        errors) for each record, for tools that only need the headers. No
+        record or content_file is handed out, so each payload is skipped in
+        the cheapest way the stream can: a seek, a jump to the end of its
+        gzip member when the stream has a member index giving its length, or
+        failing those, reading, and inflating, past it. headers is None at
+        the end of the stream or when nothing could be parsed. payload_offset
+        is None when offsets are those of gzip members, as the payload is
+        inside the member."""
+        for (offset, length, payload_offset, payload_length,
+             record, errors, _) in self._read_headers(limit):
+            if record:
+                yield (offset, length, payload_offset, payload_length,
+                       record.headers, record.errors)
+            else:
+                yield (offset, None, None, None, None, errors)
+
+    def scan(self, limit=None, head=None):
+        """Yields a compact RecordHeaderView for each record, rather than the
+        record itself, raising on errors like iterating over the stream.
+        Payloads are skipped as in read_headers, but first, if head is
+        given, head(record) is called, to read what it needs from the start
+        of record.content_file, and what it returns is kept as view.head."""
+        for (offset, length, payload_offset, payload_length,
+             record, errors, record_head) in self._read_headers(limit, head):
+            if record:
+                yield record.header_view(offset, length, payload_offset,
+                                         payload_length, record_head)
+            elif errors:
+                error_str = ",".join(str(error) for error in errors)
+                raise Exception("Errors while decoding %s" % error_str)
+
+    def read_batch(self, n, fields=()):
+        """A batch.RecordBatch of the next n records, or fewer at the end of
+        the stream, with a column of values for each header name in fields.
+        Payloads are skipped as in read_headers."""
+        return read_batch(self.read_headers(n), n, fields)
 
     def __iter__(self):
         while True:
@@ -99,8 +283,33 @@ class RecordStream(object):
                 break
 
         record, errors, offset = self.record_parser.parse(self, offset, line)
+
+        if record is not None and offset is not None:
+            self.header_length = self.fh.tell() - offset
+        else:
+            self.header_length = None
+
         return offset, record, errors
 
+    def _end_of_record(self):
+        """Skip the rest of the current record, and any record terminator
+        following it. Returns the raw offset where the record ends, or None
+        if that isn't known."""
+        if self.bytes_to_eoc is None:
+            return None
+        self._skip_to_eoc()
+        self.bytes_to_eoc = None
+
+        if not self._seekable():
+            return None
+
+        while True:
+            end = self.fh.tell()
+            line = self.fh.readline()
+            if not line or line.strip(b'\r\n'):
+                self.fh.seek(end)
+                return end
+
     def write(self, record):
         """Writes an archive record to the stream"""
         record.write_to(self)
@@ -109,15 +318,45 @@ class RecordStream(object):
         """Close the underlying file handle."""
         self.fh.close()
 
+    def _seekable(self):
+        seekable = getattr(self.fh, 'seekable', None)
+        return seekable is not None and seekable()
+
     def _skip_to_eoc(self):
         if self.bytes_to_eoc is None:
             raise Exception('bytes_to_eoc is unset, cannot skip to end')
 
+        if self._seekable():
+            pos = self.fh.tell()
+            end = self._file_size()
+            if end - pos < self.bytes_to_eoc:
+                # the file may have grown since
+                end = self._file_size(refresh=True)
+                if end - pos < self.bytes_to_eoc:
+                    raise EOFError('expected {} bytes but only read {}'.format(self.bytes_to_eoc, end - pos))
+            self.fh.seek(pos + self.bytes_to_eoc)
+            self.bytes_to_eoc = 0
+            return
+
         while self.bytes_to_eoc > 0:
             read_size = min(CHUNK_SIZE, self.bytes_to_eoc)
             buf = self._read(read_size)
             if len(buf) < read_size:
-                raise Exception('expected {} bytes but only read {}'.format(read_size, len(buf)))
+                raise EOFError('expected {} bytes but only read {}'.format(read_size, len(buf)))
+
+    def _file_size(self, refresh=False):
+        """The size of the seekable file_handle, found once rather than for
+        each record, or again if refresh is true: from os.fstat for a plain
+        file, else by seeking to the end and back."""
+        if self._size is None or refresh:
+            fd = _fileno(self.fh)
+            if fd is not None:
+                self._size = os.fstat(fd).st_size
+            else:
+                pos = self.fh.tell()
+                self._size = self.fh.seek(0, 2)
+                self.fh.seek(pos)
+        return self._size
 
     def _read(self, count=None):
         """Raw read, will read into next record if caller isn't careful"""
@@ -154,6 +393,25 @@ class RecordStream(object):
         b[:len(tmp)] = tmp
         return len(tmp)
 
+    def peek_header_block(self):
+        """The bytes from the current position up to and including the next
+        \\r\\n\\r\\n, without reading them, if they are already buffered and
+        shorter than HEADER_BLOCK_LIMIT. Otherwise None. Lets a parser take
+        all of a record's headers at once, falling back on reading them line
+        by line."""
+        if self.bytes_to_eoc is not None:
+            return None
+        peek_to = getattr(self.fh, 'peek_to', None)
+        if peek_to is not None:
+            return peek_to(b'\r\n\r\n', HEADER_BLOCK_LIMIT)
+        peek = getattr(self.fh, 'peek', None)
+        if peek is not None:
+            buf = peek(HEADER_BLOCK_LIMIT)
+            end = buf.find(b'\r\n\r\n')
+            if end >= 0:
+                return buf[:end + 4]
+        return None
+
     def readline(self, maxlen=None):
         """Safe readline for reading content, will not read past the end of the
         payload, assuming self.bytes_to_eoc is set. The record's trailing
@@ -179,36 +437,101 @@ class RecordStream(object):
         return result
 
 CHUNK_SIZE = 8192 # the size to read in, make this bigger things go faster.
+HEADER_BLOCK_LIMIT = 65536 # longest header block peek_header_block returns
+
+
+class MemoryViewFile(object):
+    """A read only file over buf[start:end], where buf is a mmap, bytes or
+    bytearray. Used as the content_file of records read from a
+    MmapRecordStream, bounded to the record's payload. getbuffer() returns
+    the unread part as a memoryview, without copying it. If buf maps all of
+    fileobj, file_range() says where the unread part is in it, for
+    filecopy.copy_file."""
+
+    def __init__(self, buf, start=0, end=None, fileobj=None):
+        self.buf = buf
+        self.start = start
+        self.end = len(buf) if end is None else end
+        self.pos = start
+        self.fileobj = fileobj
+
+    def getbuffer(self):
+        return memoryview(self.buf)[self.pos:self.end]
+
+    def file_range(self):
+        if self.fileobj is None:
+            return None
+        return self.fileobj, self.pos, max(0, self.end - self.pos)
+
+    def tell(self):
+        return self.pos - self.start
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos - self.start
+        elif whence == 2:
+            offset += self.end - self.start
+        self.pos = self.start + max(0, min(offset, self.end - self.start))
+        return self.pos - self.start
 
-class GeeZipFile(gzip.GzipFile):
-    """Extends gzip.GzipFile to remember self.member_offset, the raw file
-    offset of the current gzip member."""
+    def read(self, count=None):
+        if count is None or count < 0:
+            end = self.end
+        else:
+            end = min(self.pos + count, self.end)
+        result = self.buf[self.pos:end]
+        self.pos = max(self.pos, end)
+        return result
 
-    def __init__(self, filename=None, mode=None,
-                 compresslevel=9, fileobj=None, mtime=None):
-        # ignore mtime for python 2.6
-        gzip.GzipFile.__init__(self, filename=filename, mode=mode, compresslevel=compresslevel, fileobj=fileobj)
-        self.member_offset = None
+    def readinto(self, b):
+        n = max(0, min(len(b), self.end - self.pos))
+        b[:n] = memoryview(self.buf)[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def readline(self, maxlen=None):
+        end = self.end
+        if maxlen is not None and maxlen >= 0:
+            end = min(self.pos + maxlen, end)
+        nl = self.buf.find(b'\n', self.pos, end)
+        end = end if nl < 0 else nl + 1
+        result = self.buf[self.pos:end]
+        self.pos = max(self.pos, end)
+        return result
 
-    # hook in to the place we seem to be able to reliably get the raw gzip
-    # member offset
-    def _read(self, size=1024):
-        if self._new_member:
-            try:
-                # works for python3.2
-                self.member_offset = self.fileobj.tell() - self.fileobj._length + (self.fileobj._read or 0)
-            except AttributeError:
-                # works for python2.7
-                self.member_offset = self.fileobj.tell()
+    def close(self):
+        self.pos = self.end
 
-        return gzip.GzipFile._read(self, size)
 
-class GzipRecordStream(RecordStream):
-    """A stream to read/write concatted file made up of gzipped
-    archive records"""
+class MmapRecordStream(RecordStream):
+    """A RecordStream over a memory mapped, uncompressed local file.
+
+    Lines are found with mmap.find instead of going through the file
+    object, skipping a payload is just moving the position, and each
+    record's content_file is a MemoryViewFile over its payload, so nothing
+    is copied until it is read. Unlike other streams, content_file stays
+    valid after the next record is read, until the stream is closed."""
+
     def __init__(self, file_handle, record_parser):
-        RecordStream.__init__(self, GeeZipFile(fileobj=file_handle), record_parser)
-        self.raw_fh = file_handle
+        RecordStream.__init__(self, file_handle, record_parser)
+        self.mm = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mm)
+        self.pos = file_handle.tell()
+
+    def seek(self, offset, pos=0):
+        """Same as a seek on a file"""
+        if pos == 1:
+            offset += self.pos
+        elif pos == 2:
+            offset += self.size
+        self.pos = offset
+        self.bytes_to_eoc = None
+
+    def tell(self):
+        return self.pos
+
+    def _content_end(self):
+        return self.pos + self.bytes_to_eoc
 
     def _read_record(self, offsets):
         if self.bytes_to_eoc is not None:
@@ -217,36 +540,342 @@ class GzipRecordStream(RecordStream):
 
         # handle any sort of valid or invalid record terminator
         while True:
-            line = self.fh.readline()
-            if not re.match(br'^[\r\n]+$', line):
+            offset = self.pos if offsets else None
+            line = self._readline(self.size)
+            if not line or line.strip(b'\r\n'):
                 break
 
-        record, errors, _offset = \
-            self.record_parser.parse(self, offset=None, line=line)
+        record, errors, offset = self.record_parser.parse(self, offset, line)
+
+        if record is not None and offset is not None:
+            self.header_length = self.pos - offset
+        else:
+            self.header_length = None
 
-        offset = self.fh.member_offset
+        if record is not None and self.bytes_to_eoc is not None:
+            end = min(self.pos + self.bytes_to_eoc, self.size)
+            record.content_file = MemoryViewFile(self.mm, self.pos, end, self.fh)
 
         return offset, record, errors
 
-    def seek(self, offset, pos=0):
-        """Same as a seek on a file"""
-        self.raw_fh.seek(offset, pos)
-        # trick to avoid closing and recreating GzipFile, does it always work?
-        self.fh._new_member = True
+    def _skip_to_eoc(self):
+        if self.bytes_to_eoc is None:
+            raise Exception('bytes_to_eoc is unset, cannot skip to end')
 
-class GzipFileStream(RecordStream):
-    """A stream to read/write gzipped file made up of all archive records"""
-    def __init__(self, file_handle, record):
-        RecordStream.__init__(self, gzip.GzipFile(fileobj=file_handle), record)
+        available = max(0, self.size - self.pos)
+        if available < self.bytes_to_eoc:
+            self.pos = self.size
+            raise EOFError('expected {} bytes but only read {}'.format(self.bytes_to_eoc, available))
+        self.pos += self.bytes_to_eoc
+        self.bytes_to_eoc = 0
+
+    def _end_of_record(self):
+        if self.bytes_to_eoc is None:
+            return None
+        self._skip_to_eoc()
+        self.bytes_to_eoc = None
+
+        while True:
+            end = self.pos
+            line = self._readline(self.size)
+            if not line or line.strip(b'\r\n'):
+                self.pos = end
+                return end
+
+    def _read(self, count=None):
+        if count is None:
+            end = self.size
+        else:
+            end = min(self.pos + count, self.size)
+        result = self.mm[self.pos:end]
+        self.pos = max(self.pos, end)
+
+        if self.bytes_to_eoc is not None:
+            self.bytes_to_eoc -= len(result)
+
+        return result
+
+    def peek_header_block(self):
+        if self.bytes_to_eoc is not None:
+            return None
+        end = self.mm.find(b'\r\n\r\n', self.pos, self.pos + HEADER_BLOCK_LIMIT)
+        if end < 0:
+            return None
+        return self.mm[self.pos:end + 4]
+
+    def _readline(self, end):
+        nl = self.mm.find(b'\n', self.pos, end)
+        if nl < 0:
+            nl = end
+        else:
+            nl += 1
+        result = self.mm[self.pos:nl]
+        self.pos = max(self.pos, nl)
+        return result
+
+    def readline(self, maxlen=None):
+        """Safe readline, see RecordStream.readline"""
+        end = self.size
+        if self.bytes_to_eoc is not None:
+            end = min(end, self.pos + self.bytes_to_eoc)
+        if maxlen is not None:
+            end = min(end, self.pos + maxlen)
+
+        result = self._readline(end)
+
+        if self.bytes_to_eoc is not None:
+            self.bytes_to_eoc -= len(result)
+        return result
+
+    def close(self):
+        """Close the map and the underlying file handle. If payload views
+        are still referenced, the map is released when they are."""
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+        self.fh.close()
+
+RAW_CHUNK_SIZE = 65536 # compressed bytes read at a time by GzipMemberFile
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+
+class GzipMemberFile(object):
+    """A readable file over a sequence of concatenated gzip members, as in a
+    record-gzipped (w)arc. Each member is inflated with its own
+    zlib.decompressobj, so the reader always knows exactly where in the raw
+    file the current member starts (member_offset), and, once it has been
+    read to the end, its compressed length (member_length)."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.reset()
+
+    def reset(self):
+        """Forget any buffered data, and carry on from the current position
+        of the underlying file, e.g. after seeking it."""
+        try:
+            self.raw_offset = self.fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            self.raw_offset = 0     # pipes, offsets are relative
+        self._raw = b''  # compressed bytes at raw_offset not yet inflated
+        self._buf = b''  # inflated bytes, read up to _pos
+        self._pos = 0
+        self._decomp = None
+        self._member_out = 0
+        self.member_offset = None
+        self.member_length = None
+
+    def seek_raw(self, offset, whence=0):
+        """Seek the underlying file, and carry on reading from there."""
+        self.fileobj.seek(offset, whence)
+        self.reset()
+
+    def _read_raw(self):
+        if not self._raw:
+            self._raw = self.fileobj.read(RAW_CHUNK_SIZE)
+        return self._raw
+
+    def _start_member(self):
+        # gzip files can be padded with zeros after the last member
+        while self._read_raw() and not self._raw.lstrip(b'\x00'):
+            self.raw_offset += len(self._raw)
+            self._raw = b''
+        stripped = self._raw.lstrip(b'\x00')
+        self.raw_offset += len(self._raw) - len(stripped)
+        self._raw = stripped
+        if not self._raw:
+            return False
+
+        if len(self._raw) < 2:
+            self._raw += self.fileobj.read(RAW_CHUNK_SIZE)
+        if self._raw == b'\x1f':
+            raise EOFError('Compressed file ended in a gzip header')
+        if self._raw[:2] != b'\x1f\x8b':
+            raise IOError('Not a gzipped file at offset %d' % self.raw_offset)
+
+        self._decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._member_out = 0
+        self.member_offset = self.raw_offset
+        self.member_length = None
+        return True
+
+    def _end_member(self):
+        self.member_length = self.raw_offset - self.member_offset
+        self._decomp = None
+
+    def _fill(self, next_member=True):
+        """Inflate more data into the (empty) buffer, moving on to the next
+        member when the current one is finished if next_member is true.
+        Returns False if there is nothing more to read."""
+        while True:
+            if self._decomp is None:
+                if not next_member or not self._start_member():
+                    return False
+            elif self._decomp.eof:
+                self._end_member()
+                if not next_member:
+                    return False
+                continue
+
+            data = self._inflate()
+            if data:
+                self._buf = data
+                self._pos = 0
+                self._member_out += len(data)
+                return True
+
+    def _inflate(self):
+        """Inflate the next chunk of the current member."""
+        if not self._read_raw():
+            raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+
+        data = self._decomp.decompress(self._raw, RAW_CHUNK_SIZE)
+        remaining = self._decomp.unconsumed_tail or self._decomp.unused_data
+        self.raw_offset += len(self._raw) - len(remaining)
+        self._raw = remaining
+        return data
+
+    def tell_member(self):
+        """The raw offset of the member holding the next unread byte, or
+        the raw offset of the end of the data if there is nothing left."""
+        if self._pos >= len(self._buf) and not self._fill():
+            return self.raw_offset
+        return self.member_offset
+
+    def member_tell(self):
+        """The uncompressed offset of the next unread byte within the
+        current member."""
+        return self._member_out - (len(self._buf) - self._pos)
+
+    def member_end(self, strip=b'\r\n'):
+        """Discard any bytes in strip at the current position, without
+        going on to the next member, keeping them in stripped. Returns the
+        raw offset of the end of the member if nothing else is left in it,
+        else None."""
+        self.stripped = b''
+        while True:
+            if self._pos >= len(self._buf):
+                if self._decomp is not None and self._fill(next_member=False):
+                    continue
+                if self.member_length is None:
+                    return None
+                return self.member_offset + self.member_length
+
+            chunk = self._buf[self._pos:]
+            rest = chunk.lstrip(strip)
+            self._pos += len(chunk) - len(rest)
+            self.stripped += chunk[:len(chunk) - len(rest)]
+            if rest:
+                return None
+
+    def skip(self, count):
+        """Discard the next count bytes of inflated data. Returns the number
+        of bytes skipped, which is less than count at the end of the
+        data."""
+        skipped = 0
+        while skipped < count:
+            if self._pos >= len(self._buf) and not self._fill():
+                break
+            n = min(count - skipped, len(self._buf) - self._pos)
+            self._pos += n
+            skipped += n
+        return skipped
+
+    def skip_member(self, length):
+        """Jump to the end of the current member, given its compressed
+        length, e.g. from a member index. The file must be seekable."""
+        end = self.member_offset + length
+        self.fileobj.seek(end)
+        self.raw_offset = end
+        self._raw = b''
+        self._buf = b''
+        self._pos = 0
+        self._end_member()
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0:
+            if self._pos >= len(self._buf) and not self._fill():
+                break
+            if size < 0:
+                end = len(self._buf)
+            else:
+                end = min(len(self._buf), self._pos + size)
+                size -= end - self._pos
+            chunks.append(self._buf[self._pos:end])
+            self._pos = end
+        return b''.join(chunks)
+
+    def peek_to(self, delim, limit):
+        """The data from the current position up to and including delim,
+        without reading it, if it is within limit bytes and already
+        inflated. Otherwise None."""
+        if self._pos >= len(self._buf) and not self._fill():
+            return None
+        end = self._buf.find(delim, self._pos, self._pos + limit)
+        if end < 0:
+            return None
+        return self._buf[self._pos:end + len(delim)]
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+        while size != 0:
+            if self._pos >= len(self._buf) and not self._fill():
+                break
+            end = len(self._buf)
+            if size >= 0:
+                end = min(end, self._pos + size)
+            nl = self._buf.find(b'\n', self._pos, end)
+            if nl >= 0:
+                end = nl + 1
+            if size >= 0:
+                size -= end - self._pos
+            chunks.append(self._buf[self._pos:end])
+            self._pos = end
+            if nl >= 0:
+                break
+        return b''.join(chunks)
+
+    def close(self):
+        self.fileobj.close()
+
+
+class GzipRecordStream(RecordStream):
+    """A stream to read/write concatted file made up of gzipped
+    archive records. Offsets are the raw offsets of the gzip member each
+    record starts in."""
+    def __init__(self, file_handle, record_parser, member_index=None,
+                 prefetch=False):
+        if prefetch:
+            from .prefetch import PrefetchGzipMemberFile
+            fh = PrefetchGzipMemberFile(file_handle)
+        else:
+            fh = GzipMemberFile(file_handle)
+        RecordStream.__init__(self, fh, record_parser)
+        self.raw_fh = file_handle
+        self.member_index = member_index
+        self.prefetch = prefetch
+        # does the current record start at the beginning of its member?
+        self._member_start = False
 
     def _read_record(self, offsets):
-        # no useful offsets in a gzipped file
         if self.bytes_to_eoc is not None:
             self._skip_to_eoc()  # skip to end of previous record
         self.bytes_to_eoc = None
 
         # handle any sort of valid or invalid record terminator
+        member = None
         while True:
+            offset = self.fh.tell_member()
+            if offset != member:
+                member = offset
+                self._member_start = self.fh.member_tell() == 0
             line = self.fh.readline()
             if not re.match(br'^[\r\n]+$', line):
                 break
@@ -254,5 +883,130 @@ class GzipFileStream(RecordStream):
         record, errors, _offset = \
             self.record_parser.parse(self, offset=None, line=line)
 
+        if record is not None and self._member_start:
+            self.header_length = self.fh.member_tell()
+        else:
+            self.header_length = None
+
         return offset, record, errors
 
+    def _skip_to_eoc(self):
+        """Skip the rest of the payload. When the record has a member to
+        itself and the member index gives the member's length, jump straight
+        to the end of the member rather than inflating the rest of it.
+        Otherwise the rest is inflated and discarded: the end of a deflate
+        stream can't be found without inflating it, and anything that looks
+        like the start of the next member may be part of the payload."""
+        if self.bytes_to_eoc is None:
+            raise Exception('bytes_to_eoc is unset, cannot skip to end')
+
+        if self._member_start and self.bytes_to_eoc > 0:
+            entry = None
+            if self.member_index is not None:
+                entry = self.member_index.by_offset(self.fh.member_offset)
+            if entry is not None and entry.length is not None:
+                self.fh.skip_member(entry.length)
+                self.bytes_to_eoc = 0
+                return
+
+        skipped = self.fh.skip(self.bytes_to_eoc)
+        if skipped < self.bytes_to_eoc:
+            raise EOFError('expected {} bytes but only read {}'.format(self.bytes_to_eoc, skipped))
+        self.bytes_to_eoc = 0
+
+    def _end_of_record(self):
+        if self.bytes_to_eoc is None:
+            return None
+        self._skip_to_eoc()
+        self.bytes_to_eoc = None
+
+        end = self.fh.member_end()
+        if not self._member_start:
+            return None
+        return end
+
+    @property
+    def raw_file(self):
+        # a prefetching reader reads raw_fh in another thread
+        seekable = getattr(self.raw_fh, 'seekable', None)
+        if self.prefetch or seekable is None or not seekable():
+            return None
+        return self.raw_fh
+
+    raw_gzip = True
+
+    def raw_length(self, offset, trailer=None):
+        """The compressed length of the gzip member the record just read is
+        in. Returns None if the member holds other records too, or if
+        trailer is given and isn't what follows the record's content."""
+        if (self.raw_file is None or offset is None or self.bytes_to_eoc is None
+                or not self._member_start):
+            return None
+        remaining = self.bytes_to_eoc
+        if trailer is not None and self.bytes_to_eoc > 0:
+            # inflate up to the trailer to see it, rather than jump to the
+            # end of the member
+            skipped = self.fh.skip(self.bytes_to_eoc)
+            if skipped < self.bytes_to_eoc:
+                raise EOFError('expected {} bytes but only read {}'.format(self.bytes_to_eoc, skipped))
+            self.bytes_to_eoc = 0
+        end = self._end_of_record()
+        if end is not None and (trailer is None or self.fh.stripped == trailer):
+            return end - offset
+
+        # the member goes on past the record, or the record has to be
+        # written out again, so go back to where the record's content was,
+        # for it to be read from there
+        self.seek(offset)
+        self._read_record(False)
+        self.fh.skip(self.bytes_to_eoc - remaining)
+        self.bytes_to_eoc = remaining
+        return None
+
+    def _payload_offset(self, offset):
+        return None
+
+    def seek(self, offset, pos=0):
+        """Same as a seek on a file"""
+        self.fh.seek_raw(offset, pos)
+        self.bytes_to_eoc = None
+
+class GzipFileStream(RecordStream):
+    """A stream to read/write gzipped file made up of all archive records.
+    Offsets are uncompressed offsets. Seeking, or skipping a payload,
+    restarts inflating from the nearest of the checkpoints (see zran) when
+    that is closer than the current position."""
+    def __init__(self, file_handle, record, checkpoints=None):
+        from . import zran
+        if zran.available():
+            fh = zran.CheckpointedGzipFile(file_handle, checkpoints)
+        else:
+            fh = gzip.GzipFile(fileobj=file_handle)
+        RecordStream.__init__(self, fh, record)
+
+    def _seekable(self):
+        # seeking a GzipFile inflates everything up to the new position
+        return not isinstance(self.fh, gzip.GzipFile)
+
+    @property
+    def raw_file(self):
+        # offsets are uncompressed
+        return None
+
+    def _skip_to_eoc(self):
+        if self.bytes_to_eoc is None:
+            raise Exception('bytes_to_eoc is unset, cannot skip to end')
+
+        if not self._seekable():
+            return RecordStream._skip_to_eoc(self)
+
+        pos = self.fh.tell()
+        end = self.fh.seek(pos + self.bytes_to_eoc)
+        if end - pos < self.bytes_to_eoc:
+            raise EOFError('expected {} bytes but only read {}'.format(self.bytes_to_eoc, end - pos))
+        self.bytes_to_eoc = 0
+
+    def seek(self, offset, pos=0):
+        """Seek to an uncompressed offset"""
+        self.fh.seek(offset, pos)
+        self.bytes_to_eoc = None
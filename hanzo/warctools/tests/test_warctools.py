@@ -9,8 +9,21 @@ except AttributeError:
     import unittest2
     unittest = unittest2
 
+import io
+import base64
+import binascii
+import hashlib
+import os
+import asyncio
 import tempfile
+import json
+import shutil
 import gzip
+import zlib
+import struct
+import threading
+import inspect
+import gc
 from hanzo import warctools, httptools
 
 try:
@@ -214,6 +227,1162 @@ class WarcRecordTerminatorTest(unittest.TestCase):
         self._test_terminator(b'\r\r\r\r\r\r\n\n\n')
 
 
+class MmapRecordStreamTest(unittest.TestCase):
+    def _write(self, data):
+        f = tempfile.NamedTemporaryFile(suffix='.warc', delete=False)
+        f.write(data)
+        f.close()
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+
+    def test_mmap_matches_plain_stream(self):
+        data = (WarcRecordTerminatorTest.RECORD1 + b'\r\n\r\n'
+                + WarcRecordTerminatorTest.RECORD2 + b'\n\r\n')
+        name = self._write(data)
+
+        fh = warctools.WarcRecord.open_archive(name)
+        try:
+            self.assertIsInstance(fh, warctools.stream.MmapRecordStream)
+            results = [(offset, record and record.content[1], errors)
+                       for (offset, record, errors) in fh.read_records(limit=None)]
+        finally:
+            fh.close()
+
+        expected = []
+        plain = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        for (offset, record, errors) in plain.read_records(limit=None):
+            expected.append((offset, record and record.content[1], errors))
+
+        self.assertEqual(results, expected)
+        self.assertEqual(results[-1][0], len(data))
+
+    def test_content_file_is_bounded_view(self):
+        name = self._write(WarcRecordTerminatorTest.RECORD2 + b'\r\n\r\n'
+                           + WarcRecordTerminatorTest.RECORD1 + b'\r\n\r\n')
+        fh = warctools.WarcRecord.open_archive(name)
+        try:
+            records = list(fh)
+            content_file = records[0].content_file
+            self.assertEqual(content_file.readline(), b'HTTP/1.1 200 OK\r\n')
+            self.assertEqual(bytes(content_file.getbuffer()),
+                    b'Content-Type: text/plain\r\nContent-Length: 12\r\n\r\n01234567890\r\n')
+            self.assertEqual(records[1].content[1], b'format: WARC File Format 1.0\r\n')
+        finally:
+            del content_file
+            fh.close()
+
+    def test_truncated_record(self):
+        name = self._write(WarcRecordTerminatorTest.RECORD2[:-5])
+        fh = warctools.WarcRecord.open_archive(name)
+        try:
+            with self.assertRaises(Exception):
+                list(fh.read_records(limit=None))
+        finally:
+            fh.close()
+
+
+class RecordLengthsTest(unittest.TestCase):
+    RECORD1 = WarcRecordTerminatorTest.RECORD1 + b'\r\n\r\n'
+    RECORD2 = WarcRecordTerminatorTest.RECORD2 + b'\r\n\r\n'
+
+    def _lengths(self, fh):
+        try:
+            return [(offset, length, record and record.type)
+                    for (offset, length, record, errors)
+                    in fh.read_records(limit=None, lengths=True)]
+        finally:
+            fh.close()
+
+    def test_uncompressed(self):
+        data = self.RECORD1 + self.RECORD2 + b'\n' + self.RECORD1
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        self.assertEqual(self._lengths(fh), [
+            (0, len(self.RECORD1), b'warcinfo'),
+            (len(self.RECORD1), len(self.RECORD2) + 1, b'response'),
+            (len(self.RECORD1) + len(self.RECORD2) + 1, len(self.RECORD1), b'warcinfo'),
+            (len(data), None, None),
+        ])
+
+    def test_record_gzip(self):
+        member1 = gzip.compress(self.RECORD1)
+        member2 = gzip.compress(self.RECORD2)
+        data = member1 + member2 + member1
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        self.assertEqual(self._lengths(fh), [
+            (0, len(member1), b'warcinfo'),
+            (len(member1), len(member2), b'response'),
+            (len(member1) + len(member2), len(member1), b'warcinfo'),
+            (len(data), None, None),
+        ])
+
+    def test_shared_member(self):
+        member1 = gzip.compress(self.RECORD1 + self.RECORD2)
+        member2 = gzip.compress(self.RECORD2)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(member1 + member2))
+        self.assertEqual(self._lengths(fh), [
+            (0, None, b'warcinfo'),
+            (0, None, b'response'),
+            (len(member1), len(member2), b'response'),
+            (len(member1) + len(member2), None, None),
+        ])
+
+    def test_offsets_with_content(self):
+        member1 = gzip.compress(self.RECORD1)
+        member2 = gzip.compress(self.RECORD2)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(member1 + member2))
+        try:
+            records = [(offset, record.content[1] if record else None)
+                       for (offset, record, errors) in fh.read_records(limit=None)]
+        finally:
+            fh.close()
+        self.assertEqual([offset for offset, _ in records],
+                         [0, len(member1), len(member1) + len(member2)])
+        self.assertEqual(records[1][1], WarcRecordTerminatorTest.RECORD2[-78:])
+
+
+class SkipPayloadTest(unittest.TestCase):
+    def _record(self, n, payload, terminator=b'\r\n\r\n'):
+        return (b'WARC/1.0\r\n'
+                + b'WARC-Type: resource\r\n'
+                + b'WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-00000000000' + str(n).encode('ascii') + b'>\r\n'
+                + b'Content-Type: application/octet-stream\r\n'
+                + b'Content-Length: ' + str(len(payload)).encode('ascii') + b'\r\n'
+                + b'\r\n' + payload + terminator)
+
+    def _ids(self, fh):
+        try:
+            return [(offset, length, record and record.id)
+                    for (offset, length, record, errors)
+                    in fh.read_records(limit=None, lengths=True)]
+        finally:
+            fh.close()
+
+    def embedded_member(self, size=300000):
+        """A gzip member of a record whose random, so stored, payload holds
+        what looks like the end of its member, followed by another member."""
+        length = size + 8 + len(gzip.compress(self._record(9, b'fake')))
+        isize = len(self._record(0, b'x' * length))
+        fake = struct.pack('<I', isize) + gzip.compress(self._record(9, b'fake'))
+        payload = os.urandom(size // 2) + fake + os.urandom(length - size // 2 - len(fake))
+        return gzip.compress(self._record(0, payload))
+
+    def test_embedded_member(self):
+        members = [self.embedded_member(), gzip.compress(self._record(1, b'real'))]
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(b''.join(members)))
+        self.assertEqual(self._ids(fh), [
+            (0, len(members[0]), b'<urn:uuid:00000000-0000-0000-0000-000000000000>'),
+            (len(members[0]), len(members[1]), b'<urn:uuid:00000000-0000-0000-0000-000000000001>'),
+            (sum(map(len, members)), None, None),
+        ])
+
+    def test_fall_back_to_inflating(self):
+        payload = os.urandom(1 << 20)
+        # without a member index, payloads are inflated to find the ends of
+        # their members, so an unusually long terminator is passed over too
+        members = [gzip.compress(self._record(i, payload, b'\r\n' * 8)) for i in range(2)]
+        members.insert(1, gzip.compress(self._record(9, b'short')))
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(b''.join(members)))
+        self.assertEqual([length for (offset, length, _) in self._ids(fh)],
+                         [len(members[0]), len(members[1]), len(members[2]), None])
+
+    def test_uncompressed_seek(self):
+        payload = b'x' * 100
+        data = self._record(0, payload) + self._record(1, payload)
+
+        class UnreadableBytesIO(BytesIO):
+            def read(self, *args):
+                raise AssertionError('payload was read')
+
+        fh = warctools.WarcRecord.open_archive(file_handle=UnreadableBytesIO(data), gzip=None)
+        self.assertEqual([offset for (offset, _, _) in self._ids(fh)],
+                         [0, len(data) // 2, len(data)])
+
+    def test_file_size_once(self):
+        data = b''.join(self._record(i, b'x' * 100) for i in range(3))
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            f.write(data)
+            f.flush()
+            whences = []
+
+            class Reader(io.BufferedReader):
+                def seek(self, offset, whence=0):
+                    whences.append(whence)
+                    return io.BufferedReader.seek(self, offset, whence)
+
+            with Reader(io.FileIO(f.name)) as raw:
+                fh = warctools.WarcRecord.open_archive(file_handle=raw, gzip=None)
+                self.assertEqual(len(self._ids(fh)), 4)
+        self.assertNotIn(2, whences)
+
+    def test_truncated(self):
+        data = self._record(0, b'x' * 100)[:-20]
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        with self.assertRaises(Exception):
+            self._ids(fh)
+
+
+class MemberIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.members = [gzip.compress(SkipPayloadTest()._record(i, b'payload %d' % i))
+                        for i in range(3)]
+        f = tempfile.NamedTemporaryFile(suffix='.warc.gz', delete=False)
+        f.write(b''.join(self.members))
+        f.close()
+        self.filename = f.name
+        self.addCleanup(os.unlink, f.name)
+
+    def test_build_save_load(self):
+        index = warctools.memberindex.write_member_index(self.filename)
+        self.addCleanup(os.unlink, warctools.memberindex.index_filename(self.filename))
+
+        self.assertEqual([(e.offset, e.length, e.type) for e in index],
+                         [(0, len(self.members[0]), b'resource'),
+                          (len(self.members[0]), len(self.members[1]), b'resource'),
+                          (len(self.members[0]) + len(self.members[1]), len(self.members[2]), b'resource')])
+        self.assertEqual(index[1].header_length, 157)
+
+        loaded = warctools.memberindex.load_member_index(self.filename)
+        self.assertEqual(loaded.entries, index.entries)
+        self.assertEqual(loaded.lookup(2), index[2])
+        self.assertEqual(loaded.lookup('<urn:uuid:00000000-0000-0000-0000-000000000001>'), index[1])
+        self.assertIsNone(loaded.lookup(3))
+        self.assertIsNone(loaded.lookup(b'<urn:uuid:missing>'))
+
+    def test_no_sidecar(self):
+        self.assertIsNone(warctools.memberindex.load_member_index(self.filename))
+
+    def test_stale_sidecar(self):
+        warctools.memberindex.write_member_index(self.filename)
+        self.addCleanup(os.unlink, warctools.memberindex.index_filename(self.filename))
+        with open(self.filename, 'ab') as f:
+            f.write(self.members[0])
+        self.assertIsNone(warctools.memberindex.load_member_index(self.filename))
+
+    def test_shared_member(self):
+        record = SkipPayloadTest()._record
+        with open(self.filename, 'wb') as f:
+            f.write(gzip.compress(b''.join(record(i, b'payload %d' % i) for i in range(3))))
+        index = warctools.memberindex.build_member_index(self.filename)
+        self.assertEqual([(e.offset, e.length, e.skip) for e in index],
+                         [(0, None, 0), (0, None, 1), (0, None, 2)])
+        entry = index.lookup(2)
+        fh = warctools.WarcRecord.open_archive(self.filename, offset=entry.offset,
+                                               member_index=index)
+        try:
+            records = iter(fh)
+            for _ in range(entry.skip):
+                next(records)
+            self.assertEqual(next(records).id, b'<urn:uuid:00000000-0000-0000-0000-000000000002>')
+        finally:
+            fh.close()
+
+    def test_stream_skips_indexed_members(self):
+        index = warctools.memberindex.build_member_index(self.filename)
+        entry = index.lookup(b'<urn:uuid:00000000-0000-0000-0000-000000000001>')
+        fh = warctools.WarcRecord.open_archive(self.filename, offset=entry.offset,
+                                               member_index=index)
+        try:
+            fh.fh.skip = lambda count: self.fail('payload was inflated')
+            ids = [record.id for record in fh]
+        finally:
+            fh.close()
+        self.assertEqual(ids, [b'<urn:uuid:00000000-0000-0000-0000-000000000001>',
+                               b'<urn:uuid:00000000-0000-0000-0000-000000000002>'])
+
+
+class ParallelRecordStreamTest(unittest.TestCase):
+    def setUp(self):
+        record = SkipPayloadTest()._record
+        self.members = [gzip.compress(record(i, os.urandom(i * 50))) for i in range(20)]
+        # two records sharing a member
+        self.members.insert(5, gzip.compress(record(7, b'a') + record(8, b'b')))
+        f = tempfile.NamedTemporaryFile(suffix='.warc.gz', delete=False)
+        f.write(b''.join(self.members))
+        f.close()
+        self.filename = f.name
+        self.addCleanup(os.unlink, f.name)
+
+    def _read(self, fh, lengths=False):
+        try:
+            return [(result[:-2], result[-2] and (result[-2].id, result[-2].content[1] if not lengths else None))
+                    for result in fh.read_records(limit=None, lengths=lengths)]
+        finally:
+            fh.close()
+
+    def _parallel(self, threads):
+        from hanzo.warctools.parallel import ParallelRecordStream
+        return ParallelRecordStream(open(self.filename, 'rb'), self.filename,
+                                    warctools.WarcRecord, 3, threads=threads, range_size=300)
+
+    def test_matches_sequential(self):
+        expected = self._read(warctools.WarcRecord.open_archive(self.filename))
+        self.assertEqual(len(expected), 23)
+        self.assertEqual(self._read(self._parallel(threads=True)), expected)
+        self.assertEqual(self._read(self._parallel(threads=False)), expected)
+
+    def test_lengths(self):
+        expected = self._read(warctools.WarcRecord.open_archive(self.filename), lengths=True)
+        self.assertEqual(self._read(self._parallel(threads=True), lengths=True), expected)
+
+    def test_embedded_member(self):
+        from hanzo.warctools.parallel import ParallelRecordStream
+        record = SkipPayloadTest()._record
+        with open(self.filename, 'wb') as f:
+            f.write(SkipPayloadTest().embedded_member(300000))
+            f.write(gzip.compress(record(1, b'real')))
+            # the last member gzipped as a payload, at the end of the file
+            f.write(gzip.compress(record(2, gzip.compress(record(3, b'fake')))))
+        expected = self._read(warctools.WarcRecord.open_archive(self.filename))
+        self.assertEqual(len(expected), 4)
+        for range_size in (1000, 100000, 300100):
+            fh = ParallelRecordStream(open(self.filename, 'rb'), self.filename,
+                                      warctools.WarcRecord, 2, threads=True,
+                                      range_size=range_size)
+            self.assertEqual(self._read(fh), expected)
+
+    def test_open_archive(self):
+        from hanzo.warctools.parallel import ParallelRecordStream
+        fh = warctools.WarcRecord.open_archive(self.filename, workers=2)
+        self.assertIsInstance(fh, ParallelRecordStream)
+        try:
+            self.assertEqual(len(list(fh)), 22)
+        finally:
+            fh.close()
+
+
+@unittest.skipUnless(warctools.zran.available(), 'libz not found')
+class CheckpointedGzipTest(unittest.TestCase):
+    def setUp(self):
+        # payloads that don't compress to nothing, so there are many blocks
+        self.records = [SkipPayloadTest()._record(i, os.urandom(20000) * 3)
+                        for i in range(10)]
+        self.offsets = [sum(len(r) for r in self.records[:i])
+                        for i in range(len(self.records))]
+        f = tempfile.NamedTemporaryFile(suffix='.warc.gz', delete=False)
+        f.write(gzip.compress(b''.join(self.records)))
+        f.close()
+        self.filename = f.name
+        self.addCleanup(os.unlink, f.name)
+
+    def test_uncompressed_offsets(self):
+        fh = warctools.WarcRecord.open_archive(self.filename, gzip='file')
+        try:
+            offsets = [offset for (offset, record, errors) in fh.read_records(limit=None)
+                       if record]
+        finally:
+            fh.close()
+        self.assertEqual(offsets, self.offsets)
+
+    def test_seek_from_checkpoint(self):
+        checkpoints = warctools.zran.write_checkpoints(self.filename, span=50000)
+        self.addCleanup(os.unlink, warctools.zran.checkpoint_filename(self.filename))
+        self.assertTrue(len(checkpoints) > 5)
+
+        # the sidecar is picked up, and offset is uncompressed
+        fh = warctools.WarcRecord.open_archive(self.filename, offset=self.offsets[7])
+        try:
+            restarts = []
+            restart = fh.fh._restart
+            fh.fh._restart = lambda point: (restarts.append(point), restart(point))
+            for n in (7, 2, 9):
+                fh.seek(self.offsets[n])
+                (offset, record, errors), = fh.read_records(limit=1)
+                self.assertEqual(offset, self.offsets[n])
+                self.assertEqual(record.id, ('<urn:uuid:00000000-0000-0000-0000-%012d>' % n).encode('ascii'))
+                self.assertEqual(record.content[1], self.records[n][-60004:-4])
+        finally:
+            fh.close()
+        self.assertTrue(all(p is not None and p.out > 0 for p in restarts))
+
+    def test_stale_checkpoints(self):
+        warctools.zran.write_checkpoints(self.filename)
+        self.addCleanup(os.unlink, warctools.zran.checkpoint_filename(self.filename))
+        with open(self.filename, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(warctools.zran.load_checkpoints(self.filename))
+
+        # rewritten to the same size
+        warctools.zran.write_checkpoints(self.filename)
+        st = os.stat(self.filename)
+        os.utime(self.filename, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNone(warctools.zran.load_checkpoints(self.filename))
+
+    def test_not_whole(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b''.join(gzip.compress(record) for record in self.records))
+        self.assertRaises(warctools.zran.NotWholeGzip,
+                          warctools.zran.write_checkpoints, self.filename)
+        with open(self.filename, 'wb') as f:
+            f.write(b''.join(self.records))
+        self.assertRaises(warctools.zran.NotWholeGzip,
+                          warctools.zran.write_checkpoints, self.filename)
+        self.assertFalse(os.path.exists(warctools.zran.checkpoint_filename(self.filename)))
+
+
+class GetHeaderTest(unittest.TestCase):
+    def test_lookup_follows_changes(self):
+        record = warctools.WarcRecord(headers=[(b'WARC-Type', b'response'),
+                                               (b'warc-type', b'request')])
+        self.assertEqual(record.get_header(b'WARC-TYPE'), b'response')
+        self.assertIsNone(record.get_header(b'Content-Length'))
+        record.headers.append((b'Content-Length', b'3'))
+        self.assertEqual(record.get_header(b'content-length'), b'3')
+        record.set_header(b'WARC-Type', b'metadata')
+        self.assertEqual(record.type, b'request')
+        record.headers = [(b'WARC-Type', b'resource')]
+        self.assertEqual(record.type, b'resource')
+        record.headers[0] = (b'WARC-Type', b'revisit')
+        self.assertEqual(record.type, b'revisit')
+
+
+class ScanTest(unittest.TestCase):
+    def test_scan(self):
+        data = RecordLengthsTest.RECORD1 + RecordLengthsTest.RECORD2
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        views = list(fh.scan())
+        self.assertEqual([(v.offset, v.length, v.type) for v in views], [
+            (0, len(RecordLengthsTest.RECORD1), b'warcinfo'),
+            (len(RecordLengthsTest.RECORD1), len(RecordLengthsTest.RECORD2), b'response'),
+        ])
+        self.assertEqual(views[1].url, b'http://example.org/')
+        self.assertIs(views[1].errors, warctools.record.NO_ERRORS)
+        self.assertFalse(hasattr(views[1], '__dict__'))
+
+    def test_read_headers(self):
+        record1, record2 = RecordLengthsTest.RECORD1, RecordLengthsTest.RECORD2
+        payload = record2[record2.index(b'HTTP/1.1'):-4]
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(record1 + record2))
+        results = list(fh.read_headers())
+        self.assertEqual(len(results), 3)
+        offset, length, payload_offset, payload_length, headers, errors = results[1]
+        self.assertEqual((offset, length), (len(record1), len(record2)))
+        self.assertEqual(payload_length, len(payload))
+        self.assertEqual((record1 + record2)[payload_offset:payload_offset + payload_length], payload)
+        self.assertIn((b'WARC-Type', b'response'), headers)
+        self.assertEqual(results[2][4], None)
+
+    def test_read_headers_gzip(self):
+        members = [gzip.compress(RecordLengthsTest.RECORD1), gzip.compress(RecordLengthsTest.RECORD2)]
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(b''.join(members)))
+        results = list(fh.read_headers())
+        self.assertEqual([r[:4] for r in results[:2]], [
+            (0, len(members[0]), None, 30),
+            (len(members[0]), len(members[1]), None, 78),
+        ])
+
+
+class CdxTest(unittest.TestCase):
+    def test_surt(self):
+        surt = warctools.cdx.surt
+        self.assertEqual(surt(b'http://www.Example.org:80/a?b=1&a=2#top'), b'org,example)/a?a=2&b=1')
+        self.assertEqual(surt(b'https://user@foo.example.com:8443'), b'com,example,foo:8443)/')
+        self.assertEqual(surt(b'https://example.org:443/a b'), b'org,example)/a%20b')
+        self.assertEqual(surt(b'http://127.0.0.1/'), b'127.0.0.1)/')
+        self.assertEqual(surt(b'dns:Example.org'), b'dns:example.org')
+
+    def test_parse_http_head(self):
+        parse = warctools.cdx.parse_http_head
+        self.assertEqual(parse(b'HTTP/1.1 404 Not Found\r\nContent-Type: Text/HTML; charset=utf-8\r\n\r\nbody'),
+                         (b'404', b'text/html'))
+        self.assertEqual(parse(b'HTTP/1.0 200 OK\r\n\r\nContent-Type: text/plain'), (b'200', None))
+        self.assertEqual(parse(b'garbage'), (None, None))
+
+    def _index(self, data, name):
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        out = BytesIO()
+        try:
+            warctools.cdx.index_records(fh, 'test.warc.gz', warctools.cdx.FORMATS[name], out)
+        finally:
+            fh.close()
+        return out.getvalue().splitlines()
+
+    def test_index_records(self):
+        members = [gzip.compress(RecordLengthsTest.RECORD1), gzip.compress(RecordLengthsTest.RECORD2)]
+        data = b''.join(members)
+        # the warcinfo record isn't indexed
+        line, = self._index(data, 'cdx11')
+        self.assertEqual(line.split(b' '), [
+            b'org,example)/', b'-', b'http://example.org/', b'text/plain', b'200', b'-',
+            b'-', b'-', str(len(members[1])).encode('ascii'),
+            str(len(members[0])).encode('ascii'), b'test.warc.gz'])
+
+        line, = self._index(data, 'cdxj')
+        key, timestamp, fields = line.split(b' ', 2)
+        self.assertEqual(json.loads(fields.decode('utf-8')), {
+            'url': 'http://example.org/', 'mime': 'text/plain', 'status': '200',
+            'length': str(len(members[1])), 'offset': str(len(members[0])),
+            'filename': 'test.warc.gz'})
+
+    def test_scan_head(self):
+        data = RecordLengthsTest.RECORD1 + RecordLengthsTest.RECORD2
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        views = list(fh.scan(head=warctools.cdx.read_http_head))
+        self.assertEqual(views[0].head, None)
+        self.assertTrue(views[1].head.startswith(b'HTTP/1.1 200 OK\r\n'))
+        self.assertEqual(views[1].length, len(RecordLengthsTest.RECORD2))
+
+
+class SortedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test')
+        self.lines = []
+        for i in range(50):
+            for year in (2012, 2013, 2014):
+                url = 'http://example.org/%02d' % i
+                fields = {'url': url, 'offset': str(i * 100 + year), 'filename': 'test.warc.gz'}
+                self.lines.append(b' '.join((warctools.cdx.surt(url.encode('ascii')),
+                                             b'%d0101000000' % year,
+                                             json.dumps(fields).encode('utf-8'))) + b'\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _index(self):
+        lines = list(reversed(self.lines))
+        count = warctools.index.build_index(lines, self.path, run_size=7, block_lines=10)
+        self.assertEqual(count, len(self.lines))
+        return warctools.index.SortedIndex(self.path)
+
+    def test_lookup(self):
+        with self._index() as index:
+            self.assertEqual(list(index.range(b'')), sorted(self.lines))
+            lines = list(index.lookup(b'http://www.example.org/07'))
+            self.assertEqual([line.split(b' ')[1] for line in lines],
+                             [b'20120101000000', b'20130101000000', b'20140101000000'])
+            self.assertEqual(list(index.lookup(b'http://example.org/07', b'2013', b'2013')), lines[1:2])
+            self.assertEqual(list(index.lookup(b'http://example.org/07', to_timestamp=b'2013')), lines[:2])
+            self.assertEqual(list(index.lookup(b'http://example.org/0')), [])
+            self.assertEqual(len(list(index.prefix(b'http://example.org/0'))), 30)
+            self.assertEqual(warctools.index.line_location(lines[-1]), ('test.warc.gz', 2014 + 700, None))
+
+    def test_line_location(self):
+        line = b'org,example)/ 20130101000000 http://example.org/ text/html 200 - - - 1043 333 a.warc.gz\n'
+        self.assertEqual(warctools.index.line_location(line), ('a.warc.gz', 333, 1043))
+        line = b'org,example)/ 20130101000000 http://example.org/ text/html 200 - - - 1043 333 my%20a.warc.gz\n'
+        self.assertEqual(warctools.index.line_location(line), ('my a.warc.gz', 333, 1043))
+
+    def test_empty(self):
+        warctools.index.write_index([b' CDX N b a m s k r M S V g\n'], self.path)
+        with warctools.index.SortedIndex(self.path) as index:
+            self.assertEqual(list(index.lookup(b'http://example.org/')), [])
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.warc')
+        self.state_path = self.path + '.state'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _index_new(self, data):
+        """Write data as the archive, and return the offsets of the records
+        read since last time."""
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        os.utime(self.path, (len(data), len(data)))
+        incremental = warctools.incremental
+        state = incremental.resume_state(self.state_path, os.stat(self.path))
+        if state is None:
+            return None
+        offsets = []
+        if state.offset < state.size:
+            fh = warctools.WarcRecord.open_archive(self.path, offset=state.offset or None)
+            try:
+                offsets = [view.offset for view in incremental.scan_new(fh, state)]
+            finally:
+                fh.close()
+        state.save()
+        return offsets
+
+    def _test_growing(self, records):
+        data = b''.join(records)
+        offsets = [len(b''.join(records[:i])) for i in range(len(records))]
+        found = []
+        for end in list(range(1, len(data), 7)) + [len(data)]:
+            found += self._index_new(data[:end])
+            self.assertEqual(found, [offset for i, offset in enumerate(offsets)
+                                     if offset + len(records[i]) <= end])
+        self.assertEqual(self._index_new(data), None)
+        # replaced by a shorter file: indexed again from the start
+        self.assertEqual(self._index_new(records[0]), [0])
+
+    def test_uncompressed(self):
+        R = RecordLengthsTest
+        self._test_growing([R.RECORD1, R.RECORD2, R.RECORD1])
+
+    def test_record_gzip(self):
+        R = WarcRecordTerminatorTest
+        self.path += '.gz'
+        self._test_growing([R.RECORD1_GZ, R.RECORD2_GZ, R.RECORD1_GZ])
+
+    def test_whole_gzip(self):
+        R = RecordLengthsTest
+        self.assertEqual(self._index_new(gzip.compress(R.RECORD1 + R.RECORD2)), [0, 0])
+        # the records share a member, so the first two are skipped
+        self.assertEqual(self._index_new(gzip.compress(R.RECORD1 + R.RECORD2 + R.RECORD1)), [0])
+        self.assertEqual(warctools.incremental.IndexState.load(self.state_path).skip, 3)
+
+    def test_header_without_colon(self):
+        data = RecordLengthsTest.RECORD1.replace(b'WARC-Type: warcinfo', b'WARC-Type warcinfo')
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data + RecordLengthsTest.RECORD2))
+        records = list(fh)
+        self.assertEqual([record.type for record in records], [None, b'response'])
+        self.assertTrue(records[0].errors)
+
+
+class ReadBatchTest(unittest.TestCase):
+    def test_batches(self):
+        record1, record2 = RecordLengthsTest.RECORD1, RecordLengthsTest.RECORD2
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(record1 + record2 + record1))
+        batch = fh.read_batch(2, fields=[b'WARC-Type', b'warc-target-uri', b'WARC-Type'])
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(list(batch.offsets), [0, len(record1)])
+        self.assertEqual(list(batch.lengths), [len(record1), len(record2)])
+        self.assertEqual(list(batch.payload_lengths), [30, 78])
+        self.assertEqual(batch.column(b'WARC-Type'), [b'warcinfo', b'response'])
+        self.assertEqual(batch.column(b'warc-target-uri'), [None, b'http://example.org/'])
+        self.assertEqual(batch.errors, {})
+
+        batch = fh.read_batch(2, fields=[b'WARC-Type'])
+        self.assertEqual(batch.column(b'WARC-Type'), [b'warcinfo'])
+        self.assertEqual(len(fh.read_batch(2)), 0)
+
+    def test_unknown_lengths(self):
+        members = [gzip.compress(RecordLengthsTest.RECORD1 + RecordLengthsTest.RECORD2)]
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(members[0]))
+        batch = fh.read_batch(10)
+        self.assertEqual(list(batch.offsets), [0, 0])
+        self.assertEqual(list(batch.lengths), [-1, -1])
+        self.assertEqual(list(batch.payload_offsets), [-1, -1])
+
+
+class DigestTest(unittest.TestCase):
+    HTTP = b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\nhello world'
+
+    def _record(self, block_digest, payload_digest):
+        headers = (b'WARC/1.0\r\nWARC-Type: response\r\n'
+                   b'WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-000000000000>\r\n'
+                   b'WARC-Date: 2013-11-15T00:00:00Z\r\n'
+                   b'Content-Type: application/http;msgtype=response\r\n'
+                   b'WARC-Block-Digest: ' + block_digest + b'\r\n'
+                   b'WARC-Payload-Digest: ' + payload_digest + b'\r\n'
+                   b'Content-Length: ' + str(len(self.HTTP)).encode('ascii') + b'\r\n\r\n')
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(headers + self.HTTP + b'\r\n\r\n'))
+        return fh, next(iter(fh))
+
+    def test_parse_digest(self):
+        digest = hashlib.sha1(b'hello world').digest()
+        for value in (b'sha1:' + base64.b32encode(digest),
+                      b'SHA-1:' + base64.b32encode(digest).lower(),
+                      b'sha1:' + binascii.hexlify(digest),
+                      b'sha1:' + base64.b64encode(digest)):
+            self.assertEqual(warctools.digest.parse_digest(value), ('sha1', digest))
+        self.assertEqual(warctools.digest.parse_digest(b'sha1:nope'), ('sha1', None))
+        self.assertIsNone(warctools.digest.parse_digest(b'nosuchhash:AAAA'))
+
+    def test_payload_split_across_chunks(self):
+        for size in range(1, len(self.HTTP) + 1):
+            digester = warctools.digest.RecordDigester('sha1', 'sha256', http=True)
+            for i in range(0, len(self.HTTP), size):
+                digester.update(self.HTTP[i:i + size])
+            self.assertEqual(digester.payload.digest(), hashlib.sha256(b'hello world').digest())
+            self.assertEqual(digester.block.digest(), hashlib.sha1(self.HTTP).digest())
+
+    def test_check_digests(self):
+        block = b'sha1:' + base64.b32encode(hashlib.sha1(self.HTTP).digest())
+        payload = b'sha256:' + binascii.hexlify(hashlib.sha256(b'hello world').digest())
+        fh, record = self._record(block, payload)
+        self.assertEqual(warctools.digest.check_digests(record, chunk_size=7), [])
+        fh.close()
+
+        bad = b'sha1:' + base64.b32encode(hashlib.sha1(b'hello').digest())
+        fh, record = self._record(block, bad)
+        errors = warctools.digest.check_digests(record)
+        self.assertEqual([e[0] for e in errors], ['payload digest mismatch'])
+        fh.close()
+
+
+class WriteDigestsTest(unittest.TestCase):
+    def _check(self, record, **kwargs):
+        out = BytesIO()
+        record.write_to(out, digests='sha1', **kwargs)
+        data = out.getvalue()
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        written = next(iter(fh))
+        self.assertIsNotNone(written.get_header(warctools.WarcRecord.BLOCK_DIGEST))
+        self.assertIsNotNone(written.get_header(warctools.WarcRecord.PAYLOAD_DIGEST))
+        self.assertEqual(warctools.digest.check_digests(written), [])
+        fh.close()
+        return written
+
+    def test_content_file(self):
+        block = DigestTest.HTTP * 1000
+        record = WarcWritingTest().build_warc_record(url=b'http://example.org/',
+                warc_date=b'2013-11-15T00:00:00Z', content_file=BytesIO(block), content_length=str(len(block)).encode('ascii'),
+                warc_type=warctools.WarcRecord.RESPONSE,
+                content_type=b'application/http;msgtype=response')
+        record.add_digests(spool_size=100)
+        spool = record.content_file
+        self.assertTrue(spool._rolled)
+        self._check(record)
+        self.assertTrue(spool.closed)
+
+    def test_content_tuple(self):
+        record = WarcWritingTest().build_warc_record(url=b'http://example.org/',
+                warc_date=b'2013-11-15T00:00:00Z', content_buffer=DigestTest.HTTP, warc_type=warctools.WarcRecord.RESPONSE,
+                content_type=b'application/http;msgtype=response')
+        self._check(record)
+        self._check(record, gzip=True)
+
+
+class WarcWriterTest(unittest.TestCase):
+    def _records(self):
+        test = WarcWritingTest()
+        return [test.build_record_using_tuple(), test.build_record_using_stream(),
+                test.build_record_using_tuple()]
+
+    def test_same_as_write_to(self):
+        expected = BytesIO()
+        for record in self._records():
+            record.write_to(expected)
+
+        out = BytesIO()
+        writer = warctools.writer.WarcWriter(out, buffer_size=200)
+        for record in self._records():
+            writer.write(record)
+        self.assertLess(len(out.getvalue()), len(expected.getvalue()))
+        writer.flush()
+        self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_gzip_members(self):
+        expected = BytesIO()
+        for record in self._records():
+            record.write_to(expected)
+
+        out = BytesIO()
+        writer = warctools.writer.WarcWriter(out, gzip=True)
+        for record in self._records():
+            writer.write(record)
+        writer.flush()
+        self.assertEqual(gzip.decompress(out.getvalue()), expected.getvalue())
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(out.getvalue()))
+        lengths = [length for (offset, length, record, errors)
+                   in fh.read_records(limit=None, lengths=True) if record]
+        self.assertEqual(len(lengths), 3)
+        self.assertNotIn(None, lengths)
+
+    def test_offsets(self):
+        out = BytesIO(b'x' * 10)
+        out.seek(10)
+        writer = warctools.writer.WarcWriter(out, gzip=True)
+        results = [writer.write(record) for record in self._records()]
+        writer.flush()
+        data = out.getvalue()
+        for offset, length in results:
+            self.assertEqual(data[offset:offset + 2], b'\x1f\x8b')
+        self.assertEqual(sum(length for offset, length in results), len(data) - 10)
+
+    def test_parallel(self):
+        expected = BytesIO()
+        writer = warctools.writer.WarcWriter(expected, gzip=True)
+        lengths = [writer.write(record) for record in self._records() + self._records() + self._records()]
+        writer.flush()
+
+        for max_record_size in (warctools.writer.MAX_RECORD_SIZE, 10):
+            out = BytesIO()
+            writer = warctools.writer.ParallelWarcWriter(out, 2, max_record_size=max_record_size)
+            futures = [writer.write(record) for record in self._records() + self._records() + self._records()]
+            writer.flush()
+            self.assertEqual(out.getvalue(), expected.getvalue())
+            writer.close()
+            self.assertEqual([f.result() for f in futures], lengths)
+
+    def test_rolling(self):
+        directory = tempfile.mkdtemp()
+        try:
+            writer = warctools.writer.RollingWarcWriter(
+                directory, template='test-{serial}.warc.gz', max_records=2, digests='sha1')
+            written = [writer.write(record) for record in self._records() + self._records()[:2]]
+            writer.close()
+            self.assertEqual([w[0] for w in written], ['test-0.warc.gz'] * 2 + ['test-1.warc.gz'] * 2
+                             + ['test-2.warc.gz'])
+            self.assertEqual(sorted(os.listdir(directory)), [
+                'test-0.warc.gz', 'test-0.warc.gz.cdxj', 'test-1.warc.gz', 'test-1.warc.gz.cdxj',
+                'test-2.warc.gz', 'test-2.warc.gz.cdxj'])
+
+            for name in ('test-0.warc.gz', 'test-1.warc.gz'):
+                path = os.path.join(directory, name)
+                fh = warctools.WarcRecord.open_archive(path)
+                records = [(offset, length, record.type, record.get_header(warctools.WarcRecord.FILENAME))
+                           for (offset, length, record, errors) in fh.read_records(limit=None, lengths=True)
+                           if record]
+                fh.close()
+                self.assertEqual(records[0][2:], (b'warcinfo', name.encode('ascii')))
+                with open(path + '.cdxj', 'rb') as index:
+                    lines = index.read().splitlines()
+                self.assertEqual(len(lines), 2)
+                for line, (offset, length, _, _) in zip(lines, records[1:]):
+                    key, timestamp, fields = line.split(b' ', 2)
+                    fields = json.loads(fields.decode('utf-8'))
+                    self.assertEqual((key, timestamp), (b'org,example)/', b'20131115000000'))
+                    self.assertEqual((int(fields['offset']), int(fields['length'])), (offset, length))
+                    self.assertEqual(fields['filename'], name)
+                    self.assertEqual(len(fields['digest']), 32) # base32 sha1, without sha1:
+        finally:
+            shutil.rmtree(directory)
+
+    def test_rolling_index_of_http(self):
+        # the index of streamed records is the same as warcindex makes
+        http = b'HTTP/1.1 404 Not Found\r\nContent-Type: text/plain; charset=utf-8\r\n\r\nnope'
+        test = WarcWritingTest()
+        records = [test.build_warc_record(
+            url=b'http://example.org/%d' % i, content_buffer=http if i == 0 else None,
+            content_file=BytesIO(http) if i else None,
+            content_length=str(len(http)).encode('ascii'),
+            record_id=b'<urn:uuid:00000000-0000-0000-0000-%012d>' % i,
+            warc_date=b'2013-11-15T00:00:00Z', warc_type=warctools.WarcRecord.RESPONSE,
+            content_type=httptools.ResponseMessage.CONTENT_TYPE) for i in range(2)]
+        directory = tempfile.mkdtemp()
+        try:
+            with warctools.writer.RollingWarcWriter(directory, template='test.warc.gz') as writer:
+                for record in records:
+                    writer.write(record)
+            path = os.path.join(directory, 'test.warc.gz')
+            with open(path + '.cdxj', 'rb') as index:
+                lines = index.read()
+            expected = BytesIO()
+            fh = warctools.WarcRecord.open_archive(path)
+            warctools.cdx.write_index_lines(fh.scan(head=warctools.cdx.read_http_head), 'test.warc.gz',
+                                            warctools.cdx.FORMATS['cdxj'], expected)
+            fh.close()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(lines, expected.getvalue())
+        self.assertEqual(lines.count(b'"status": "404"'), 2)
+
+    def test_content_file_written_once(self):
+        writer = warctools.writer.WarcWriter(BytesIO())
+        record = WarcWritingTest().build_record_using_stream()
+        writer.write(record)
+        self.assertRaises(Exception, writer.write, record)
+
+
+class GzipCompressorTest(unittest.TestCase):
+    def test_members_inflate_alone(self):
+        compressor = warctools.compress.GzipCompressor(level=1)
+        parts = [b'member %d ' % i * (i * 100 + 1) for i in range(4)]
+        members = [compressor.compress_member(part) for part in parts]
+        self.assertEqual(gzip.decompress(b''.join(members)), b''.join(parts))
+        for member, part in zip(members, parts):
+            self.assertEqual(gzip.decompress(member), part)
+
+    def test_write_to(self):
+        test = WarcWritingTest()
+        compressor = warctools.compress.GzipCompressor()
+        out = BytesIO()
+        expected = BytesIO()
+        for record in (test.build_record_using_tuple(), test.build_record_using_stream()):
+            record.write_to(out, gzip=compressor)
+        for record in (test.build_record_using_tuple(), test.build_record_using_stream()):
+            record.write_to(expected)
+        self.assertEqual(gzip.decompress(out.getvalue()), expected.getvalue())
+
+    def test_backend(self):
+        self.assertIs(warctools.compress.get_backend('zlib'), zlib)
+        self.assertRaises(Exception, warctools.compress.get_backend, 'nosuchzlib')
+
+
+class RawCopyTest(unittest.TestCase):
+    RECORD1 = RecordLengthsTest.RECORD1
+    RECORD2 = RecordLengthsTest.RECORD2
+
+    def _copy(self, fh, gzip=False, trailer=False):
+        out = BytesIO()
+        writer = warctools.writer.WarcWriter(out, gzip=gzip)
+        raw = []
+        for offset, record, errors in fh.read_records(limit=None):
+            if not record:
+                break
+            length = fh.raw_length(offset, record.TRAILER if trailer else None)
+            raw.append(length)
+            if length is None:
+                writer.write(record)
+            else:
+                writer.write_raw(fh.raw_file, offset, length)
+        writer.flush()
+        fh.close()
+        return out.getvalue(), raw
+
+    def test_record_gzip(self):
+        data = gzip.compress(self.RECORD1) + gzip.compress(self.RECORD2)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        self.assertTrue(fh.raw_gzip)
+        copied, raw = self._copy(fh, gzip=True)
+        self.assertEqual(copied, data)
+        self.assertEqual(raw, [len(gzip.compress(self.RECORD1)), len(gzip.compress(self.RECORD2))])
+
+    def test_uncompressed_file(self):
+        data = self.RECORD1 + self.RECORD2 + b'\n'
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            f.write(data)
+            f.flush()
+            fh = warctools.WarcRecord.open_archive(f.name)
+            self.assertFalse(fh.raw_gzip)
+            copied, raw = self._copy(fh)
+        self.assertEqual(copied, data)
+        self.assertEqual(raw, [len(self.RECORD1), len(self.RECORD2) + 1])
+
+    def test_shared_member(self):
+        # the first record can't be copied on its own, but is still written
+        data = gzip.compress(self.RECORD1 + self.RECORD2) + gzip.compress(self.RECORD2)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        copied, raw = self._copy(fh)
+        self.assertEqual(raw, [None, None, len(gzip.compress(self.RECORD2))])
+        self.assertEqual(copied[:len(self.RECORD1 + self.RECORD2)], self.RECORD1 + self.RECORD2)
+
+    def test_trailer(self):
+        # a record not followed by the usual trailer is written out again
+        record1 = self.RECORD1[:-4] + b'\n\n'
+        expected = self.RECORD1 + self.RECORD2
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            f.write(record1 + self.RECORD2)
+            f.flush()
+            copied, raw = self._copy(warctools.WarcRecord.open_archive(f.name), trailer=True)
+        self.assertEqual(copied, expected)
+        self.assertEqual(raw, [None, len(self.RECORD2)])
+
+        data = gzip.compress(record1) + gzip.compress(self.RECORD2)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data))
+        copied, raw = self._copy(fh, gzip=True, trailer=True)
+        self.assertEqual(gzip.decompress(copied), expected)
+        self.assertEqual(raw, [None, len(gzip.compress(self.RECORD2))])
+
+    def test_not_raw(self):
+        data = gzip.compress(self.RECORD1)
+        fh = warctools.WarcRecord.open_archive(file_handle=BytesIO(data), gzip='file')
+        self.assertIsNone(fh.raw_file)
+        fh.close()
+
+    def test_copy_range(self):
+        data = os.urandom(3 << 20)
+        with tempfile.TemporaryFile() as src, tempfile.TemporaryFile() as dst:
+            src.write(data)
+            src.seek(10)
+            dst.write(b'start')
+            warctools.filecopy.copy_range(src, 100, len(data) - 200, dst)
+            dst.write(b'end')
+            self.assertEqual(src.tell(), 10)
+            dst.seek(0)
+            self.assertEqual(dst.read(), b'start' + data[100:-100] + b'end')
+
+        src = BytesIO(data)
+        dst = BytesIO()
+        warctools.filecopy.copy_range(src, 1, 5, dst)
+        self.assertEqual(dst.getvalue(), data[1:6])
+        self.assertEqual(src.tell(), 0)
+        self.assertRaises(Exception, warctools.filecopy.copy_range, src, len(data) - 1, 5, dst)
+
+    def test_copy_payload(self):
+        data = SkipPayloadTest()._record(1, os.urandom(200000))
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            f.write(data)
+            f.flush()
+            for write in ('write_to', 'writer'):
+                fh = warctools.WarcRecord.open_archive(f.name)
+                record = next(iter(fh))
+                self.assertIsNotNone(warctools.filecopy.file_range(record.content_file))
+                with tempfile.TemporaryFile() as out:
+                    if write == 'write_to':
+                        record.write_to(out)
+                    else:
+                        writer = warctools.writer.WarcWriter(out)
+                        self.assertEqual(writer.write(record), (0, len(data)))
+                        writer.flush()
+                    out.seek(0)
+                    self.assertEqual(out.read(), data)
+                self.assertEqual(record.content_file.read(), b'')
+                fh.close()
+
+    def test_copy_file(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'x' * 100000)
+            f.seek(10)
+            out = BytesIO()
+            self.assertEqual(warctools.filecopy.copy_file(f, out), 99990)
+            self.assertEqual(f.read(), b'')
+        self.assertEqual(out.getvalue(), b'x' * 99990)
+
+    def test_copy_into_gzip_file(self):
+        # a GzipFile's fileno() is that of the compressed file under it
+        data = SkipPayloadTest()._record(1, os.urandom(200000))
+        with tempfile.NamedTemporaryFile(suffix='.warc') as f:
+            f.write(data)
+            f.flush()
+            fh = warctools.WarcRecord.open_archive(f.name)
+            with tempfile.TemporaryFile() as out:
+                with gzip.GzipFile(fileobj=out, mode='wb') as g:
+                    next(iter(fh)).write_to(g)
+                    warctools.writer.WarcWriter(g).write_raw(fh.raw_file, 0, len(data))
+                out.seek(0)
+                self.assertEqual(gzip.GzipFile(fileobj=out).read(), data + data)
+            fh.close()
+
+
+class HeaderBlockTest(unittest.TestCase):
+    RECORDS = [
+        b'WARC/1.0\r\nWARC-Type: response\r\nContent-Type: text/plain\r\nContent-Length: 3\r\n\r\nabc\r\n\r\n',
+        b'WARC/1.0\r\nWARC-Type:resource\r\nX-Folded: a\r\n  b\r\n\tc\r\nContent-Length:  1 \r\n\r\nx\r\n\r\n',
+        b'WARC/1.0\r\nContent-Length: x\r\nContent-Type:\r\n\r\n\r\n\r\n',
+        b'WARC/1.0\r\nA: b\nContent-Length: 0\r\n\r\n\r\n\r\n',
+    ]
+
+    def _parse(self, data, peek):
+        class Stream(warctools.stream.RecordStream):
+            def peek_header_block(self):
+                return warctools.stream.RecordStream.peek_header_block(self) if peek else None
+        stream = Stream(io.BufferedReader(io.BytesIO(data)), warctools.WarcRecord.make_parser())
+        offset, record, errors = stream._read_record(True)
+        return record.headers, record.errors, record.content[1], stream.fh.tell()
+
+    def test_same_as_line_by_line(self):
+        for data in self.RECORDS:
+            self.assertEqual(self._parse(data, True), self._parse(data, False))
+
+    def test_folded_header(self):
+        headers, errors, content, end = self._parse(self.RECORDS[1], True)
+        self.assertEqual(headers, [(b'WARC-Type', b'resource'), (b'X-Folded', b'a b c'),
+                                   (b'Content-Length', b'1')])
+        self.assertEqual(content, b'x')
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.members = [gzip.compress(SkipPayloadTest()._record(i, os.urandom(50000 * i)))
+                        for i in range(4)]
+        f = tempfile.NamedTemporaryFile(suffix='.warc.gz', delete=False)
+        f.write(b''.join(self.members) + b'\0' * 10)
+        f.close()
+        self.filename = f.name
+        self.addCleanup(os.unlink, f.name)
+
+    def _read(self, **kwargs):
+        fh = warctools.WarcRecord.open_archive(self.filename, **kwargs)
+        try:
+            contents = [(offset, record and record.content[1])
+                        for (offset, record, errors) in fh.read_records(limit=None)]
+            fh.seek(len(self.members[0]))
+            lengths = [(offset, length) for (offset, length, record, errors)
+                       in fh.read_records(limit=None, lengths=True)]
+        finally:
+            fh.close()
+        return contents, lengths
+
+    def test_same_as_without(self):
+        contents, lengths = self._read(prefetch=True)
+        self.assertEqual((contents, lengths), self._read())
+        self.assertEqual(lengths[:3], [(len(b''.join(self.members[:i])), len(self.members[i]))
+                                       for i in range(1, 4)])
+
+    def test_member_index(self):
+        member_index = warctools.memberindex.build_member_index(self.filename)
+        fh = warctools.WarcRecord.open_archive(self.filename, prefetch=True,
+                                               member_index=member_index)
+        try:
+            ids = [record.id for (offset, record, errors) in fh.read_records(limit=None)
+                   if record]
+        finally:
+            fh.close()
+        self.assertEqual(ids, [('<urn:uuid:00000000-0000-0000-0000-%012d>' % i).encode('ascii')
+                               for i in range(4)])
+
+    def test_uncompressed_pipe(self):
+        r, w = os.pipe()
+        data = b''.join(SkipPayloadTest()._record(i, b'payload %d' % i) for i in range(3))
+        os.write(w, data)
+        os.close(w)
+        with os.fdopen(r, 'rb') as pipe:
+            fh = warctools.WarcRecord.open_archive(file_handle=pipe, gzip=None, prefetch=True)
+            self.assertEqual([record.content[1] for record in fh],
+                             [b'payload 0', b'payload 1', b'payload 2'])
+
+    def test_dropped_without_close(self):
+        # more members than the thread can queue ahead, so it waits to put
+        data = b''.join(gzip.compress(SkipPayloadTest()._record(i, b'payload'))
+                        for i in range(5000))
+        with tempfile.NamedTemporaryFile(suffix='.warc.gz') as f:
+            f.write(data)
+            f.flush()
+            before = set(threading.enumerate())
+            fh = warctools.WarcRecord.open_archive(f.name, prefetch=True)
+            for record in fh:
+                break
+            threads = set(threading.enumerate()) - before
+            self.assertEqual(len(threads), 1)
+            del fh, record
+            gc.collect()
+            thread = threads.pop()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+
+class AsyncRecordStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.members = [gzip.compress(SkipPayloadTest()._record(i, b'payload %d' % i))
+                        for i in range(5)]
+        self.data = b''.join(self.members)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_async_for(self):
+        f = tempfile.NamedTemporaryFile(suffix='.warc.gz', delete=False)
+        f.write(self.data)
+        f.close()
+        self.addCleanup(os.unlink, f.name)
+
+        async def read():
+            stream = await warctools.asyncstream.open_archive(filename=f.name)
+            stream.batch_size = 2
+            async with stream:
+                return [(record.id, record.content[1]) async for record in stream]
+
+        records = self.loop.run_until_complete(read())
+        self.assertEqual(records, [(('<urn:uuid:00000000-0000-0000-0000-00000000000%d>' % i).encode('ascii'),
+                                    b'payload %d' % i) for i in range(5)])
+
+    def test_async_reader(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(self.data)
+            reader.feed_eof()
+            stream = await warctools.asyncstream.open_archive(reader=reader)
+            return [(offset, record.content[1] if record else None)
+                    async for (offset, record, errors) in stream.read_records(limit=None)]
+
+        results = self.loop.run_until_complete(read())
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[3], (len(b''.join(self.members[:3])), b'payload 3'))
+        self.assertEqual(results[-1], (len(self.data), None))
+
+    def test_read_records_again(self):
+        # the first reader is stopped before the second reads anything
+        async def read():
+            stream = warctools.asyncstream.AsyncRecordStream(
+                warctools.WarcRecord.open_archive(file_handle=BytesIO(self.data)), batch_size=1)
+            first = stream.read_records(limit=None)
+            await first.__anext__()
+            second = stream.read_records(limit=None)
+            await second.__anext__()
+            state = (inspect.getgeneratorstate(first._results),
+                     first._pending is None or first._pending.done())
+            await stream.close()
+            return state
+
+        self.assertEqual(self.loop.run_until_complete(read()), (inspect.GEN_CLOSED, True))
+
+
 class WarcWritingTest(unittest.TestCase):
 
     # XXX should this a part of the library?
@@ -5,6 +5,7 @@ import re
 import hashlib
 from hanzo.warctools.record import ArchiveRecord, ArchiveParser
 from hanzo.warctools.archive_detect import register_record_type
+from hanzo.warctools.filecopy import copy_file
 import uuid
 
 bad_lines = 5 # when to give up looking for the version stamp
@@ -83,49 +84,56 @@ class WarcRecord(ArchiveRecord):
 
             don't write multi line headers
         """
-        out.write(self.version)
-        out.write(nl)
-        for k, v in self.headers:
-            if self.content_file is not None or k not in (self.CONTENT_TYPE, self.CONTENT_LENGTH):
-                out.write(k)
-                out.write(b": ")
-                out.write(v)
-                out.write(nl)
+        header_block, content_buffer = self.header_block(nl)
+        out.write(header_block)
 
-        if self.content_file is not None:
-            out.write(nl) # end of header blank nl
-            while True:
-                buf = self.content_file.read(8192)
-                if buf == b'': break
-                out.write(buf)
-        else:
-            # if content tuple is provided, set Content-Type and
-            # Content-Length based on the values in the tuple
-            content_type, content_buffer = self.content
-
-            if content_type:
-                out.write(self.CONTENT_TYPE)
-                out.write(b": ")
-                out.write(content_type)
-                out.write(nl)
-            if content_buffer is None:
-                content_buffer = b""
-
-            content_length = len(content_buffer)
-            out.write(self.CONTENT_LENGTH)
-            out.write(b": ")
-            out.write(str(content_length).encode('ascii'))
-            out.write(nl)
-
-            out.write(nl) # end of header blank nl
-            if content_buffer:
-                out.write(content_buffer)
+        if content_buffer is None:
+            copy_file(self.content_file, out)
+        elif content_buffer:
+            out.write(content_buffer)
      
         # end of record nl nl
-        out.write(nl)
-        out.write(nl)
+        out.write(nl + nl)
         out.flush()
 
+    def header_block(self, nl=b'\r\n'):
+        """Returns (header_block, content_buffer): a bytearray of the version,
+        headers and blank line that start the record as written, and the
+        content to follow them, or None if it is to be read from
+        content_file."""
+        block = bytearray(self.version)
+        block += nl
+        for k, v in self.headers:
+            if self.content_file is not None or k not in (self.CONTENT_TYPE, self.CONTENT_LENGTH):
+                block += k
+                block += b": "
+                block += v
+                block += nl
+
+        if self.content_file is not None:
+            block += nl # end of header blank nl
+            return block, None
+
+        # if content tuple is provided, set Content-Type and
+        # Content-Length based on the values in the tuple
+        content_type, content_buffer = self.content
+
+        if content_type:
+            block += self.CONTENT_TYPE
+            block += b": "
+            block += content_type
+            block += nl
+        if content_buffer is None:
+            content_buffer = b""
+
+        block += self.CONTENT_LENGTH
+        block += b": "
+        block += str(len(content_buffer)).encode('ascii')
+        block += nl
+
+        block += nl # end of header blank nl
+        return block, content_buffer
+
     def repair(self):
         pass
 
@@ -136,6 +144,14 @@ class WarcRecord(ArchiveRecord):
     def make_parser(self):
         return WarcParser()
 
+    def add_digests(self, algorithm='sha1', spool_size=None):
+        """Set the WARC-Block-Digest and WARC-Payload-Digest headers from the
+        content, reading content_file only once. See digest.add_digests."""
+        from hanzo.warctools import digest
+        if spool_size is None:
+            spool_size = digest.SPOOL_SIZE
+        digest.add_digests(self, algorithm, spool_size)
+
     def block_digest(self, content_buffer):
         block_hash = hashlib.sha256()
         block_hash.update(content_buffer)
@@ -159,11 +175,13 @@ def rx(pat):
 version_rx = rx(br'^(?P<prefix>.*?)(?P<version>\s*WARC/(?P<number>.*?))'
                 b'(?P<nl>\r\n|\r|\n)\\Z')
 # a header is key: <ws> value plus any following lines with leading whitespace
-header_rx = rx(br'^(?P<name>.*?):\s?(?P<value>.*?)' b'(?P<nl>\r\n|\r|\n)\\Z')
+header_rx = rx(br'^(?P<name>.*?):[ \t]?(?P<value>.*?)' b'(?P<nl>\r\n|\r|\n)\\Z')
 value_rx = rx(br'^\s+(?P<value>.+?)' b'(?P<nl>\r\n|\r|\n)\\Z')
 nl_rx = rx(b'^(?P<nl>\r\n|\r|\n\\Z)')
 length_rx = rx(b'^' + WarcRecord.CONTENT_LENGTH + b'$' ) # pylint: disable-msg=E1101
 type_rx = rx(b'^' + WarcRecord.CONTENT_TYPE + b'$')     # pylint: disable-msg=E1101
+length_name = WarcRecord.CONTENT_LENGTH.lower()       # pylint: disable-msg=E1101
+type_name = WarcRecord.CONTENT_TYPE.lower()           # pylint: disable-msg=E1101
 
 required_headers = set((
         WarcRecord.TYPE.lower(),           # pylint: disable-msg=E1101
@@ -176,6 +194,44 @@ required_headers = set((
 class WarcParser(ArchiveParser):
     KNOWN_VERSIONS = set((b'1.0', b'0.17', b'0.18'))
 
+    def read_header_block(self, stream):
+        """Read all the headers of a record at once, if the stream has them
+        buffered, splitting them up without regular expressions. Returns the
+        list of headers, or None, having read nothing, if the block isn't
+        buffered or has anything unusual about it, such as bare newlines,
+        leaving it to be parsed line by line."""
+        peek = getattr(stream, 'peek_header_block', None)
+        block = peek() if peek is not None else None
+        if block is None:
+            return None
+
+        if block.startswith(b'\r\n'):
+            lines = ()
+            size = 2
+        else:
+            lines = block[:-4].split(b'\r\n')
+            size = len(block)
+
+        headers = []
+        for line in lines:
+            if b'\n' in line or b'\r' in line:
+                return None
+            if line[:1].isspace():
+                # a continuation of the last header
+                value = line.strip()
+                if not headers or not value:
+                    return None
+                name, first = headers[-1]
+                headers[-1] = (name, first + b' ' + value)
+                continue
+            name, sep, value = line.partition(b':')
+            if not sep:
+                return None
+            headers.append((name.strip(), value.strip()))
+
+        stream.read(size)
+        return headers
+
     def parse(self, stream, offset, line=None):
         """Reads a warc record from the stream, returns a tuple
         (record, errors).  Either records is null or errors is
@@ -228,8 +284,25 @@ class WarcParser(ArchiveParser):
             if prefix:
                 record.error('bad prefix on WARC version header', prefix)
 
-            #Read headers
-            line = stream.readline()
+            #Read headers, all at once if we can
+            headers = self.read_header_block(stream)
+            if headers is not None:
+                record.headers = headers
+                for name, value in headers:
+                    lname = name.lower()
+                    if lname == type_name:
+                        if value:
+                            content_type = value
+                        else:
+                            record.error('invalid header', name, value)
+                    elif lname == length_name:
+                        try:
+                            content_length = int(value)
+                        except ValueError:
+                            record.error('invalid header', name, value)
+                line = None
+            else:
+                line = stream.readline()
             while line and not nl_rx.match(line):
 
                 #print 'header', repr(line)
@@ -269,6 +342,10 @@ class WarcParser(ArchiveParser):
                             #print content_length
                         except ValueError:
                             record.error('invalid header', name, value)
+                else:
+                    # no colon, or the end of a file cut short
+                    record.error('invalid header line', line)
+                    line = stream.readline()
 
             # have read blank line following headers
 
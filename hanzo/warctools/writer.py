@@ -0,0 +1,408 @@
+"""Write many warc records to a file.
+
+record.write_to(out) makes a write call for each part of a record, and
+flushes out after every record. A WarcWriter puts each record together in
+a buffer instead, and writes the buffer to out when it is full, when
+flush_interval seconds have passed since it was last written, or when
+flush() is called:
+
+    with WarcWriter(open('out.warc.gz', 'wb'), gzip=True) as writer:
+        for record in records:
+            writer.write(record)
+
+With gzip, each record is compressed as a gzip member of its own, as
+write_to(gzip=True) does, by one compress.GzipCompressor, at
+compress_level. A ParallelWarcWriter compresses records in a pool of
+threads instead, writing them out in the order they were given.
+
+write() returns the offset and length of each record in out, counting
+from where out was when the writer was made.
+
+write_raw() copies a record's raw bytes from another file as they are,
+e.g. a gzip member found with RecordStream.raw_length, without inflating
+or deflating anything.
+
+A RollingWarcWriter writes to a series of files instead, starting a new
+one when the last gets too big, with a warcinfo record at the start of
+each and a CDXJ index of it alongside.
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import collections
+import datetime
+import os
+import socket
+import threading
+import time
+
+from hanzo.warctools.cdx import cdxj_line, content_http_head, read_http_head, HTTP_HEAD_SIZE
+from hanzo.warctools.compress import GzipCompressor, COMPRESS_LEVEL
+from hanzo.warctools.filecopy import copy_range, read_range, file_range, MIN_COPY
+from hanzo.warctools.warc import WarcRecord, warc_datetime_str
+
+BUFFER_SIZE = 1 << 20
+CHUNK_SIZE = 65536
+MAX_RECORD_SIZE = 16 << 20 # bigger records are compressed as they're read
+
+
+class WarcWriter(object):
+    """Writes records to out through a buffer of buffer_size bytes. Parts
+    of a record as big as the buffer are written to out directly, and an
+    uncompressed payload read from a local file is copied from it by the
+    kernel when it can be (see filecopy.copy_file). With
+    digests, the name of a hashlib algorithm, each record's digest headers
+    are set as it is written (see WarcRecord.add_digests)."""
+
+    def __init__(self, out, gzip=False, buffer_size=BUFFER_SIZE,
+                 flush_interval=None, newline=b'\r\n', digests=None,
+                 compress_level=COMPRESS_LEVEL):
+        self.out = out
+        if gzip and not isinstance(gzip, GzipCompressor):
+            gzip = GzipCompressor(compress_level)
+        self.gzip = gzip
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.newline = newline
+        self.digests = digests
+        self.compress_level = compress_level
+        try:
+            self.offset = out.tell()
+        except (AttributeError, IOError, OSError):
+            self.offset = 0
+        self._buf = bytearray()
+        self._flushed = time.time()
+
+    def _write(self, data):
+        self.offset += len(data)
+        if len(self._buf) + len(data) > self.buffer_size:
+            self._write_buffer()
+        if len(data) >= self.buffer_size:
+            self.out.write(data)
+        else:
+            self._buf += data
+
+    def _write_buffer(self):
+        if self._buf:
+            self.out.write(self._buf)
+            self._buf = bytearray()
+        self._flushed = time.time()
+
+    def _start(self, record):
+        if record.content_file is not None and not record._content_file_valid:
+            raise Exception('cannot write record because content_file has already been used')
+        if self.digests:
+            record.add_digests(self.digests)
+        return record.header_block(self.newline)
+
+    def write(self, record):
+        """Write a record, which can only be done once if it has a
+        content_file. Returns (offset, length) of the record in out."""
+        header_block, content_buffer = self._start(record)
+        return self._write_record(record, header_block, content_buffer)
+
+    def write_with_head(self, record, size=HTTP_HEAD_SIZE):
+        """Write a record as write() does, returning (offset, length, head),
+        with head the start of its http response, if it holds one, as
+        cdx.read_http_head reads it, taken from the content as it is
+        written."""
+        header_block, content_buffer = self._start(record)
+        if content_buffer is None:
+            head = read_http_head(record, size)
+            offset, length = self._write_record(record, header_block, None, read=head or b'')
+        else:
+            head = content_http_head(record, size)
+            offset, length = self._write_record(record, header_block, content_buffer)
+        return offset, length, head
+
+    def _write_record(self, record, header_block, content_buffer, read=b''):
+        """Write the record, with read being what has already been read from
+        its content_file."""
+        offset = self.offset
+        nl = self.newline
+        compressor = self.gzip or None
+        if compressor is not None:
+            self._write(compressor.start_member())
+            write = lambda data: self._write(compressor.compress(data))
+        else:
+            write = self._write
+
+        write(header_block)
+        if content_buffer is None:
+            if read:
+                write(read)
+            found = None if compressor is not None else file_range(record.content_file)
+            if found is not None and found[2] >= MIN_COPY:
+                # straight from file to file
+                self._write_buffer()
+                copy_range(found[0], found[1], found[2], self.out)
+                self.offset += found[2]
+                record.content_file.seek(0, 2)
+            while True:
+                buf = record.content_file.read(CHUNK_SIZE)
+                if not buf:
+                    break
+                write(buf)
+            record._content_file_used()
+        elif content_buffer:
+            write(content_buffer)
+        write(nl + nl)
+
+        if compressor is not None:
+            self._write(compressor.end_member())
+
+        self._flush_if_due()
+        return offset, self.offset - offset
+
+    def write_raw(self, src, offset, length):
+        """Copy length bytes at offset in src to out verbatim, leaving src
+        where it was. They must be whole records, gzipped if out is.
+        Returns (offset, length) of them in out."""
+        start = self.offset
+        if length < CHUNK_SIZE:
+            data = read_range(src, offset, length)
+            if len(data) < length:
+                raise Exception('expected {} bytes but only read {}'.format(length, len(data)))
+            self._write(data)
+        else:
+            self._write_buffer()
+            copy_range(src, offset, length, self.out)
+            self.offset += length
+        self._flush_if_due()
+        return start, length
+
+    def _flush_if_due(self):
+        if (self.flush_interval is not None
+                and time.time() - self._flushed >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write out anything buffered, and flush out."""
+        self._write_buffer()
+        self.out.flush()
+
+    def close(self):
+        """Flush and close out."""
+        self.flush()
+        self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_local = threading.local()
+
+def compress_member(data, level):
+    """A gzip member of data, compressed by a GzipCompressor kept for each
+    thread (or process)."""
+    compressor = getattr(_local, 'compressor', None)
+    if compressor is None or compressor.level != level:
+        compressor = _local.compressor = GzipCompressor(level)
+    return compressor.compress_member(data)
+
+
+def _read_up_to(fh, size):
+    chunks = []
+    while size > 0:
+        buf = fh.read(min(size, CHUNK_SIZE))
+        if not buf:
+            break
+        chunks.append(buf)
+        size -= len(buf)
+    return b''.join(chunks)
+
+
+class ParallelWarcWriter(WarcWriter):
+    """A gzip WarcWriter that compresses records in a pool of jobs threads,
+    as zlib lets other threads run while it compresses, or processes.
+    Records are still written in order. write() returns a Future of the
+    record's (offset, length), which is set once it has been written.
+
+    A record is read into memory to be handed to the pool, unless it is
+    bigger than max_record_size, when it is compressed as it is read, after
+    the records before it have been written."""
+
+    def __init__(self, out, jobs, threads=True, max_record_size=MAX_RECORD_SIZE,
+                 **kwargs):
+        kwargs['gzip'] = True
+        WarcWriter.__init__(self, out, **kwargs)
+        self.jobs = jobs
+        self.max_record_size = max_record_size
+        if threads:
+            self.executor = ThreadPoolExecutor(jobs)
+        else:
+            self.executor = ProcessPoolExecutor(jobs)
+        self._pending = collections.deque() # (member, result) futures
+
+    def write(self, record):
+        """Write a record, which can only be done once if it has a
+        content_file. Returns a Future of (offset, length) of the record in
+        out."""
+        header_block, content_buffer = self._start(record)
+        result = Future()
+
+        if content_buffer is None:
+            content_buffer = _read_up_to(record.content_file, self.max_record_size + 1)
+            if len(content_buffer) > self.max_record_size:
+                self._write_pending()
+                result.set_result(self._write_record(record, header_block, None,
+                                                     read=content_buffer))
+                return result
+            record._content_file_used()
+
+        data = b''.join((header_block, content_buffer, self.newline, self.newline))
+        member = self.executor.submit(compress_member, data, self.compress_level)
+        self._pending.append((member, result))
+        while len(self._pending) > 2 * self.jobs:
+            self._write_next()
+        return result
+
+    def write_raw(self, src, offset, length):
+        """Copy raw records verbatim, after the records given before them.
+        Returns a Future of (offset, length) of them in out."""
+        self._write_pending()
+        result = Future()
+        result.set_result(WarcWriter.write_raw(self, src, offset, length))
+        return result
+
+    def _write_next(self):
+        member, result = self._pending.popleft()
+        offset = self.offset
+        try:
+            self._write(member.result())
+        except Exception as e:
+            result.set_exception(e)
+            raise
+        result.set_result((offset, self.offset - offset))
+        self._flush_if_due()
+
+    def _write_pending(self):
+        while self._pending:
+            self._write_next()
+
+    def flush(self):
+        """Write out all the records given so far, and flush out."""
+        self._write_pending()
+        WarcWriter.flush(self)
+
+    def close(self):
+        """Flush, close out and stop the pool."""
+        try:
+            WarcWriter.close(self)
+        finally:
+            self.executor.shutdown()
+
+
+def _utcnow():
+    """The time now in UTC, without a tzinfo, as warc_datetime_str wants."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+TEMPLATE = 'WARC-{timestamp}-{serial:05d}-{hostname}.warc.gz'
+MAX_SIZE = 1 << 30
+INDEX_SUFFIX = '.cdxj'
+
+
+class RollingWarcWriter(object):
+    """Writes records to files in directory, named by formatting template
+    with the serial number of the file, a timestamp, the hostname and pid.
+    A new file is started before a record would be written to one already
+    max_size bytes long or holding max_records records.
+
+    Each file starts with a warcinfo record of warcinfo_fields, unless that
+    is None. With index, the CDXJ line of each other record is written to
+    a sidecar file named after the warc file plus INDEX_SUFFIX, as the
+    record is written, in the order written. Other keyword arguments are
+    passed on to each file's WarcWriter."""
+
+    def __init__(self, directory='.', template=TEMPLATE, max_size=MAX_SIZE,
+                 max_records=None, gzip=True, warcinfo_fields=b'software: hanzo.warctools\r\n',
+                 index=True, **kwargs):
+        self.directory = directory
+        self.template = template
+        self.max_size = max_size
+        self.max_records = max_records
+        self.gzip = gzip
+        self.warcinfo_fields = warcinfo_fields
+        self.index = index
+        self.writer_kwargs = kwargs
+        self.serial = 0
+        self.filename = None
+        self.writer = None
+        self.index_file = None
+        self.records = 0
+        self.filenames = []
+
+    def _next_filename(self):
+        now = _utcnow()
+        filename = self.template.format(
+            serial=self.serial,
+            timestamp=now.strftime('%Y%m%d%H%M%S%f')[:17],
+            hostname=socket.gethostname(),
+            pid=os.getpid())
+        self.serial += 1
+        return filename
+
+    def _warcinfo(self):
+        headers = [
+            (WarcRecord.TYPE, WarcRecord.WARCINFO),
+            (WarcRecord.ID, WarcRecord.random_warc_uuid()),
+            (WarcRecord.DATE, warc_datetime_str(_utcnow())),
+            (WarcRecord.FILENAME, self.filename.encode('utf-8')),
+        ]
+        return WarcRecord(headers=headers,
+                          content=(b'application/warc-fields', self.warcinfo_fields))
+
+    def _open(self):
+        self.filename = self._next_filename()
+        path = os.path.join(self.directory, self.filename)
+        self.writer = WarcWriter(open(path, 'wb'), gzip=self.gzip, **self.writer_kwargs)
+        if self.index:
+            self.index_file = open(path + INDEX_SUFFIX, 'wb')
+        self.records = 0
+        self.filenames.append(path)
+        if self.warcinfo_fields is not None:
+            self.writer.write(self._warcinfo())
+
+    def _full(self):
+        return ((self.max_size is not None and self.writer.offset >= self.max_size)
+                or (self.max_records is not None and self.records >= self.max_records))
+
+    def write(self, record):
+        """Write a record, returning the filename it was written to with its
+        offset and length there."""
+        if self.writer is not None and self._full():
+            self.close()
+        if self.writer is None:
+            self._open()
+        if self.index_file is None:
+            offset, length = self.writer.write(record)
+            self.records += 1
+        else:
+            offset, length, head = self.writer.write_with_head(record)
+            self.records += 1
+            self.index_file.write(cdxj_line(record, self.filename, offset, length, head))
+        return self.filename, offset, length
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+            if self.index_file is not None:
+                self.index_file.flush()
+
+    def close(self):
+        """Finish the current file. The next write starts another."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,495 @@
+"""Random access into (w)arcs gzipped as a whole, after examples/zran.c in
+the zlib distribution.
+
+Reaching a record in the middle of a large .warc.gz compressed as one
+stream otherwise means inflating everything before it. Instead, the file is
+inflated once, and every so often, at the boundary of a deflate block, a
+checkpoint is noted: the uncompressed and raw offsets, the number of bits of
+the previous byte already used, and the 32K of output before it that later
+data can refer back to. Inflating can restart from any checkpoint.
+
+Python's zlib module can't restart inflating part way through a byte or say
+where the blocks end, so libz is used directly through ctypes. If it can't
+be loaded, available() is false, and callers fall back to gzip.GzipFile.
+
+The checkpoints are saved in a sidecar next to the archive, named
+<archive>.zran, e.g. foo.warc.gz.zran. They are only made for a file that
+is a single gzip member: a record-gzipped file has offsets of its own, and
+a sidecar would make readers use uncompressed offsets for it instead.
+"""
+
+from collections import namedtuple
+import bisect
+import ctypes
+import ctypes.util
+import os
+import os.path
+import struct
+import zlib
+
+SUFFIX = '.zran'
+MAGIC = b'#warctools zran 2\n'
+
+SPAN = 1 << 20  # uncompressed bytes between checkpoints
+WINDOW_SIZE = 32768
+RAW_CHUNK_SIZE = 65536
+OUT_CHUNK_SIZE = 65536
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+
+Checkpoint = namedtuple('Checkpoint', 'out raw bits window')
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+    ]
+
+
+_libz = None
+
+def _load_libz():
+    global _libz
+    if _libz is not None:
+        return _libz or None
+
+    _libz = False
+    names = [ctypes.util.find_library('z'), 'libz.so.1', 'libz.dylib', 'zlib1.dll']
+    for name in names:
+        if not name:
+            continue
+        try:
+            lib = ctypes.CDLL(name)
+            stream_p = ctypes.POINTER(_ZStream)
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.zlibVersion.argtypes = []
+            lib.inflateInit2_.argtypes = [stream_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [stream_p, ctypes.c_int]
+            lib.inflateEnd.argtypes = [stream_p]
+            lib.inflatePrime.argtypes = [stream_p, ctypes.c_int, ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [stream_p, ctypes.c_char_p, ctypes.c_uint]
+        except (OSError, AttributeError):
+            continue
+        _libz = lib
+        break
+    return _libz or None
+
+
+def available():
+    """True if libz could be loaded, so checkpoints can be used."""
+    return _load_libz() is not None
+
+
+class _Inflater(object):
+    """A libz inflate stream. wbits is as for zlib.decompressobj."""
+
+    def __init__(self, wbits):
+        self.lib = None
+        self.strm = _ZStream()
+        self._in = None  # zlib points into this, so keep hold of it
+        lib = _load_libz()
+        ret = lib.inflateInit2_(ctypes.byref(self.strm), wbits,
+                                lib.zlibVersion(), ctypes.sizeof(_ZStream))
+        if ret == Z_OK:
+            self.lib = lib
+        else:
+            raise zlib.error('inflateInit2 failed (%d)' % ret)
+
+    def feed(self, data):
+        """Set the input; any left from before is dropped."""
+        self._in = ctypes.create_string_buffer(data, len(data))
+        self.strm.next_in = ctypes.addressof(self._in)
+        self.strm.avail_in = len(data)
+
+    @property
+    def avail_in(self):
+        return self.strm.avail_in
+
+    def unused(self):
+        """The input not yet consumed."""
+        if not self.strm.avail_in:
+            return b''
+        return self._in.raw[len(self._in) - self.strm.avail_in:]
+
+    def prime(self, bits, value):
+        self.lib.inflatePrime(ctypes.byref(self.strm), bits, value)
+
+    def set_dictionary(self, window):
+        ret = self.lib.inflateSetDictionary(ctypes.byref(self.strm), window, len(window))
+        if ret != Z_OK:
+            raise zlib.error('inflateSetDictionary failed (%d)' % ret)
+
+    def inflate(self, out, start, size, flush=Z_NO_FLUSH):
+        """Inflate into out[start:start+size]. Returns the zlib return code
+        and the number of bytes written."""
+        self.strm.next_out = ctypes.addressof(out) + start
+        self.strm.avail_out = size
+        ret = self.lib.inflate(ctypes.byref(self.strm), flush)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            msg = self.strm.msg.decode('latin-1') if self.strm.msg else ret
+            raise zlib.error('Error %s while decompressing data' % msg)
+        return ret, size - self.strm.avail_out
+
+    def close(self):
+        if self.lib is not None:
+            self.lib.inflateEnd(ctypes.byref(self.strm))
+            self.lib = None
+
+    def __del__(self):
+        self.close()
+
+
+def _next_member(fileobj, rest, raw):
+    """After the end of a gzip member, skip any padding. rest is the input
+    left over, starting at raw offset raw. Returns the input and raw
+    offset where the next member starts, or None if there isn't one."""
+    while True:
+        stripped = rest.lstrip(b'\x00')
+        raw += len(rest) - len(stripped)
+        if stripped:
+            return stripped, raw
+        rest = fileobj.read(RAW_CHUNK_SIZE)
+        if not rest:
+            return None
+
+
+class NotWholeGzip(Exception):
+    """Raised when checkpoints are asked for of a file that isn't a single
+    gzip member."""
+
+
+class Checkpoints(object):
+    """The checkpoints of a gzipped file, in order of uncompressed offset.
+    size and mtime are those of the file they were made from."""
+
+    def __init__(self, points=(), size=None, span=SPAN, mtime=None):
+        self.points = list(points)
+        self.size = size
+        self.mtime = mtime
+        self.span = span
+        self._outs = [p.out for p in self.points]
+
+    def matches(self, st):
+        """True if the checkpoints were made from a file with os.stat() st."""
+        return self.size == st.st_size and self.mtime == st.st_mtime
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def append(self, point):
+        self.points.append(point)
+        self._outs.append(point.out)
+
+    def before(self, offset):
+        """The last checkpoint at or before uncompressed offset, or None."""
+        i = bisect.bisect_right(self._outs, offset)
+        return self.points[i - 1] if i else None
+
+    def write(self, out):
+        out.write(MAGIC)
+        out.write(struct.pack('<QdQI', self.size or 0, self.mtime or 0.0, self.span,
+                              len(self.points)))
+        for point in self.points:
+            window = zlib.compress(point.window)
+            out.write(struct.pack('<QQBI', point.out, point.raw, point.bits, len(window)))
+            out.write(window)
+
+    def save(self, filename):
+        with open(filename, 'wb') as out:
+            self.write(out)
+
+    @classmethod
+    def read(cls, fh):
+        if fh.readline() != MAGIC:
+            raise Exception('not a checkpoint file')
+        size, mtime, span, count = struct.unpack('<QdQI', fh.read(28))
+        points = []
+        for _ in range(count):
+            out, raw, bits, length = struct.unpack('<QQBI', fh.read(21))
+            points.append(Checkpoint(out, raw, bits, zlib.decompress(fh.read(length))))
+        return cls(points, size, span, mtime)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fh:
+            return cls.read(fh)
+
+
+def build_checkpoints(fileobj, span=SPAN):
+    """Inflate a gzipped file from its start, and return its Checkpoints,
+    about span uncompressed bytes apart. Raises NotWholeGzip if the file
+    isn't a single gzip member, followed by nothing but padding."""
+    fileobj.seek(0)
+    if fileobj.read(2) != b'\x1f\x8b':
+        raise NotWholeGzip('not gzipped')
+    fileobj.seek(0)
+    checkpoints = Checkpoints(span=span)
+    window = ctypes.create_string_buffer(WINDOW_SIZE)
+    wpos = 0
+    out = 0
+    last = None
+    raw = 0  # raw offset of the start of the input fed to inflater
+    inflater = _Inflater(16 + zlib.MAX_WBITS)
+    data = b''
+    try:
+        while True:
+            if not inflater.avail_in:
+                raw += len(data)
+                data = fileobj.read(RAW_CHUNK_SIZE)
+                if not data:
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+                inflater.feed(data)
+            if wpos == WINDOW_SIZE:
+                wpos = 0
+
+            # stop at the end of each block, to see if it is a place to
+            # make a checkpoint
+            ret, produced = inflater.inflate(window, wpos, WINDOW_SIZE - wpos, Z_BLOCK)
+            wpos += produced
+            out += produced
+
+            if ret == Z_STREAM_END:
+                consumed = raw + len(data) - inflater.avail_in
+                inflater.close()
+                if _next_member(fileobj, inflater.unused(), consumed) is not None:
+                    raise NotWholeGzip('more than one gzip member, e.g. gzipped record by record')
+                break
+
+            data_type = inflater.strm.data_type
+            if (data_type & 128 and not data_type & 64
+                    and (last is None or out - last > span)):
+                consumed = raw + len(data) - inflater.avail_in
+                # the window, oldest byte first
+                history = window.raw[wpos:] + window.raw[:wpos]
+                checkpoints.append(Checkpoint(out, consumed, data_type & 7, history))
+                last = out
+    finally:
+        inflater.close()
+
+    fileobj.seek(0, 2)
+    checkpoints.size = fileobj.tell()
+    return checkpoints
+
+
+class CheckpointedGzipFile(object):
+    """A readable file of the uncompressed contents of a gzipped file,
+    which may be made of several members. tell() and seek() are in
+    uncompressed offsets; seek() restarts inflating from the nearest
+    checkpoint before the new position, rather than the start of the
+    file, when that is closer."""
+
+    def __init__(self, fileobj, checkpoints=None):
+        self.fileobj = fileobj
+        self.checkpoints = checkpoints or Checkpoints()
+        self._out = ctypes.create_string_buffer(OUT_CHUNK_SIZE)
+        self._inflater = None
+        self._restart(None)
+
+    def _restart(self, point):
+        """Start inflating again from a checkpoint, or the start of the
+        file if point is None."""
+        if self._inflater is not None:
+            self._inflater.close()
+        self._buf = b''
+        self._bufpos = 0
+        self._eof = False
+        self._raw_mode = point is not None
+
+        if point is None:
+            self.fileobj.seek(0)
+            self._inflater = _Inflater(16 + zlib.MAX_WBITS)
+            self._pos = 0
+            return
+
+        self._inflater = _Inflater(-zlib.MAX_WBITS)
+        if point.bits:
+            self.fileobj.seek(point.raw - 1)
+            byte = bytearray(self.fileobj.read(1))[0]
+            self._inflater.prime(point.bits, byte >> (8 - point.bits))
+        else:
+            self.fileobj.seek(point.raw)
+        self._inflater.set_dictionary(point.window)
+        self._pos = point.out
+
+    def _end_member(self):
+        rest = self._inflater.unused()
+        if self._raw_mode:
+            # restarted in raw deflate, the trailer is still to come
+            while len(rest) < 8:
+                more = self.fileobj.read(RAW_CHUNK_SIZE)
+                if not more:
+                    break
+                rest += more
+            rest = rest[8:]
+        self._inflater.close()
+        found = _next_member(self.fileobj, rest, 0)
+        if found is None:
+            self._eof = True
+            return
+        self._inflater = _Inflater(16 + zlib.MAX_WBITS)
+        self._inflater.feed(found[0])
+        self._raw_mode = False
+
+    def _fill(self):
+        """Inflate more data into the (empty) buffer. Returns False at the
+        end of the file."""
+        while not self._eof:
+            if not self._inflater.avail_in:
+                data = self.fileobj.read(RAW_CHUNK_SIZE)
+                if not data:
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+                self._inflater.feed(data)
+
+            ret, produced = self._inflater.inflate(self._out, 0, OUT_CHUNK_SIZE)
+            if ret == Z_STREAM_END:
+                self._end_member()
+            if produced:
+                self._buf = self._out.raw[:produced]
+                self._bufpos = 0
+                return True
+        return False
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        """Move to an uncompressed offset. Returns the new position, which
+        is short of offset if the file ends before it."""
+        if whence == 1:
+            offset += self._pos
+        elif whence != 0:
+            raise IOError('can only seek from the start or current position')
+
+        # within the buffer
+        buf_start = self._pos - self._bufpos
+        if buf_start <= offset <= buf_start + len(self._buf):
+            self._bufpos = offset - buf_start
+            self._pos = offset
+            return self._pos
+
+        point = self.checkpoints.before(offset)
+        if offset < self._pos:
+            self._restart(point)
+        elif point is not None and point.out > self._pos:
+            self._restart(point)
+        self.skip(offset - self._pos)
+        return self._pos
+
+    def skip(self, count):
+        """Read and discard up to count bytes. Returns how many there
+        were."""
+        skipped = 0
+        while skipped < count:
+            if self._bufpos >= len(self._buf) and not self._fill():
+                break
+            n = min(count - skipped, len(self._buf) - self._bufpos)
+            self._bufpos += n
+            self._pos += n
+            skipped += n
+        return skipped
+
+    def read(self, size=-1):
+        chunks = []
+        while size is None or size < 0 or size > 0:
+            if self._bufpos >= len(self._buf) and not self._fill():
+                break
+            end = len(self._buf)
+            if size is not None and size >= 0:
+                end = min(end, self._bufpos + size)
+                size -= end - self._bufpos
+            chunks.append(self._buf[self._bufpos:end])
+            self._pos += end - self._bufpos
+            self._bufpos = end
+        return b''.join(chunks)
+
+    def peek_to(self, delim, limit):
+        """See GzipMemberFile.peek_to"""
+        if self._bufpos >= len(self._buf) and not self._fill():
+            return None
+        end = self._buf.find(delim, self._bufpos, self._bufpos + limit)
+        if end < 0:
+            return None
+        return self._buf[self._bufpos:end + len(delim)]
+
+    def readline(self, size=-1):
+        chunks = []
+        while size is None or size < 0 or size > 0:
+            if self._bufpos >= len(self._buf) and not self._fill():
+                break
+            end = self._buf.find(b'\n', self._bufpos)
+            end = len(self._buf) if end < 0 else end + 1
+            if size is not None and size >= 0:
+                end = min(end, self._bufpos + size)
+                size -= end - self._bufpos
+            chunks.append(self._buf[self._bufpos:end])
+            self._pos += end - self._bufpos
+            done = self._buf[end - 1:end] == b'\n'
+            self._bufpos = end
+            if done:
+                break
+        return b''.join(chunks)
+
+    def close(self):
+        if self._inflater is not None:
+            self._inflater.close()
+        self.fileobj.close()
+
+
+def checkpoint_filename(filename):
+    """The name of the checkpoint sidecar for an archive."""
+    return filename + SUFFIX
+
+
+def write_checkpoints(filename, span=SPAN):
+    """Build the checkpoints for a file gzipped as a whole and save them as
+    its sidecar. Raises NotWholeGzip, writing nothing, for any other file."""
+    with open(filename, 'rb') as fh:
+        st = os.fstat(fh.fileno())
+        try:
+            checkpoints = build_checkpoints(fh, span)
+        except NotWholeGzip as e:
+            raise NotWholeGzip('%s: %s' % (filename, e))
+    checkpoints.size, checkpoints.mtime = st.st_size, st.st_mtime
+    checkpoints.save(checkpoint_filename(filename))
+    return checkpoints
+
+
+def load_checkpoints(filename):
+    """The checkpoints from the sidecar of a gzipped file, or None if it
+    doesn't have one, or has one that was made from a different version of
+    the file, or is of an older version itself."""
+    name = checkpoint_filename(filename)
+    if not os.path.exists(name):
+        return None
+    with open(name, 'rb') as fh:
+        if fh.readline() != MAGIC:
+            return None
+        fh.seek(0)
+        checkpoints = Checkpoints.read(fh)
+    if not checkpoints.matches(os.stat(filename)):
+        return None
+    return checkpoints
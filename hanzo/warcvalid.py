@@ -9,17 +9,46 @@ import sys
 import sys
 import os.path
 
+from concurrent.futures import ProcessPoolExecutor
 from optparse import OptionParser
 
 from .warctools import WarcRecord, expand_files
+from .warctools.digest import check_digests
 
 parser = OptionParser(usage="%prog [options] warc warc warc")
 
 parser.add_option("-l", "--limit", dest="limit")
 parser.add_option("-I", "--input", dest="input_format")
 parser.add_option("-L", "--log-level", dest="log_level")
+parser.add_option("-D", "--digests", dest="digests", action="store_true",
+                  help="check WARC-Block-Digest and WARC-Payload-Digest headers")
+parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                  help="check this many files at once, in separate processes")
 
-parser.set_defaults(output_directory=None, limit=None, log_level="info")
+parser.set_defaults(output_directory=None, limit=None, log_level="info", digests=False, jobs=1)
+
+def validate_file(name, digests=False):
+    """Check one archive, returning a list of messages about the first
+    problem found in it, or an empty list if it is ok."""
+    fh = None
+    try:
+        fh = WarcRecord.open_archive(name, gzip="auto")
+
+        for (offset, record, errors) in fh.read_records(limit=None):
+            if errors:
+                return ["warc errors at %s:%d"%(name, offset), str(errors)]
+            elif record is not None and record.validate(): # ugh name, returns errorsa
+                return ["warc errors at %s:%d"%(name, offset), str(record.validate())]
+            elif record is not None and digests:
+                errors = check_digests(record)
+                if errors:
+                    return ["digest errors at %s:%d"%(name, offset), str(errors)]
+
+    except Exception as e:
+        return ["Exception: %s"%(str(e))]
+    finally:
+        if fh: fh.close()
+    return []
 
 def main(argv):
     (options, input_files) = parser.parse_args(args=argv[1:])
@@ -30,30 +59,22 @@ def main(argv):
         
 
     correct=True
-    fh=None
-    try:
-        for name in expand_files(input_files):
-            fh = WarcRecord.open_archive(name, gzip="auto")
-
-            for (offset, record, errors) in fh.read_records(limit=None):
-                if errors:
-                    print("warc errors at %s:%d"%(name, offset), file=sys.stderr)
-                    print(errors, file=sys.stderr)
-                    correct=False
-
-                    break
-                elif record is not None and record.validate(): # ugh name, returns errorsa
-                    print("warc errors at %s:%d"%(name, offset), file=sys.stderr)
-                    print(record.validate(), file=sys.stderr)
-                    correct=False
-                    break
-                
+    names = list(expand_files(input_files))
+    executor = None
+    if options.jobs > 1:
+        executor = ProcessPoolExecutor(options.jobs)
+        results = executor.map(validate_file, names, [options.digests] * len(names))
+    else:
+        results = (validate_file(name, options.digests) for name in names)
 
-    except Exception as e:
-        print("Exception: %s"%(str(e)), file=sys.stderr)
-        correct=False
+    try:
+        for messages in results:
+            for message in messages:
+                print(message, file=sys.stderr)
+            if messages:
+                correct=False
     finally:
-        if fh: fh.close()
+        if executor: executor.shutdown()
     
     if correct:
         return 0
@@ -67,5 +88,3 @@ def run():
 
 if __name__ == '__main__':  
     run()
-
-